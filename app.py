@@ -1,5 +1,4 @@
 import os
-import logging
 import secrets
 import eventlet
 
@@ -11,9 +10,6 @@ from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_session import Session
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-
 # Create a declarative base for SQLAlchemy models
 class Base(DeclarativeBase):
     pass
@@ -27,11 +23,34 @@ sess = Session()
 
 # Create the Flask application
 app = Flask(__name__)
+
+# Configure logging. Records are written as JSON lines (LOG_FORMAT=text for
+# plain lines) by a background thread (see log_pipeline.py); LOG_LEVELS sets
+# per-module levels, e.g. "chat=DEBUG,engineio=WARNING".
+app.config['LOG_LEVEL'] = os.environ.get("LOG_LEVEL", "INFO")
+app.config['LOG_LEVELS'] = os.environ.get("LOG_LEVELS", "")
+app.config['LOG_FORMAT'] = os.environ.get("LOG_FORMAT", "json")
+app.config['LOG_FILE'] = os.environ.get("LOG_FILE")
+# Records waiting for the writer; further records are dropped and counted
+app.config['LOG_QUEUE_SIZE'] = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# Below WARNING, each message passes LOG_SAMPLE_BURST times a second and then
+# one in LOG_SAMPLE_EVERY; 1 disables sampling
+app.config['LOG_SAMPLE_BURST'] = int(os.environ.get("LOG_SAMPLE_BURST", 20))
+app.config['LOG_SAMPLE_EVERY'] = int(os.environ.get("LOG_SAMPLE_EVERY", 100))
+
+from log_pipeline import configure_logging
+configure_logging(app.config)
+
 # Generate a secure secret key if one isn't set in the environment
 app.secret_key = os.environ.get("SESSION_SECRET", secrets.token_hex(16))
 
-# Flask session configuration
-app.config['SESSION_TYPE'] = 'filesystem'
+# Flask session configuration. 'sqlite' is the built-in store (see
+# session_store.py); other values are passed to Flask-Session.
+app.config['SESSION_TYPE'] = os.environ.get("SESSION_TYPE", "sqlite")
+# Expired sessions are deleted every SESSION_SWEEP_INTERVAL seconds
+app.config['SESSION_SWEEP_INTERVAL'] = float(os.environ.get("SESSION_SWEEP_INTERVAL", 300))
+# File of the 'sqlite' store; defaults to instance/sessions.db
+app.config['SESSION_SQLITE_PATH'] = os.environ.get("SESSION_SQLITE_PATH")
 app.config['SESSION_PERMANENT'] = True
 app.config['SESSION_USE_SIGNER'] = True
 app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
@@ -43,20 +62,122 @@ app.config['WTF_CSRF_ENABLED'] = True
 app.config['WTF_CSRF_SECRET_KEY'] = app.secret_key
 app.config['WTF_CSRF_SSL_STRICT'] = False  # More permissive during development
 
-# Configure the database - use SQLite for development
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///chat.db"
+# Read receipts are coalesced and written at most once per interval (seconds)
+app.config['READ_RECEIPT_FLUSH_INTERVAL'] = float(os.environ.get("READ_RECEIPT_FLUSH_INTERVAL", 0.5))
+
+# Number of groups whose member lists are kept in memory, and for how many seconds
+app.config['MEMBERSHIP_CACHE_SIZE'] = int(os.environ.get("MEMBERSHIP_CACHE_SIZE", 10000))
+app.config['MEMBERSHIP_CACHE_TTL'] = float(os.environ.get("MEMBERSHIP_CACHE_TTL", 60))
+
+# Background workers delivering new messages; 0 delivers inline
+app.config['FANOUT_WORKERS'] = int(os.environ.get("FANOUT_WORKERS", 4))
+
+# Group commit for incoming messages: up to INGEST_BATCH_SIZE messages arriving
+# within INGEST_FLUSH_INTERVAL milliseconds share one transaction; 1 disables it
+app.config['INGEST_BATCH_SIZE'] = int(os.environ.get("INGEST_BATCH_SIZE", 256))
+app.config['INGEST_FLUSH_INTERVAL'] = float(os.environ.get("INGEST_FLUSH_INTERVAL", 2))
+
+# Message search ranks at most this many of the newest matches
+app.config['SEARCH_CANDIDATES'] = int(os.environ.get("SEARCH_CANDIDATES", 2000))
+
+# Events sent to user rooms are numbered per user and the last
+# EVENT_LOG_SIZE of each user are stored, so reconnecting clients replay
+# what they missed instead of reloading (see events.py). A single worker
+# also keeps the last EVENT_LOG_MEMORY per user in memory.
+app.config['EVENT_LOG_SIZE'] = int(os.environ.get("EVENT_LOG_SIZE", 1000))
+app.config['EVENT_LOG_MEMORY'] = int(os.environ.get("EVENT_LOG_MEMORY", 100))
+
+# `flask archive run` moves messages older than ARCHIVE_AFTER_DAYS into
+# compressed segment files under ARCHIVE_DIR, ARCHIVE_BATCH_SIZE rows per
+# transaction (see archive.py). Every worker must see the same ARCHIVE_DIR.
+app.config['ARCHIVE_DIR'] = os.environ.get("ARCHIVE_DIR", os.path.join(app.instance_path, 'archive'))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get("ARCHIVE_AFTER_DAYS", 90))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get("ARCHIVE_BATCH_SIZE", 5000))
+
+# Presence: changes are published every PRESENCE_FLUSH_INTERVAL seconds, a user
+# goes offline PRESENCE_GRACE_PERIOD seconds after their last tab disconnects,
+# and connections without a heartbeat for PRESENCE_TIMEOUT seconds are dropped
+app.config['PRESENCE_FLUSH_INTERVAL'] = float(os.environ.get("PRESENCE_FLUSH_INTERVAL", 1.0))
+app.config['PRESENCE_GRACE_PERIOD'] = float(os.environ.get("PRESENCE_GRACE_PERIOD", 5))
+app.config['PRESENCE_TIMEOUT'] = float(os.environ.get("PRESENCE_TIMEOUT", 60))
+
+# Logged-in users are cached per process for IDENTITY_CACHE_TTL seconds
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get("IDENTITY_CACHE_TTL", 60))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get("IDENTITY_CACHE_SIZE", 10000))
+
+# Request and Socket.IO event metrics in Prometheus format at /metrics
+# (see metrics.py). Off by default; when on, scrapers must send
+# METRICS_TOKEN as a bearer token, or connect from localhost if it is unset.
+app.config['METRICS_ENABLED'] = os.environ.get("METRICS_ENABLED", "0") == "1"
+app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
+
+# JSON encoding for HTTP responses and Socket.IO packets: 'orjson' (if
+# installed) or 'default' for Flask's standard provider
+app.config['JSON_PROVIDER'] = os.environ.get("JSON_PROVIDER", "orjson")
+# Text responses of at least COMPRESS_MIN_SIZE bytes are sent with brotli
+# (if installed) or gzip, whichever the client prefers. Brotli quality 5
+# matches gzip level 6 on size for about 25% less CPU.
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+# Pages load the fingerprinted bundles from `flask assets build` when they
+# exist (see assets.py); set to 0 to load the source files while editing them
+app.config['ASSETS_USE_BUILD'] = os.environ.get("ASSETS_USE_BUILD", "1") == "1"
+# Hand file downloads to a front proxy that understands X-Sendfile instead
+# of sending them from the worker
+app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE", "0") == "1"
+
+# Configure the database - SQLite for development, PostgreSQL in production.
+# The profile is picked from the URL scheme (see storage.py).
+app.config['DATABASE_URL'] = os.environ.get("DATABASE_URL", "sqlite:///chat.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# SQLite profile: lock wait (ms), memory-mapped I/O (bytes), read-only connections
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+app.config['SQLITE_READER_POOL_SIZE'] = int(os.environ.get("SQLITE_READER_POOL_SIZE", 8))
+# PostgreSQL profile: pool sizing, pool wait (s) and statement timeout (ms)
+app.config['DB_POOL_SIZE'] = int(os.environ.get("DB_POOL_SIZE", 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get("DB_POOL_TIMEOUT", 10))
+app.config['DB_STATEMENT_TIMEOUT'] = int(os.environ.get("DB_STATEMENT_TIMEOUT", 5000))
+
+# Clustering: with a message queue (e.g. redis://localhost:6379/0) Socket.IO
+# emits from any worker, including REST handlers and background tasks, reach
+# clients on every worker, and cache invalidations are shared (see cluster.py).
+# Workers must share SESSION_SECRET and a session store.
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get("SOCKETIO_MESSAGE_QUEUE")
+app.config['SOCKETIO_CHANNEL'] = os.environ.get("SOCKETIO_CHANNEL", "wequack")
+if app.config['SOCKETIO_MESSAGE_QUEUE'] and "SESSION_SECRET" not in os.environ:
+    raise RuntimeError("SESSION_SECRET must be set when SOCKETIO_MESSAGE_QUEUE is used")
+
+from storage import configure_storage, init_storage
+configure_storage(app)
 
 # Initialize extensions with the app
 db.init_app(app)
-socketio.init_app(app, cors_allowed_origins="*", manage_session=False)
+init_storage(app)
+from fast_json import init_json
+socketio.init_app(
+    app,
+    cors_allowed_origins="*",
+    manage_session=False,
+    message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'],
+    channel=app.config['SOCKETIO_CHANNEL'],
+    json=init_json(app)
+)
 login_manager.init_app(app)
 csrf.init_app(app)
-sess.init_app(app)
+from session_store import init_session_store
+init_session_store(app, sess)
 login_manager.login_view = 'auth.login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
 
+from compression import init_compression
+init_compression(app)
+from assets import init_assets
+init_assets(app)
+
 # Register blueprints
 from auth import auth_bp
 from chat import chat_bp
@@ -66,14 +187,27 @@ app.register_blueprint(auth_bp)
 app.register_blueprint(chat_bp)
 app.register_blueprint(download_bp)
 
+from search import search_cli
+app.cli.add_command(search_cli)
+from archive import archive_cli
+app.cli.add_command(archive_cli)
+
+# Instrument the routes and Socket.IO handlers registered above
+if app.config['METRICS_ENABLED']:
+    from metrics import init_metrics
+    init_metrics(app, socketio)
+
 # Create database tables
 with app.app_context():
     import models
+    from migrations import run_migrations
     db.create_all()
+    run_migrations(db)
 
-# Configure the login manager
-from models import User
+# Configure the login manager. current_user is a cached, detached snapshot
+# (see identity.py), so loading it usually costs no query.
+from identity import identity_cache
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity_cache.get(int(user_id))
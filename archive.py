@@ -0,0 +1,264 @@
+from flask.cli import AppGroup
+from sqlalchemy import select, delete, insert, tuple_, text, bindparam, DateTime
+from app import app, db
+from models import User, Message, ArchiveSegment
+from search import search_available
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import groupby
+import click
+import gzip
+import json
+import os
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Old messages move out of the message table into compressed NDJSON files,
+# one or more per group and month, under ARCHIVE_DIR. Each file is a run of
+# gzip members of BLOCK_SIZE messages, so a read seeks to one member through
+# the segment's sparse index and decompresses only that block.
+#
+# Messages are archived from the oldest up, in (timestamp, id) order, and
+# the newest message of every group always stays in the table for the
+# conversation list. Everything archived of a group therefore sorts before
+# everything still in the table, and history pages continue into the
+# archive where the table ends. Archived messages stay searchable through
+# the archive_fts index, which they move to in the same transaction.
+
+BLOCK_SIZE = 256
+
+# Keeps IN lists well below the bound parameter limits of SQLite
+CHUNK_SIZE = 400
+
+_INDEX_ARCHIVED = text(
+    "INSERT INTO archive_fts (rowid, content, group_id, sender_id, timestamp)"
+    " VALUES (:id, :content, :group_id, :sender_id, :timestamp)"
+).bindparams(bindparam('timestamp', type_=DateTime))
+
+# Shaped like the rows of the history query
+ArchivedMessage = namedtuple('ArchivedMessage', 'id content sender_id timestamp username')
+
+def _encode(rows):
+    """Segment file contents and sparse index for rows in (timestamp, id) order"""
+    data, blocks = bytearray(), []
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = rows[start:start + BLOCK_SIZE]
+        lines = ''.join(json.dumps({
+            'id': row.id,
+            'sender_id': row.sender_id,
+            'timestamp': row.timestamp.isoformat(),
+            'content': row.content
+        }, ensure_ascii=False) + '\n' for row in block)
+        member = gzip.compress(lines.encode('utf-8'), mtime=0)
+        ids = [row.id for row in block]
+        blocks.append([len(data), len(member), block[0].timestamp.isoformat(), block[0].id, min(ids), max(ids)])
+        data += member
+    return bytes(data), blocks
+
+def _write_segment(group_id, rows):
+    data, blocks = _encode(rows)
+    relative = f"{group_id}/{rows[0].timestamp:%Y-%m}/{rows[0].id}-{rows[-1].id}.ndjson.gz"
+    path = os.path.join(app.config['ARCHIVE_DIR'], relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+    # The file is in place before its rows are deleted; if the transaction
+    # fails the file goes and the rows stay
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(ArchiveSegment), {
+                'group_id': group_id,
+                'path': relative,
+                'first_timestamp': rows[0].timestamp,
+                'first_message_id': rows[0].id,
+                'last_timestamp': rows[-1].timestamp,
+                'last_message_id': rows[-1].id,
+                'min_message_id': min(row.id for row in rows),
+                'max_message_id': max(row.id for row in rows),
+                'message_count': len(rows),
+                'blocks': json.dumps(blocks),
+                'created_at': datetime.utcnow()
+            })
+            # Deleting the rows drops them from message_fts
+            if search_available():
+                _index_archived(conn, group_id, rows)
+            ids = [row.id for row in rows]
+            for start in range(0, len(ids), CHUNK_SIZE):
+                conn.execute(delete(Message.__table__).where(Message.id.in_(ids[start:start + CHUNK_SIZE])))
+    except Exception:
+        os.remove(path)
+        raise
+
+def _index_archived(conn, group_id, messages):
+    conn.execute(_INDEX_ARCHIVED, [{
+        'id': message.id,
+        'content': message.content,
+        'group_id': group_id,
+        'sender_id': message.sender_id,
+        'timestamp': message.timestamp
+    } for message in messages])
+
+def archive_group(group_id, cutoff, batch_size):
+    """Archive a group's messages older than cutoff; returns how many moved"""
+    moved = 0
+    with db.engine.connect() as conn:
+        newest = conn.execute(
+            select(Message.timestamp, Message.id).where(Message.group_id == group_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc()).limit(1)
+        ).first()
+    if newest is None:
+        return 0
+
+    while True:
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(Message.id, Message.content, Message.sender_id, Message.timestamp).where(
+                    Message.group_id == group_id,
+                    Message.timestamp < cutoff,
+                    tuple_(Message.timestamp, Message.id) < tuple_(newest.timestamp, newest.id)
+                ).order_by(Message.timestamp, Message.id).limit(batch_size)
+            ).all()
+        for _, month in groupby(rows, key=lambda row: (row.timestamp.year, row.timestamp.month)):
+            _write_segment(group_id, list(month))
+        moved += len(rows)
+        if len(rows) < batch_size:
+            return moved
+
+def archive_messages(older_than, batch_size):
+    """Move every message older than the given timedelta into the archive"""
+    cutoff = datetime.utcnow() - older_than
+    with db.engine.connect() as conn:
+        group_ids = conn.execute(
+            select(Message.group_id).distinct().where(Message.timestamp < cutoff)
+        ).scalars().all()
+    moved = 0
+    for group_id in group_ids:
+        moved += archive_group(group_id, cutoff, batch_size)
+    return moved
+
+@lru_cache(maxsize=256)
+def _read_block(path, offset, length):
+    # Segment files never change once written, so blocks are cached by position
+    with open(os.path.join(app.config['ARCHIVE_DIR'], path), 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    messages = []
+    for line in gzip.decompress(data).splitlines():
+        record = json.loads(line)
+        messages.append(ArchivedMessage(record['id'], record['content'], record['sender_id'],
+                                        datetime.fromisoformat(record['timestamp']), None))
+    return tuple(messages)
+
+def _position(message):
+    return (message.timestamp, message.id)
+
+def _block_position(block):
+    return (datetime.fromisoformat(block[2]), block[3])
+
+def _with_usernames(conn, messages):
+    sender_ids = list({message.sender_id for message in messages})
+    usernames = {}
+    for start in range(0, len(sender_ids), CHUNK_SIZE):
+        usernames.update(conn.execute(
+            select(User.id, User.username).where(User.id.in_(sender_ids[start:start + CHUNK_SIZE]))
+        ).all())
+    return [message._replace(username=usernames.get(message.sender_id)) for message in messages]
+
+def read_archived_before(conn, group_id, position, count):
+    """Up to count archived messages before position, newest first.
+
+    position is a (timestamp, id) pair, or None to start from the newest
+    archived message.
+    """
+    query = select(ArchiveSegment.path, ArchiveSegment.blocks).where(ArchiveSegment.group_id == group_id)
+    if position is not None:
+        query = query.where(tuple_(ArchiveSegment.first_timestamp, ArchiveSegment.first_message_id) < tuple_(*position))
+    segments = conn.execute(query.order_by(
+        ArchiveSegment.last_timestamp.desc(), ArchiveSegment.last_message_id.desc()
+    ))
+
+    messages = []
+    for segment in segments:
+        for block in reversed(json.loads(segment.blocks)):
+            if position is not None and _block_position(block) >= position:
+                continue
+            for message in reversed(_read_block(segment.path, block[0], block[1])):
+                if position is None or _position(message) < position:
+                    messages.append(message)
+                    if len(messages) == count:
+                        return _with_usernames(conn, messages)
+    return _with_usernames(conn, messages)
+
+def read_archived_after(conn, group_id, position, count):
+    """Up to count archived messages after position, oldest first"""
+    segments = conn.execute(
+        select(ArchiveSegment.path, ArchiveSegment.blocks).where(
+            ArchiveSegment.group_id == group_id,
+            tuple_(ArchiveSegment.last_timestamp, ArchiveSegment.last_message_id) > tuple_(*position)
+        ).order_by(ArchiveSegment.last_timestamp, ArchiveSegment.last_message_id)
+    )
+
+    messages = []
+    for segment in segments:
+        blocks = json.loads(segment.blocks)
+        for index, block in enumerate(blocks):
+            # Skip blocks that end before the position
+            if index + 1 < len(blocks) and _block_position(blocks[index + 1]) <= position:
+                continue
+            for message in _read_block(segment.path, block[0], block[1]):
+                if _position(message) > position:
+                    messages.append(message)
+                    if len(messages) == count:
+                        return _with_usernames(conn, messages)
+    return _with_usernames(conn, messages)
+
+def reindex_archive():
+    """Rebuild archive_fts from the segment files; returns the messages indexed"""
+    indexed = 0
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM archive_fts"))
+        segments = conn.execute(select(ArchiveSegment.group_id, ArchiveSegment.path, ArchiveSegment.blocks)).all()
+        for segment in segments:
+            for offset, length, *_ in json.loads(segment.blocks):
+                messages = _read_block(segment.path, offset, length)
+                _index_archived(conn, segment.group_id, messages)
+                indexed += len(messages)
+    return indexed
+
+def find_archived_message(conn, group_id, message_id):
+    """An archived message of a group by id, or None"""
+    segments = conn.execute(
+        select(ArchiveSegment.path, ArchiveSegment.blocks).where(
+            ArchiveSegment.group_id == group_id,
+            ArchiveSegment.min_message_id <= message_id,
+            ArchiveSegment.max_message_id >= message_id
+        )
+    ).all()
+    for segment in segments:
+        for offset, length, _, _, low, high in json.loads(segment.blocks):
+            if low <= message_id <= high:
+                for message in _read_block(segment.path, offset, length):
+                    if message.id == message_id:
+                        return _with_usernames(conn, [message])[0]
+    return None
+
+# flask --app main archive ...
+archive_cli = AppGroup('archive', help='Move old messages into the archive.')
+
+@archive_cli.command('run')
+@click.option('--days', type=int, default=None,
+              help='Archive messages older than this many days (default ARCHIVE_AFTER_DAYS).')
+def run_command(days):
+    """Archive the messages older than the retention age."""
+    days = app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    started = time.monotonic()
+    moved = archive_messages(timedelta(days=days), app.config['ARCHIVE_BATCH_SIZE'])
+    click.echo(f"Archived {moved} messages older than {days} days in {time.monotonic() - started:.1f}s")
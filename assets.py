@@ -0,0 +1,213 @@
+from flask import Blueprint, current_app, request, send_from_directory, url_for, abort
+from flask.cli import AppGroup
+import click
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+# Bundles built from the files under static/, in load order. Scripts are
+# concatenated into one file, so their top-level declarations still share a
+# scope as they did as separate classic scripts.
+BUNDLES = {
+    'chat.js': ['js/socket.js', 'js/chat.js', 'js/ui.js'],
+    'style.css': ['css/style.css']
+}
+
+# Built files live under static/dist and are served from /assets
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Fingerprinted names never change content, so clients may keep them for a year
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Precompressed variants, in order of preference
+_VARIANTS = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_IMPORT = re.compile(r"""@import\s+url\(\s*['"]?([^'")]+)['"]?\s*\)\s*;""")
+_CSS_URL = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)""")
+
+def _is_relative(url):
+    return not re.match(r'^([a-z][a-z0-9+.-]*:|/|#)', url, re.I)
+
+def _read_css(static_folder, path, seen):
+    """Inline relative @imports and point relative url()s at /static.
+
+    The bundle is served from another directory, so relative references
+    would no longer resolve.
+    """
+    seen.add(path)
+    with open(os.path.join(static_folder, path), encoding='utf-8') as f:
+        css = f.read()
+    directory = posixpath.dirname(path)
+
+    def inline(match):
+        url = match.group(1)
+        target = posixpath.normpath(posixpath.join(directory, url)) if _is_relative(url) else url
+        if target in seen:
+            # Imported once already
+            return ''
+        if not _is_relative(url):
+            seen.add(target)
+            return match.group(0)
+        return _read_css(static_folder, target, seen)
+
+    def rebase(match):
+        if not _is_relative(match.group(1)):
+            return match.group(0)
+        return f"url('/static/{posixpath.normpath(posixpath.join(directory, match.group(1)))}')"
+
+    return _CSS_URL.sub(rebase, _CSS_IMPORT.sub(inline, css))
+
+def _bundle(static_folder, name, sources):
+    if name.endswith('.css'):
+        seen = set()
+        content = '\n'.join(_read_css(static_folder, source, seen) for source in sources)
+        return rcssmin.cssmin(content) if rcssmin is not None else content
+    parts = []
+    for source in sources:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+            parts.append(f.read())
+    # A file ending without a semicolon must not run into the next one
+    content = ';\n'.join(parts)
+    return rjsmin.jsmin(content) if rjsmin is not None else content
+
+def _write(path, data):
+    # Written aside and renamed, so a running server never serves half a file
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def build_assets(static_folder):
+    """Build every bundle into static/dist and write the manifest.
+
+    Each bundle is named after a hash of its content and written along
+    with .gz and .br variants. Files of the previous build are kept, so
+    pages rendered before a deploy can still load them; older ones are
+    removed. Returns the new manifest.
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    previous = _read_manifest(os.path.join(dist, MANIFEST)) or {}
+
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        data = _bundle(static_folder, name, sources).encode('utf-8')
+        stem, ext = os.path.splitext(name)
+        filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        path = os.path.join(dist, filename)
+        _write(path, data)
+        # mtime=0 keeps the .gz bytes identical between builds
+        _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + '.br', brotli.compress(data, quality=11))
+        manifest[name] = filename
+
+    keep = set(manifest.values()) | set(previous.values())
+    for filename in os.listdir(dist):
+        base = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+        if filename != MANIFEST and base not in keep:
+            os.remove(os.path.join(dist, filename))
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+def _read_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class AssetManifest:
+    """The manifest of the last build, reloaded when a new build replaces it"""
+
+    def __init__(self, static_folder):
+        self.path = os.path.join(static_folder, DIST_DIR, MANIFEST)
+        self._mtime = None
+        self._entries = {}
+
+    def get(self, name):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._entries = (_read_manifest(self.path) or {}) if mtime is not None else {}
+            self._mtime = mtime
+        return self._entries.get(name)
+
+assets_bp = Blueprint('assets', __name__)
+
+@assets_bp.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Serve a built file, precompressed if the client accepts it"""
+    if filename == MANIFEST:
+        abort(404)
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    variants = {encoding: filename + suffix for encoding, suffix in _VARIANTS
+                if os.path.isfile(os.path.join(dist, filename + suffix))}
+    encoding = request.accept_encodings.best_match(list(variants)) if variants else None
+
+    if encoding is None:
+        response = send_from_directory(dist, filename)
+    else:
+        response = send_from_directory(dist, variants[encoding], mimetype=_mimetype(filename))
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+def _mimetype(filename):
+    return 'text/css' if filename.endswith('.css') else 'text/javascript'
+
+def init_assets(app):
+    """Serve built bundles and give templates asset_urls().
+
+    asset_urls(name) lists the URLs to load for a bundle: the fingerprinted
+    file if the bundle has been built, otherwise its source files, so a
+    checkout works without a build step.
+    """
+    manifest = AssetManifest(app.static_folder)
+    app.register_blueprint(assets_bp)
+    app.cli.add_command(assets_cli)
+
+    def asset_urls(name):
+        filename = manifest.get(name) if app.config['ASSETS_USE_BUILD'] else None
+        if filename is None:
+            return [url_for('static', filename=source) for source in BUNDLES[name]]
+        return [url_for('assets.serve_asset', filename=filename)]
+
+    @app.context_processor
+    def _asset_helpers():
+        return {'asset_urls': asset_urls}
+
+# flask --app main assets build
+assets_cli = AppGroup('assets', help='Build the static asset bundles.')
+
+@assets_cli.command('build')
+def build_command():
+    """Bundle, minify, fingerprint and precompress static/ into static/dist."""
+    manifest = build_assets(current_app.static_folder)
+    if rjsmin is None or rcssmin is None:
+        click.echo('rjsmin/rcssmin are not installed; bundles are not minified')
+    if brotli is None:
+        click.echo('brotli is not installed; only .gz variants were written')
+    for name, filename in sorted(manifest.items()):
+        click.echo(f"{name} -> {DIST_DIR}/{filename}")
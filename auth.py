@@ -3,6 +3,8 @@ from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
 from app import db, csrf
 from models import User
+from identity import identity_cache
+from versions import bump_versions
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, EmailField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
@@ -51,21 +53,21 @@ def index():
 @auth_bp.route('/login', methods=['GET', 'POST'])
 @csrf.exempt
 def login():
-    logger.info("Login route accessed")
+    logger.debug("Login route accessed")
     
     if current_user.is_authenticated:
-        logger.info(f"User already authenticated: {current_user.username}")
+        logger.debug("User already authenticated: %s", current_user.username)
         return redirect(url_for('chat.chat_page'))
     
     form = LoginForm()
-    logger.info(f"Request method: {request.method}")
+    logger.debug("Request method: %s", request.method)
     
     if form.validate_on_submit():
-        logger.info(f"Form validated, attempting login for: {form.username.data}")
+        logger.debug("Form validated, attempting login for: %s", form.username.data)
         user = User.query.filter_by(username=form.username.data).first()
         
         if user and user.check_password(form.password.data):
-            logger.info(f"Login successful for: {user.username}")
+            logger.info("Login successful for: %s", user.username, extra={'user_id': user.id})
             
             # Create a fresh session
             if 'user_id' in session:
@@ -73,20 +75,18 @@ def login():
                 
             login_user(user)
             session['user_id'] = user.id
-            user.status = 'online'
-            db.session.commit()
             
             next_page = request.args.get('next')
             redirect_url = next_page or url_for('chat.chat_page')
-            logger.info(f"Redirecting to: {redirect_url}")
+            logger.debug("Redirecting to: %s", redirect_url)
             return redirect(redirect_url)
         
-        logger.warning(f"Invalid login attempt for: {form.username.data}")
+        logger.warning("Invalid login attempt for: %s", form.username.data)
         flash('Invalid username or password', 'danger')
     elif request.method == 'POST':
-        logger.warning(f"Form validation failed: {form.errors}")
+        logger.warning("Form validation failed: %s", form.errors)
         for field, errors in form.errors.items():
-            logger.warning(f"Field {field} errors: {errors}")
+            logger.warning("Field %s errors: %s", field, errors)
     
     return render_template('login.html', form=form)
 
@@ -105,7 +105,10 @@ def register():
         user.set_password(form.password.data)
         
         db.session.add(user)
+        bump_versions(db.session, directory=True)
         db.session.commit()
+        # Ids can be reused after a user is deleted
+        identity_cache.invalidate(user.id)
         
         flash('Registration successful! You can now log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -115,7 +118,7 @@ def register():
 @auth_bp.route('/logout')
 @login_required
 def logout():
-    current_user.status = 'offline'
-    db.session.commit()
+    # Presence follows the user's socket connections (see presence.py)
+    identity_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('auth.index'))
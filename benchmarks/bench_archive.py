@@ -0,0 +1,108 @@
+"""Message history before and after archiving old messages.
+
+Seeds --messages messages spread evenly over the last --days days across
+--groups groups, then times history pages (the latest page, and pages deep
+in one group's history) and measures the database size. It then archives
+messages older than --keep-days days and measures again, so deep pages are
+read through the archive.
+
+    python -m benchmarks.bench_archive --messages 1000000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import bootstrap, seed_users, seed_group, login, summarize, write_results
+
+def database_bytes(db):
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        pages = conn.exec_driver_sql('PRAGMA page_count').scalar()
+        free = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+    return (pages - free) * size
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, files in os.walk(path) for name in files)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--keep-days', type=int, default=90)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app_module = bootstrap(ARCHIVE_DIR='archive')
+    app, db = app_module.app, app_module.db
+    from archive import archive_messages
+    from models import User, Message
+
+    rng = random.Random(42)
+    with app.app_context():
+        user_ids = seed_users(db, 2)
+        group_ids = [seed_group(db, user_ids, name=f"group {i}") for i in range(args.groups)]
+        first = datetime.utcnow() - timedelta(days=args.days)
+        step = args.days * 86400 / args.messages
+        for start in range(0, args.messages, 50000):
+            count = min(50000, args.messages - start)
+            db.session.execute(Message.__table__.insert(), [{
+                'content': f"message {start + i} " + 'quack ' * rng.randint(1, 20),
+                'sender_id': user_ids[i % 2],
+                'group_id': group_ids[(start + i) % args.groups],
+                'timestamp': first + timedelta(seconds=(start + i) * step)
+            } for i in range(count)])
+            db.session.commit()
+        username = db.session.get(User, user_ids[0]).username
+        with db.engine.connect() as conn:
+            history = conn.execute(
+                db.select(Message.id).where(Message.group_id == group_ids[0]).order_by(Message.timestamp, Message.id)
+            ).scalars().all()
+
+    client = login(app, username)
+    # Cursors spread over the first half of the history, which gets archived
+    cursors = [history[rng.randrange(50, len(history) // 2)] for _ in range(args.pages)]
+
+    def measure():
+        cases = {
+            'latest page': lambda i: f"/api/messages/{group_ids[i % args.groups]}",
+            'deep page': lambda i: f"/api/messages/{group_ids[0]}?before={cursors[i]}"
+        }
+        measured = {}
+        for name, url in cases.items():
+            latencies = []
+            for i in range(args.pages):
+                started = time.perf_counter()
+                response = client.get(url(i))
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200 or len(response.get_json()['messages']) != 50:
+                    raise RuntimeError(f"{name} returned {response.status_code}")
+            measured[name] = summarize(latencies)
+        with app.app_context():
+            measured['database_bytes'] = database_bytes(db)
+        return measured
+
+    results = [{'phase': 'before', 'messages': args.messages, **measure()}]
+    with app.app_context():
+        started = time.perf_counter()
+        moved = archive_messages(timedelta(days=args.keep_days), app.config['ARCHIVE_BATCH_SIZE'])
+        archive_seconds = time.perf_counter() - started
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('VACUUM')
+    results.append({
+        'phase': 'after',
+        'archived': moved,
+        'archive_seconds': round(archive_seconds, 1),
+        'archive_bytes': directory_bytes(app.config['ARCHIVE_DIR']),
+        **measure()
+    })
+
+    write_results('archive', results, args.output)
+
+if __name__ == '__main__':
+    main()
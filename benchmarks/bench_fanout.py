@@ -0,0 +1,68 @@
+"""Send acknowledgement latency versus group size.
+
+Compares inline delivery (FANOUT_WORKERS=0, the old behaviour) with the
+background fan-out engine. Ack latency is the time from emitting
+send_message to receiving the server's acknowledgement; drain time is how
+long the workers then need to deliver everything that was sent.
+
+    python -m benchmarks.bench_fanout --sizes 2,100,1000,10000 --messages 200
+"""
+import argparse
+import time
+
+from benchmarks.common import bootstrap, seed_users, seed_group, login, summarize, write_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='2,10,100,1000,10000')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app_module = bootstrap()
+    app, db, socketio = app_module.app, app_module.db, app_module.socketio
+    from fanout import fanout
+    background_workers = fanout.workers
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        with app.app_context():
+            member_ids = seed_users(db, size, prefix=f"g{size}_")
+            group_id = seed_group(db, member_ids, name=f"size {size}")
+        sender = login(app, _username(app, member_ids[0]))
+
+        for mode, workers in (('inline', 0), ('background', background_workers)):
+            fanout.workers = workers
+            client = socketio.test_client(app, flask_test_client=sender)
+            latencies = []
+            started = time.perf_counter()
+            for i in range(args.messages):
+                sent = time.perf_counter()
+                ack = client.emit('send_message', {'group_id': group_id, 'content': f"message {i}"}, callback=True)
+                latencies.append(time.perf_counter() - sent)
+                if not ack or ack.get('status') != 'ok':
+                    raise RuntimeError(f"send_message failed: {ack}")
+            acked = time.perf_counter()
+            while fanout.pending():
+                socketio.sleep(0.001)
+            drained = time.perf_counter()
+            client.disconnect()
+
+            results.append({
+                'group_size': size,
+                'mode': mode,
+                'ack_latency': summarize(latencies),
+                'send_seconds': round(acked - started, 4),
+                'drain_seconds': round(drained - acked, 4)
+            })
+        fanout.workers = background_workers
+
+    write_results('fanout', results, args.output)
+
+def _username(app, user_id):
+    from models import User
+    with app.app_context():
+        return User.query.get(user_id).username
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Message ingestion throughput: per-message commits versus group commit.
+
+Runs concurrent senders, each on its own socket and posting to its own
+group so that delivery cost stays out of the measurement, and reports
+messages stored per second and ack latency. The direct mode
+sets the pipeline batch size to 1 (one transaction per message, the old
+behaviour); the group-commit mode uses the configured batch size and
+flush interval.
+
+    python -m benchmarks.bench_ingest --senders 50 --messages 40
+"""
+import argparse
+import time
+
+from benchmarks.common import bootstrap, seed_users, seed_group, login, summarize, write_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--senders', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=40, help='messages per sender')
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--flush-interval', type=float, default=None, help='milliseconds')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    env = {}
+    if args.batch_size is not None:
+        env['INGEST_BATCH_SIZE'] = args.batch_size
+    if args.flush_interval is not None:
+        env['INGEST_FLUSH_INTERVAL'] = args.flush_interval
+    app_module = bootstrap(**env)
+    app, db, socketio = app_module.app, app_module.db, app_module.socketio
+    from ingest import ingestion
+    from fanout import fanout
+    from models import User
+
+    with app.app_context():
+        senders = []
+        for user_id in seed_users(db, args.senders):
+            senders.append((User.query.get(user_id).username, seed_group(db, [user_id])))
+    clients = [
+        (socketio.test_client(app, flask_test_client=login(app, username)), group_id)
+        for username, group_id in senders
+    ]
+
+    results = []
+    group_commit_size = ingestion.batch_size
+    for mode, batch_size in (('direct', 1), ('group_commit', group_commit_size)):
+        ingestion.batch_size = batch_size
+        latencies = []
+        failures = []
+        finished = []
+
+        def sender(client, group_id):
+            try:
+                for i in range(args.messages):
+                    sent = time.perf_counter()
+                    ack = client.emit('send_message', {'group_id': group_id, 'content': f"message {i}"}, callback=True)
+                    latencies.append(time.perf_counter() - sent)
+                    if not ack or ack.get('status') != 'ok':
+                        failures.append(ack)
+            finally:
+                finished.append(group_id)
+
+        started = time.perf_counter()
+        for client, group_id in clients:
+            socketio.start_background_task(sender, client, group_id)
+        # join() does not wait for green threads that have not started yet
+        while len(finished) < len(clients):
+            socketio.sleep(0.001)
+        elapsed = time.perf_counter() - started
+
+        while fanout.pending():
+            socketio.sleep(0.001)
+
+        total = args.senders * args.messages
+        results.append({
+            'mode': mode,
+            'batch_size': batch_size,
+            'flush_interval_ms': ingestion.flush_interval * 1000,
+            'senders': args.senders,
+            'messages': total,
+            'failures': len(failures),
+            'seconds': round(elapsed, 4),
+            'messages_per_second': round(total / elapsed, 1),
+            'ack_latency': summarize(latencies)
+        })
+
+    write_results('ingest', results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Per-request cost of logging on the request path.
+
+Replays the routes that log on every call (/chat, /api/users and /login
+while logged in) under several logging setups and reports request latency
+for each, plus the overhead relative to logging switched off. The setups
+take turns over several rounds so drift in the machine affects them alike.
+
+- off:            root level WARNING, nothing is written
+- sync-debug:     the old setup, basicConfig at DEBUG writing on the caller
+- pipeline-info:  log_pipeline at the default INFO level
+- pipeline-debug: log_pipeline at DEBUG, with sampling
+
+--sink-delay makes every write to the log sink sleep, to show what a slow
+stderr consumer (a full pipe, a busy log shipper) does to each setup.
+
+    python -m benchmarks.bench_logging --requests 2000 --sink-delay 0.2
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.common import bootstrap, login, seed_group, seed_users, summarize, write_results
+
+ROUTES = ('/chat', '/api/users', '/login')
+
+class SlowFile:
+    """File wrapper whose writes take at least delay seconds"""
+
+    def __init__(self, path, delay):
+        self._file = open(path, 'a', encoding='utf-8')
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        self.writes += 1
+        return self._file.write(text)
+
+    def flush(self):
+        self._file.flush()
+
+def configure(name, sink, log_pipeline):
+    log_pipeline.flush_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    if name == 'off':
+        root.setLevel(logging.WARNING)
+    elif name == 'sync-debug':
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.DEBUG)
+    else:
+        level = 'DEBUG' if name == 'pipeline-debug' else 'INFO'
+        log_pipeline.configure_logging({'LOG_LEVEL': level, 'LOG_FORMAT': 'json'})
+        log_pipeline._listener.handlers[0].setStream(sink)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--sink-delay', type=float, default=0.0, help='milliseconds per write')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app_module = bootstrap(LOG_LEVEL='WARNING')
+    app, db = app_module.app, app_module.db
+    import log_pipeline
+
+    with app.app_context():
+        user_ids = seed_users(db, args.users)
+        seed_group(db, user_ids[:20])
+    client = login(app, 'user0')
+
+    # Warm up caches and templates before timing
+    for route in ROUTES * 10:
+        client.get(route)
+
+    setups = ('off', 'sync-debug', 'pipeline-info', 'pipeline-debug')
+    samples = {name: [] for name in setups}
+    lines = dict.fromkeys(setups, 0)
+    per_round = max(1, args.requests // args.rounds)
+    for _ in range(args.rounds):
+        for name in setups:
+            sink = SlowFile(os.path.join(tempfile.mkdtemp(), 'app.log'), args.sink_delay / 1000.0)
+            configure(name, sink, log_pipeline)
+            for i in range(per_round):
+                started = time.perf_counter()
+                client.get(ROUTES[i % len(ROUTES)])
+                samples[name].append(time.perf_counter() - started)
+            log_pipeline.flush_logging()
+            lines[name] += sink.writes
+
+    baseline = sum(samples['off']) / len(samples['off'])
+    results = []
+    for name in setups:
+        mean = sum(samples[name]) / len(samples[name])
+        results.append({
+            'setup': name,
+            'sink_delay_ms': args.sink_delay,
+            'request': summarize(samples[name]),
+            'mean_ms': round(mean * 1000, 3),
+            'overhead_per_request_ms': round((mean - baseline) * 1000, 3),
+            'lines_written': lines[name]
+        })
+
+    write_results('logging', results, args.output)
+
+if __name__ == '__main__':
+    main()
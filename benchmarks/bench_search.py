@@ -0,0 +1,85 @@
+"""Latency of /api/search over a large message table.
+
+Seeds --messages messages of random words (Zipf-distributed, so some words
+are very common and most are rare) spread over --groups groups, of which
+the searching user belongs to --member-of. Then times ranked searches for
+rare, medium and common words and for prefixes.
+
+    python -m benchmarks.bench_search --messages 10000000
+"""
+import argparse
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import bootstrap, seed_users, seed_group, login, summarize, write_results
+
+VOCABULARY = 50000
+WORDS_PER_MESSAGE = 12
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--member-of', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app_module = bootstrap()
+    app, db = app_module.app, app_module.db
+    from models import User, Message
+
+    rng = random.Random(42)
+    words = [f"w{rank}" for rank in range(VOCABULARY)]
+    # Zipf weights: the word of rank r appears ~1/r as often as the most common one
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(VOCABULARY)))
+
+    with app.app_context():
+        user_ids = seed_users(db, 2)
+        group_ids = [
+            seed_group(db, user_ids if i < args.member_of else user_ids[1:], name=f"group {i}")
+            for i in range(args.groups)
+        ]
+        started = time.perf_counter()
+        first = datetime.utcnow() - timedelta(days=365)
+        for start in range(0, args.messages, 50000):
+            count = min(50000, args.messages - start)
+            db.session.execute(Message.__table__.insert(), [{
+                'content': ' '.join(rng.choices(words, cum_weights=cum_weights, k=WORDS_PER_MESSAGE)),
+                'sender_id': user_ids[1],
+                'group_id': rng.choice(group_ids),
+                'timestamp': first + timedelta(seconds=start + i)
+            } for i in range(count)])
+            db.session.commit()
+        # As `flask search optimize` would after a backfill
+        with db.engine.begin() as conn:
+            conn.execute(db.text("INSERT INTO message_fts (message_fts) VALUES ('optimize')"))
+        seed_seconds = time.perf_counter() - started
+        username = db.session.get(User, user_ids[0]).username
+
+    client = login(app, username)
+    cases = {
+        'common word': lambda: words[rng.randrange(0, 10)],
+        'medium word': lambda: words[rng.randrange(100, 1000)],
+        'rare word': lambda: words[rng.randrange(10000, VOCABULARY)],
+        'two words': lambda: f"{words[rng.randrange(0, 100)]} {words[rng.randrange(100, 1000)]}",
+        'prefix': lambda: words[rng.randrange(100, 1000)][:3]
+    }
+    results = []
+    for name, make_query in cases.items():
+        latencies = []
+        for _ in range(args.queries):
+            started = time.perf_counter()
+            response = client.get('/api/search', query_string={'q': make_query()})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"Search failed with {response.status_code}")
+        results.append({'case': name, 'messages': args.messages, 'latency': summarize(latencies)})
+
+    write_results('search', results, args.output)
+    print(f"Seeded {args.messages} messages in {seed_seconds:.0f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Serialization CPU and bytes on the wire for large API responses.
+
+Seeds a user who belongs to --groups groups and a group with a full page of
+long-ish messages, then for a 200-message /api/messages page and the
+/api/conversations list measures:
+
+- encoding time with Flask's standard JSON provider and with orjson
+- response size and compression time for gzip and brotli at the levels
+  the app uses
+- end-to-end request latency for each Accept-Encoding
+
+    python -m benchmarks.bench_serialization --groups 500
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import bootstrap, seed_users, seed_group, login, summarize, write_results
+
+WORDS = ('quack', 'pond', 'bread', 'feather', 'waddle', 'duckling', 'lake', 'reed', 'splash', 'migrate')
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - started)
+    return result, samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app_module = bootstrap()
+    app, db = app_module.app, app_module.db
+    from flask.json.provider import DefaultJSONProvider
+    from fast_json import OrjsonProvider
+    from compression import brotli
+    from models import Message
+
+    rng = random.Random(42)
+    with app.app_context():
+        user_ids = seed_users(db, 20)
+        group_ids = [seed_group(db, [user_ids[0]] + rng.sample(user_ids[1:], 3), name=f"group {i}")
+                     for i in range(args.groups)]
+        first = datetime.utcnow() - timedelta(days=1)
+        db.session.execute(Message.__table__.insert(), [{
+            'content': ' '.join(rng.choices(WORDS, k=rng.randint(5, 30))),
+            'sender_id': rng.choice(user_ids[:4]),
+            'group_id': group_id if i >= len(group_ids) else group_ids[i],
+            'timestamp': first + timedelta(seconds=i)
+        } for i, group_id in enumerate(group_ids + [group_ids[0]] * 300)])
+        db.session.commit()
+    client = login(app, 'user0')
+
+    standard, fast = DefaultJSONProvider(app), OrjsonProvider(app)
+    endpoints = {
+        'messages': f"/api/messages/{group_ids[0]}?limit=200",
+        'conversations': '/api/conversations'
+    }
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+
+    results = []
+    for name, url in endpoints.items():
+        payload = json.loads(client.get(url).get_data())
+        # Whole response bodies, as jsonify() builds them
+        with app.app_context():
+            raw, standard_samples = timed(lambda: standard.response(payload).get_data(), args.repeat)
+            _, fast_samples = timed(lambda: fast.response(payload).get_data(), args.repeat)
+        result = {
+            'endpoint': name,
+            'json_bytes': len(raw),
+            'encode_standard': summarize(standard_samples),
+            'encode_orjson': summarize(fast_samples),
+            'wire': {}
+        }
+
+        compressors = {
+            'gzip': lambda: gzip.compress(raw, compresslevel=app.config['COMPRESS_GZIP_LEVEL'])
+        }
+        if brotli is not None:
+            compressors['br'] = lambda: brotli.compress(raw, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        for encoding, compress in compressors.items():
+            compressed, samples = timed(compress, args.repeat)
+            result['wire'][encoding] = {
+                'bytes': len(compressed),
+                'ratio': round(len(raw) / len(compressed), 2),
+                'compress': summarize(samples)
+            }
+
+        result['request'] = {}
+        for encoding in encodings:
+            response, samples = timed(lambda: client.get(url, headers={'Accept-Encoding': encoding}), args.repeat)
+            result['request'][encoding] = {
+                'bytes': len(response.get_data()),
+                'content_encoding': response.headers.get('Content-Encoding'),
+                'latency': summarize(samples)
+            }
+        results.append(result)
+
+    write_results('serialization', results, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Per-request session load and save cost: filesystem store versus SQLite.
+
+Fills each store with --sessions live sessions, then replays requests
+against random ones: every request loads its session, and every --write-every-th
+request also changes it (the rest only refresh the expiry, as Flask does for
+permanent sessions). The filesystem store uses Flask-Session's defaults,
+including its 500 file threshold, so the hit rate shows how many sessions
+it silently dropped; 'filesystem-unbounded' disables the threshold to
+show the steady-state cost of keeping every file.
+
+    python -m benchmarks.bench_sessions --sessions 10000 --requests 5000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import bootstrap, summarize, write_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--write-every', type=int, default=10)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app = bootstrap().app
+    from flask import Response
+    from session_store import SQLiteSessionInterface
+
+    common = {'key_prefix': 'session:', 'use_signer': False, 'permanent': True, 'sid_length': 32}
+    stores = [
+        ('sqlite', SQLiteSessionInterface(
+            os.path.join(tempfile.mkdtemp(), 'sessions.db'), sweep_interval=0, **common))
+    ]
+    try:
+        # The filesystem store as Flask-Session 0.6 implements it
+        from flask_session.sessions import FileSystemSessionInterface
+    except ImportError:
+        print("Flask-Session 0.6 is not installed; only timing the SQLite store")
+    else:
+        stores[:0] = [
+            ('filesystem', FileSystemSessionInterface(
+                os.path.join(tempfile.mkdtemp(), 'flask_session'), 500, 0o600, **common)),
+            ('filesystem-unbounded', FileSystemSessionInterface(
+                os.path.join(tempfile.mkdtemp(), 'flask_session'), 0, 0o600, **common))
+        ]
+
+    results = []
+    for name, store in stores:
+        rng = random.Random(42)
+        sids = []
+        with app.test_request_context():
+            for i in range(args.sessions):
+                session = store.session_class(sid=store._generate_sid(32), permanent=True)
+                session.update({'_user_id': str(i), 'user_id': i, '_fresh': True})
+                store.save_session(app, session, Response())
+                sids.append(session.sid)
+
+            loads, saves, hits = [], [], 0
+            for i in range(args.requests):
+                sid = rng.choice(sids)
+                started = time.perf_counter()
+                session = store.fetch_session(sid)
+                loads.append(time.perf_counter() - started)
+                hits += bool(session)
+
+                if i % args.write_every == 0:
+                    session['csrf_token'] = str(i)
+                started = time.perf_counter()
+                store.save_session(app, session, Response())
+                saves.append(time.perf_counter() - started)
+
+        results.append({
+            'store': name,
+            'sessions': args.sessions,
+            'hit_rate': hits / args.requests,
+            'load': summarize(loads),
+            'save': summarize(saves)
+        })
+
+    write_results('sessions', results, args.output)
+
+if __name__ == '__main__':
+    main()
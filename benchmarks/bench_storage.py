@@ -0,0 +1,126 @@
+"""Compare storage profiles on the same chat workload.
+
+Each profile runs in its own process against an empty database: a tuned
+SQLite file (always) and PostgreSQL when --postgres-url or the
+BENCH_POSTGRES_URL environment variable points at an empty database. The
+workload checks every response, so it doubles as a smoke test that both
+profiles behave the same.
+
+    python -m benchmarks.bench_storage --postgres-url postgresql://localhost/wequack_bench
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import ROOT, bootstrap, seed_users, seed_group, login, summarize, write_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--postgres-url', default=os.environ.get('BENCH_POSTGRES_URL'))
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=400, help='messages per group')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--output')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_workload(args)
+        return
+
+    profiles = [('sqlite', None)]
+    if args.postgres_url:
+        profiles.append(('postgresql', args.postgres_url))
+
+    results = []
+    for name, url in profiles:
+        env = dict(os.environ)
+        if url:
+            env['DATABASE_URL'] = url
+        else:
+            env.pop('DATABASE_URL', None)
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            subprocess.run([
+                sys.executable, '-m', 'benchmarks.bench_storage',
+                '--worker', output.name,
+                '--groups', str(args.groups),
+                '--members', str(args.members),
+                '--messages', str(args.messages),
+                '--requests', str(args.requests)
+            ], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+            results.append(dict(json.load(output), profile=name))
+
+    write_results('storage', results, args.output)
+
+def run_workload(args):
+    app_module = bootstrap()
+    app, db, socketio = app_module.app, app_module.db, app_module.socketio
+    from models import User, Message
+
+    rng = random.Random(42)
+    with app.app_context():
+        user_ids = seed_users(db, args.groups * (args.members - 1) + 1)
+        reader_id, others = user_ids[0], user_ids[1:]
+        group_ids = []
+        for i in range(args.groups):
+            members = [reader_id] + others[i * (args.members - 1):(i + 1) * (args.members - 1)]
+            group_ids.append((seed_group(db, members, name=f"group {i}"), members))
+
+        started = datetime.utcnow() - timedelta(days=30)
+        for group_id, members in group_ids:
+            db.session.execute(Message.__table__.insert(), [{
+                'content': f"seeded message {n}",
+                'sender_id': rng.choice(members),
+                'group_id': group_id,
+                'timestamp': started + timedelta(seconds=n)
+            } for n in range(args.messages)])
+        db.session.commit()
+        reader_name = User.query.get(reader_id).username
+
+    client = login(app, reader_name)
+    socket = socketio.test_client(app, flask_test_client=client)
+
+    def timed_get(url):
+        sent = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - sent
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        return elapsed, response.get_json()
+
+    latest, older, conversations, sends = [], [], [], []
+    for _ in range(args.requests):
+        group_id, _ = rng.choice(group_ids)
+        elapsed, page = timed_get(f"/api/messages/{group_id}")
+        latest.append(elapsed)
+        elapsed, _ = timed_get(f"/api/messages/{group_id}?before={page['messages'][0]['id']}")
+        older.append(elapsed)
+        elapsed, rows = timed_get('/api/conversations')
+        conversations.append(elapsed)
+        if len(rows) != args.groups:
+            raise RuntimeError(f"Expected {args.groups} conversations, got {len(rows)}")
+
+        sent = time.perf_counter()
+        ack = socket.emit('send_message', {'group_id': group_id, 'content': 'benchmark'}, callback=True)
+        sends.append(time.perf_counter() - sent)
+        if not ack or ack.get('status') != 'ok':
+            raise RuntimeError(f"send_message failed: {ack}")
+
+    with open(args.worker, 'w') as handle:
+        json.dump({
+            'database': app.config['STORAGE_PROFILE'],
+            'latest_page': summarize(latest),
+            'older_page': summarize(older),
+            'conversations': summarize(conversations),
+            'send_ack': summarize(sends)
+        }, handle)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Check that Socket.IO traffic crosses workers in clustered mode.
+
+Starts --workers app processes on consecutive ports that share one SQLite
+database, session store and Redis message queue, connects one user to each
+worker and checks that a message sent on one worker reaches the clients on
+all the others, and that emits from REST handlers do too. Finally a user
+with connections on two workers closes one of them and must stay online.
+
+Needs a reachable Redis (a local redis-server will do) and the Socket.IO
+client extras: pip install -r benchmarks/requirements.txt
+
+    python -m benchmarks.cluster_check --redis redis://localhost:6379/0 --workers 3
+"""
+import argparse
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import ROOT, PASSWORD
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--redis', default=os.environ.get('SOCKETIO_MESSAGE_QUEUE', 'redis://localhost:6379/0'))
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--seed', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker)
+    elif args.seed:
+        seed(args.workers)
+    else:
+        sys.exit(run_check(args))
+
+def run_worker(port):
+    # Must happen before the app (and the Redis client) is imported
+    import eventlet
+    eventlet.monkey_patch()
+
+    from benchmarks.common import bootstrap
+    app_module = bootstrap()
+    app_module.socketio.run(app_module.app, host='127.0.0.1', port=port, log_output=False)
+
+def seed(count):
+    from benchmarks.common import bootstrap, seed_users, seed_group
+    app_module = bootstrap()
+    with app_module.app.app_context():
+        from models import User
+        user_ids = seed_users(app_module.db, count, prefix='cluster')
+        group_id = seed_group(app_module.db, user_ids, name='cluster')
+        users = [(user_id, app_module.db.session.get(User, user_id).username) for user_id in user_ids]
+    print(json.dumps({'users': users, 'group_id': group_id}))
+
+def run_check(args):
+    import redis
+    import requests
+    import socketio
+
+    try:
+        redis.Redis.from_url(args.redis).ping()
+    except redis.RedisError as e:
+        print(f"Redis is not reachable at {args.redis}: {e}")
+        return 2
+
+    workdir = tempfile.mkdtemp(prefix='wequack-cluster-')
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'chat.db')}",
+        SESSION_SQLITE_PATH=os.path.join(workdir, 'sessions.db'),
+        SESSION_SECRET=secrets.token_hex(16),
+        SOCKETIO_CHANNEL=f"wequack-check-{secrets.token_hex(4)}",
+        PRESENCE_FLUSH_INTERVAL='0.2',
+        PRESENCE_GRACE_PERIOD='0.5',
+        PYTHONPATH=ROOT
+    )
+    seeded = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.cluster_check', '--seed', '--workers', str(args.workers)],
+        cwd=ROOT, env=dict(env, SOCKETIO_MESSAGE_QUEUE=''), check=True, capture_output=True, text=True
+    )
+    fixture = json.loads(seeded.stdout.strip().splitlines()[-1])
+    group_id = fixture['group_id']
+
+    env['SOCKETIO_MESSAGE_QUEUE'] = args.redis
+    urls = [f"http://127.0.0.1:{args.port + i}" for i in range(args.workers)]
+    workers = [subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.cluster_check', '--worker', str(args.port + i)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ) for i in range(args.workers)]
+
+    clients = []
+    failures = []
+    try:
+        for url in urls:
+            _wait_for(url, args.timeout)
+
+        # One user per worker, each listening on their own worker only
+        for url, (user_id, username) in zip(urls, fixture['users']):
+            http = requests.Session()
+            http.post(f"{url}/login", data={'username': username, 'password': PASSWORD})
+            received = {}
+            condition = threading.Condition()
+            client = socketio.Client()
+
+            def record(name):
+                def handler(data, received=received, condition=condition):
+                    with condition:
+                        received.setdefault(name, []).append(data)
+                        condition.notify_all()
+                return handler
+
+            for name in ('new_message', 'conversation_updated'):
+                client.on(name, record(name))
+            client.connect(url, headers={'Cookie': '; '.join(f"{k}={v}" for k, v in http.cookies.items())})
+            client.emit('join_room', {'room': f"group_{group_id}"})
+            clients.append({'user_id': user_id, 'username': username, 'http': http, 'socket': client,
+                            'received': received, 'condition': condition, 'url': url})
+        time.sleep(0.5)
+
+        def expect(check, name, predicate):
+            for peer in clients[1:]:
+                with peer['condition']:
+                    ok = peer['condition'].wait_for(
+                        lambda: any(predicate(data) for data in peer['received'].get(name, ())),
+                        timeout=args.timeout
+                    )
+                result = 'PASS' if ok else 'FAIL'
+                print(f"{result} {check}: {name} reached user {peer['user_id']} on {peer['url']}")
+                if not ok:
+                    failures.append(check)
+
+        sender = clients[0]
+        content = f"cluster check {secrets.token_hex(4)}"
+        ack = sender['socket'].call('send_message', {'group_id': group_id, 'content': content}, timeout=args.timeout)
+        if not ack or ack.get('status') != 'ok':
+            print(f"FAIL send_message on {sender['url']}: {ack}")
+            return 1
+        expect('socket emit', 'new_message', lambda data: data.get('content') == content)
+        expect('socket emit', 'conversation_updated', lambda data: data.get('last_message') == content)
+
+        response = sender['http'].post(f"{sender['url']}/api/create_group", json={
+            'name': 'cluster rest',
+            'members': [client['user_id'] for client in clients[1:]]
+        })
+        new_group_id = response.json()['id']
+        expect('REST emit', 'conversation_updated', lambda data: data.get('id') == new_group_id)
+
+        # A second tab of a peer on the sender's worker comes and goes; the
+        # peer's own worker still holds a connection, so they stay online
+        peer = clients[1]
+        tab = socketio.Client()
+        tab.connect(sender['url'], headers={'Cookie': '; '.join(f"{k}={v}" for k, v in peer['http'].cookies.items())})
+        time.sleep(1)
+        tab.disconnect()
+        time.sleep(1.5)
+        deadline = time.monotonic() + args.timeout
+        while True:
+            users = sender['http'].get(f"{sender['url']}/api/users", params={'q': peer['username']}).json()['users']
+            status = next(user['status'] for user in users if user['id'] == peer['user_id'])
+            if status == 'online' or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        print(f"{'PASS' if status == 'online' else 'FAIL'} presence: user {peer['user_id']} is {status} "
+              f"after closing their connection to {sender['url']}")
+        if status != 'online':
+            failures.append('presence')
+    finally:
+        for client in clients:
+            client['socket'].disconnect()
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+    print('OK' if not failures else f"{len(failures)} check(s) failed")
+    return 1 if failures else 0
+
+def _wait_for(url, timeout):
+    import requests
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(f"{url}/login", timeout=1)
+            return
+        except requests.ConnectionError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Worker at {url} did not start")
+            time.sleep(0.2)
+
+if __name__ == '__main__':
+    main()
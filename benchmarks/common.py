@@ -0,0 +1,121 @@
+"""Shared setup for the benchmark scripts.
+
+Benchmarks run the real application against a throwaway database in a
+temporary directory, so they never touch instance/chat.db or the session
+store of a development checkout. Run them from the repository root, e.g.
+``python -m benchmarks.bench_fanout``.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'benchmark'
+
+def bootstrap(**env):
+    """Import the app configured for a scratch database and return the module"""
+    workdir = tempfile.mkdtemp(prefix='wequack-bench-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault('SESSION_SQLITE_PATH', os.path.join(workdir, 'sessions.db'))
+    os.environ.update({key: str(value) for key, value in env.items()})
+    # File based stores (sessions, archives) are created relative to the cwd
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    import app as app_module
+    app_module.app.config['WTF_CSRF_ENABLED'] = False
+    return app_module
+
+def seed_users(db, count, prefix='user'):
+    """Bulk insert users sharing one password hash and return their ids"""
+    from models import User, username_key
+    from werkzeug.security import generate_password_hash
+
+    password_hash = generate_password_hash(PASSWORD)
+    offset = db.session.query(User).count()
+    rows = [{
+        'username': f"{prefix}{offset + i}",
+        'username_key': username_key(f"{prefix}{offset + i}"),
+        'email': f"{prefix}{offset + i}@bench.invalid",
+        'password_hash': password_hash,
+        'status': 'offline'
+    } for i in range(count)]
+    db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+    names = [row['username'] for row in rows]
+    return [user_id for user_id, in db.session.query(User.id).filter(User.username.in_(names))]
+
+def seed_group(db, member_ids, name='bench', is_direct_chat=False):
+    """Create a group with the given members and return its id"""
+    from models import Group, user_group, direct_chat_pair
+
+    group = Group(name=name, creator_id=member_ids[0], is_direct_chat=is_direct_chat)
+    if is_direct_chat:
+        group.dm_low_user_id, group.dm_high_user_id = direct_chat_pair(*member_ids)
+    db.session.add(group)
+    db.session.flush()
+    db.session.execute(user_group.insert(), [
+        {'user_id': user_id, 'group_id': group.id} for user_id in member_ids
+    ])
+    db.session.commit()
+    return group.id
+
+def login(app, username):
+    """Return a Flask test client logged in as username"""
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f"Login failed for {username}")
+    return client
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    if not samples:
+        return {'count': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3)
+    }
+
+def environment():
+    """What a run was measured on, so results can be compared over time"""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+def write_results(name, results, output=None):
+    """Print results and optionally write them as JSON for later comparison"""
+    document = {
+        'benchmark': name,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': environment(),
+        'results': results
+    }
+    text = json.dumps(document, indent=2)
+    if output:
+        with open(output, 'w') as handle:
+            handle.write(text)
+    print(text)
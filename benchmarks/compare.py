@@ -0,0 +1,60 @@
+"""Compare two benchmark result files.
+
+Matches results by their descriptive fields (case, mode, store, ...) and
+prints every numeric metric side by side with the relative change.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+def flatten(value, prefix=''):
+    """Yield (path, number) for every numeric leaf"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+def label(result):
+    """Identify a result by its string fields, e.g. 'case=common word'"""
+    return ', '.join(f"{key}={value}" for key, value in result.items() if isinstance(value, str)) or '-'
+
+def load(path):
+    with open(path) as handle:
+        document = json.load(handle)
+    metrics = {}
+    for result in document['results']:
+        for name, number in flatten(result):
+            metrics[(label(result), name)] = number
+    return document, metrics
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    before_document, before = load(args.before)
+    after_document, after = load(args.after)
+    for document in (before_document, after_document):
+        environment = document.get('environment') or {}
+        print(f"{document['benchmark']} {document['timestamp']} revision={environment.get('revision')}")
+
+    current = None
+    for key in sorted(before.keys() | after.keys()):
+        result, name = key
+        if result != current:
+            print(f"\n{result}")
+            current = result
+        old, new = before.get(key), after.get(key)
+        change = ''
+        if old and new is not None:
+            change = f"{(new - old) / old * 100:+.1f}%"
+        print(f"  {name:<32} {_format(old):>12} {_format(new):>12} {change:>9}")
+
+def _format(number):
+    return '-' if number is None else f"{number:g}"
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""End-to-end load test over real HTTP and Socket.IO connections.
+
+Seeds a dataset (see benchmarks/seed.py), starts the app on a local port
+and drives it with a swarm of Socket.IO clients. Each client logs in, joins
+its groups' rooms and sends messages at --rate per second. It also marks
+what it receives as read (mark_read_upto, as the browser client does).
+While the swarm runs, a probe thread times /api/conversations,
+/api/messages/<id> and /chat.
+
+The report gives send-to-deliver latency (from emitting send_message to
+another member receiving new_message), acknowledgement latency, message
+and delivery throughput, and the endpoint latencies under load.
+
+Needs the Socket.IO client extras: pip install -r benchmarks/requirements.txt
+
+    python -m benchmarks.load_test --clients 50 --rate 2 --duration 30 --output run.json
+
+Use --url and --fixture to target a server that is already running and was
+seeded with `python -m benchmarks.seed --fixture`.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import ROOT, PASSWORD, summarize, write_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--groups', type=int, default=150)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=1.0, help='messages per second per client')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--probe-interval', type=float, default=0.05, help='seconds between HTTP probes')
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--url')
+    parser.add_argument('--fixture')
+    parser.add_argument('--output')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    server = None
+    if args.url:
+        if not args.fixture:
+            parser.error('--url needs the --fixture written when that server was seeded')
+        url = args.url.rstrip('/')
+    else:
+        workdir = tempfile.mkdtemp(prefix='wequack-load-')
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'chat.db')}",
+            SESSION_SQLITE_PATH=os.path.join(workdir, 'sessions.db')
+        )
+        args.fixture = os.path.join(workdir, 'fixture.json')
+        subprocess.run([
+            sys.executable, '-m', 'benchmarks.seed',
+            '--users', str(args.users), '--groups', str(args.groups),
+            '--messages', str(args.messages), '--fixture', args.fixture
+        ], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.load_test', '--serve', str(args.port)],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        with open(args.fixture) as handle:
+            fixture = json.load(handle)
+        _wait_for(url)
+        report = run_load(url, fixture, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    write_results('load_test', [report], args.output)
+
+def serve(port):
+    # Must happen before the app is imported
+    import eventlet
+    eventlet.monkey_patch()
+
+    from benchmarks.common import bootstrap
+    app_module = bootstrap()
+    app_module.socketio.run(app_module.app, host='127.0.0.1', port=port, log_output=False)
+
+class SwarmClient:
+    """One logged-in user with an HTTP session and a Socket.IO connection"""
+
+    def __init__(self, url, user_id, username, group_ids, stats):
+        import requests
+        import socketio
+
+        self.url = url
+        self.user_id = user_id
+        self.group_ids = group_ids
+        self.stats = stats
+        self.http = requests.Session()
+        response = self.http.post(f"{url}/login", data={'username': username, 'password': PASSWORD},
+                                  allow_redirects=False)
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed for {username}")
+        self.socket = socketio.Client(reconnection=False)
+        self.socket.on('new_message', self._on_new_message)
+        self.socket.connect(url, headers={
+            'Cookie': '; '.join(f"{name}={value}" for name, value in self.http.cookies.items())
+        })
+        for group_id in group_ids:
+            self.socket.emit('join_room', {'room': f"group_{group_id}"})
+
+    def _on_new_message(self, message):
+        received = time.perf_counter()
+        token = message.get('content', '').rpartition(' ')[2]
+        sent = self.stats.sent.get(token)
+        if sent is None or message.get('sender_id') == self.user_id:
+            return
+        with self.stats.lock:
+            self.stats.deliveries.append(received - sent)
+        self.socket.emit('mark_read_upto', {'group_id': message['group_id'], 'message_id': message['id']})
+
+    def run(self, rng, rate, deadline, index):
+        sequence = 0
+        while time.perf_counter() < deadline:
+            time.sleep(rng.expovariate(rate))
+            token = f"{index}-{sequence}"
+            sequence += 1
+            self.stats.sent[token] = started = time.perf_counter()
+            try:
+                ack = self.socket.call('send_message', {
+                    'group_id': rng.choice(self.group_ids),
+                    'content': f"load test {token}"
+                }, timeout=10)
+            except Exception:
+                ack = None
+            with self.stats.lock:
+                if ack and ack.get('status') == 'ok':
+                    self.stats.acks.append(time.perf_counter() - started)
+                else:
+                    self.stats.errors += 1
+
+class SwarmStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.acks = []
+        self.deliveries = []
+        self.errors = 0
+        self.probes = {'/api/conversations': [], '/api/messages/<id>': [], '/chat': []}
+
+def run_load(url, fixture, args):
+    rng = random.Random(7)
+    groups_of = {}
+    for group_id, members in fixture['groups']:
+        for user_id in members:
+            groups_of.setdefault(user_id, []).append(group_id)
+    candidates = [(user_id, username) for user_id, username in fixture['users'] if user_id in groups_of]
+    chosen = rng.sample(candidates, min(args.clients, len(candidates)))
+
+    stats = SwarmStats()
+    clients = [SwarmClient(url, user_id, username, groups_of[user_id], stats) for user_id, username in chosen]
+    time.sleep(1)
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=client.run, args=(random.Random(i), args.rate, deadline, i))
+               for i, client in enumerate(clients)]
+    threads.append(threading.Thread(target=_probe, args=(clients, stats, deadline, args.probe_interval)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    # Let in-flight deliveries arrive
+    time.sleep(2)
+    for client in clients:
+        client.socket.disconnect()
+
+    return {
+        'url': url,
+        'clients': len(clients),
+        'rate_per_client': args.rate,
+        'duration_s': round(elapsed, 3),
+        'messages_sent': len(stats.acks) + stats.errors,
+        'errors': stats.errors,
+        'messages_per_second': round(len(stats.acks) / elapsed, 1),
+        'deliveries_per_second': round(len(stats.deliveries) / elapsed, 1),
+        'send_ack': summarize(stats.acks),
+        'send_to_deliver': summarize(stats.deliveries),
+        'http': {path: summarize(samples) for path, samples in stats.probes.items()}
+    }
+
+def _probe(clients, stats, deadline, interval):
+    rng = random.Random(1)
+    while time.perf_counter() < deadline:
+        client = rng.choice(clients)
+        for path, url in (
+            ('/api/conversations', f"{client.url}/api/conversations"),
+            ('/api/messages/<id>', f"{client.url}/api/messages/{rng.choice(client.group_ids)}"),
+            ('/chat', f"{client.url}/chat")
+        ):
+            started = time.perf_counter()
+            response = client.http.get(url)
+            elapsed = time.perf_counter() - started
+            with stats.lock:
+                if response.status_code == 200:
+                    stats.probes[path].append(elapsed)
+                else:
+                    stats.errors += 1
+        time.sleep(interval)
+
+def _wait_for(url, timeout=30):
+    import requests
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(f"{url}/login", timeout=1)
+            return
+        except requests.ConnectionError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Server at {url} did not start")
+            time.sleep(0.2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Synthetic dataset for load tests.
+
+Creates --users users, --groups conversations and --messages messages with
+shapes that resemble a real deployment: most conversations are direct
+chats, group sizes follow a heavy-tailed distribution (many small groups,
+a few very large ones), busier groups get more of the messages and every
+member has a read cursor somewhere in the recent history.
+
+Seeds a scratch database by default, or any database with --database-url
+(it must already have the schema, e.g. after starting the app once):
+
+    python -m benchmarks.seed --users 1000 --groups 300 --messages 100000 --database-url sqlite:////tmp/load.db
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.common import bootstrap, seed_users
+
+# Share of conversations that are direct chats
+DIRECT_CHAT_SHARE = 0.6
+# Pareto shape for group sizes; lower means more very large groups
+GROUP_SIZE_SHAPE = 1.3
+
+def seed_dataset(db, users, groups, messages, seed=42, days=30):
+    """Seed a dataset and return a fixture describing it.
+
+    The fixture lists the users (id, username) and the groups (id,
+    member ids), which load generators use to pick who talks where.
+    """
+    from sqlalchemy import func, bindparam
+    from models import User, Message, Group, user_group, direct_chat_pair
+
+    rng = random.Random(seed)
+    user_ids = seed_users(db, users, prefix='load')
+
+    group_members = []
+    direct_pairs = set()
+    for i in range(groups):
+        pair = None
+        if rng.random() < DIRECT_CHAT_SHARE:
+            members = rng.sample(user_ids, 2)
+            is_direct_chat = True
+            pair = direct_chat_pair(*members)
+            # Only one direct chat per pair of users
+            if pair in direct_pairs:
+                continue
+            direct_pairs.add(pair)
+        else:
+            size = min(len(user_ids), 2 + int(rng.paretovariate(GROUP_SIZE_SHAPE) * 2))
+            members = rng.sample(user_ids, size)
+            is_direct_chat = False
+        group = Group(
+            name=f"load {i}" if not is_direct_chat else f"Direct: load {i}",
+            creator_id=members[0],
+            is_direct_chat=is_direct_chat,
+            dm_low_user_id=pair[0] if pair else None,
+            dm_high_user_id=pair[1] if pair else None
+        )
+        db.session.add(group)
+        db.session.flush()
+        db.session.execute(user_group.insert(), [
+            {'user_id': user_id, 'group_id': group.id} for user_id in members
+        ])
+        group_members.append((group.id, members))
+    db.session.commit()
+
+    # Activity grows with group size, but less than linearly
+    cum_weights = list(itertools.accumulate(len(members) ** 0.5 for _, members in group_members))
+    started = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / max(messages, 1)
+    for start in range(0, messages, 20000):
+        rows = []
+        for i in range(start, min(messages, start + 20000)):
+            group_id, members = rng.choices(group_members, cum_weights=cum_weights)[0]
+            rows.append({
+                'content': f"seeded message {i} " + ' '.join(rng.choices(WORDS, k=rng.randint(2, 20))),
+                'sender_id': rng.choice(members),
+                'group_id': group_id,
+                'timestamp': started + step * i
+            })
+        db.session.execute(Message.__table__.insert(), rows)
+        db.session.commit()
+
+    # Members have read most of each group; some are a little behind
+    newest = dict(db.session.query(Message.group_id, func.max(Message.id)).group_by(Message.group_id))
+    cursors = []
+    for group_id, members in group_members:
+        if group_id not in newest:
+            continue
+        for user_id in members:
+            cursors.append({
+                'member_id': user_id,
+                'member_group_id': group_id,
+                'cursor': max(0, newest[group_id] - int(rng.expovariate(1 / 20)))
+            })
+    if cursors:
+        db.session.execute(
+            user_group.update().where(
+                user_group.c.user_id == bindparam('member_id'),
+                user_group.c.group_id == bindparam('member_group_id')
+            ).values(last_read_message_id=bindparam('cursor')),
+            cursors
+        )
+        db.session.commit()
+
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)))
+    return {
+        'users': [[user_id, usernames[user_id]] for user_id in user_ids],
+        'groups': [[group_id, members] for group_id, members in group_members]
+    }
+
+WORDS = ('quack duck pond bread lunch meeting tomorrow today deploy review '
+         'branch fix bug ship release coffee later sounds good thanks yes no '
+         'maybe weekend photo link call now soon done wait').split()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url')
+    parser.add_argument('--fixture', help='write the fixture JSON here')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    app_module = bootstrap()
+    with app_module.app.app_context():
+        fixture = seed_dataset(app_module.db, args.users, args.groups, args.messages, seed=args.seed)
+    text = json.dumps(fixture)
+    if args.fixture:
+        with open(args.fixture, 'w') as handle:
+            handle.write(text)
+    print(f"Seeded {args.users} users, {args.groups} groups and {args.messages} messages")
+
+if __name__ == '__main__':
+    main()
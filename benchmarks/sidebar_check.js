@@ -0,0 +1,127 @@
+// Check that the sidebar renders and patches conversations without a browser.
+//
+// Loads static/js/chat.js against a minimal DOM stub, renders a direct chat
+// and a group, then applies conversation_updated deltas (a new direct chat,
+// a new message, a read) and a presence change. Exits non-zero if any check
+// fails.
+//
+//     node benchmarks/sidebar_check.js
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+class Element {
+    constructor(tagName) {
+        this.tagName = tagName;
+        this.children = [];
+        this.parent = null;
+        this.dataset = {};
+        this.className = '';
+        this.textContent = '';
+        this.title = '';
+        this.style = {};
+        this.listeners = {};
+        const element = this;
+        this.classList = {
+            add: name => { if (!element.classes().includes(name)) element.className = (element.className + ' ' + name).trim(); },
+            remove: name => { element.className = element.classes().filter(c => c !== name).join(' '); },
+            contains: name => element.classes().includes(name)
+        };
+    }
+    classes() { return this.className.split(/\s+/).filter(Boolean); }
+    set innerHTML(value) { this.children.forEach(child => { child.parent = null; }); this.children = []; }
+    appendChild(child) { return this.insertBefore(child, null); }
+    insertBefore(child, next) {
+        if (child.parent) child.remove();
+        const index = next ? this.children.indexOf(next) : -1;
+        if (index < 0) this.children.push(child); else this.children.splice(index, 0, child);
+        child.parent = this;
+        return child;
+    }
+    remove() {
+        if (!this.parent) return;
+        this.parent.children = this.parent.children.filter(child => child !== this);
+        this.parent = null;
+    }
+    addEventListener(name, handler) { (this.listeners[name] = this.listeners[name] || []).push(handler); }
+    matches(selector) {
+        // .class, optionally followed by [data-name="value"]
+        const match = /^\.([\w-]+)(?:\[data-([\w-]+)="([^"]*)"\])?$/.exec(selector);
+        if (!match) throw new Error(`Unsupported selector ${selector}`);
+        if (!this.classes().includes(match[1])) return false;
+        if (!match[2]) return true;
+        const key = match[2].replace(/-(\w)/g, (_, letter) => letter.toUpperCase());
+        return String(this.dataset[key]) === match[3];
+    }
+    querySelectorAll(selector) {
+        const found = [];
+        const selectors = selector.split(',').map(part => part.trim());
+        const walk = element => element.children.forEach(child => {
+            if (selectors.some(part => child.matches(part))) found.push(child);
+            walk(child);
+        });
+        walk(this);
+        return found;
+    }
+    querySelector(selector) { return this.querySelectorAll(selector)[0] || null; }
+}
+
+const body = new Element('body');
+const byId = {};
+['friends-list', 'groups-list', 'chat-messages', 'chat-title'].forEach(id => {
+    byId[id] = body.appendChild(new Element('div'));
+});
+const document = {
+    getElementById: id => byId[id] || null,
+    createElement: tagName => new Element(tagName),
+    createDocumentFragment: () => new Element('fragment'),
+    querySelector: selector => body.querySelector(selector),
+    querySelectorAll: selector => body.querySelectorAll(selector),
+    addEventListener: () => {}
+};
+
+const context = vm.createContext({ document, window: {}, console, structuredClone, fetch: () => new Promise(() => {}) });
+vm.runInContext(fs.readFileSync(path.join(__dirname, '..', 'static', 'js', 'chat.js'), 'utf8'), context);
+// Stand-ins for the socket.js functions chat.js calls
+vm.runInContext('currentUserId = 1; function joinChatRoom() {} function markMessageAsRead() {}', context);
+const run = code => vm.runInContext(code, context);
+
+let failures = 0;
+function check(name, ok) {
+    console.log(`${ok ? 'PASS' : 'FAIL'} ${name}`);
+    if (!ok) failures += 1;
+}
+
+const rowDefaults = { last_message_id: null, last_message: null, last_message_time: null,
+                      last_sender_id: null, last_sender_name: null, unread_count: 0 };
+run(`
+    conversations.set(2, ${JSON.stringify({ ...rowDefaults, id: 2, name: 'bob', is_direct: true, user_id: 2, status: 'online', unread_count: 3 })});
+    conversations.set(5, ${JSON.stringify({ ...rowDefaults, id: 5, name: 'ducks', is_direct: false, description: '' })});
+    renderConversations();
+`);
+const friends = byId['friends-list'];
+const groups = byId['groups-list'];
+check('direct chat row rendered', friends.children.length === 1);
+check('group row rendered after the direct chat', groups.children.length === 1);
+const bob = friends.children[0];
+check('direct chat has its status', bob.querySelector('.friend-status').className === 'friend-status status-online');
+check('direct chat shows its unread count', bob.querySelector('.unread-count').textContent === 3);
+
+run(`applyConversationUpdate(${JSON.stringify({ ...rowDefaults, id: 1, name: 'carol', is_direct: true, user_id: 3, status: 'offline', seq: 4 })})`);
+check('new direct chat inserted in id order', friends.children.map(item => item.dataset.id).join() === '1,2');
+check('new direct chat has its status', friends.children[0].querySelector('.friend-status').className === 'friend-status status-offline');
+
+// What receiveMessageUpdate in socket.js does for a message from someone else
+run(`applyConversationUpdate({ id: 5, last_message_id: 9, last_message: 'quack', last_sender_id: 2, last_sender_name: 'bob' }); updateUnreadCountForGroup(5);`);
+check('message delta patches the group row', groups.children[0].title === 'bob: quack');
+check('message delta raises the unread count', groups.children[0].querySelector('.unread-count').textContent === 1);
+check('group row patched in place', groups.children.length === 1);
+
+run(`applyConversationUpdate({ id: 2, unread_count: 0, seq: 5 })`);
+check('read delta clears the unread count', bob.querySelector('.unread-count') === null);
+
+run(`updateUserStatus(2, 'offline')`);
+check('presence patches the status', bob.querySelector('.friend-status').className === 'friend-status status-offline');
+
+console.log(failures ? `${failures} check(s) failed` : 'OK');
+process.exit(failures ? 1 : 0);
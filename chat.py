@@ -1,145 +1,301 @@
-from flask import Blueprint, render_template, jsonify, request, abort
+from flask import Blueprint, render_template, jsonify, request, abort, make_response
 from flask_login import login_required, current_user
 from app import db, socketio
-from models import User, Group, Message, ReadReceipt, user_group
+from models import User, Group, Message, user_group, username_key, direct_chat_pair
+from conversations import get_conversation_summaries, new_conversation_summary, get_new_message_counts, get_latest_message_id
+from membership import membership_index
+from ingest import ingestion, IngestionPending
+from presence import presence
+from storage import read_engine
+from search import search_available, search_messages
+from archive import read_archived_before, read_archived_after, find_archived_message
+from versions import group_version, conversations_version, directory_version
+from events import event_log
+from read_state import get_others_read_cursor, get_seen_by, read_cursor_buffer
 from flask_socketio import emit, join_room, leave_room
 from datetime import datetime
+import hashlib
 import json
 import logging
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, tuple_, select
+from sqlalchemy.exc import IntegrityError
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 chat_bp = Blueprint('chat', __name__)
 
+# Message history paging
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+# Search paging; relevance order has no stable cursor, so pages are offsets
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_OFFSET = 1000
+
+# User directory paging
+USER_PAGE_SIZE = 20
+MAX_USER_PAGE_SIZE = 50
+
 @chat_bp.route('/chat')
 @login_required
 def chat_page():
-    logger.info(f"Chat page accessed by: {current_user.username}")
+    logger.debug("Chat page accessed by: %s", current_user.username)
     try:
-        users = User.query.filter(User.id != current_user.id).all()
-        logger.info(f"Found {len(users)} users")
+        # current_user is a snapshot without relationships, so query the groups
+        user_groups = Group.query.join(
+            user_group, Group.id == user_group.c.group_id
+        ).filter(
+            user_group.c.user_id == current_user.id,
+            Group.is_direct_chat == False
+        ).all()
+        logger.debug("Found %d groups", len(user_groups))
         
-        # Use a filter on the list itself since groups is an InstrumentedList, not a query
-        user_groups = [group for group in current_user.groups if not group.is_direct_chat]
-        logger.info(f"Found {len(user_groups)} groups")
-        
-        logger.info("Rendering chat.html template")
-        return render_template('chat.html', users=users, groups=user_groups)
+        logger.debug("Rendering chat.html template")
+        return render_template('chat.html', groups=user_groups)
     except Exception as e:
-        logger.error(f"Error in chat_page route: {str(e)}")
-        logger.exception("Exception details:")
+        logger.exception("Error in chat_page route: %s", e)
         raise
 
 @chat_bp.route('/api/users')
 @login_required
 def get_users():
-    logger.info(f"Getting users list for: {current_user.username}")
-    users = User.query.filter(User.id != current_user.id).all()
-    user_list = [{
-        'id': user.id,
-        'username': user.username,
-        'status': user.status
-    } for user in users]
-    return jsonify(user_list)
+    """Case-insensitive username prefix search over the user directory.
+
+    ?q=<prefix> may be empty, which lists everyone. Users come in
+    (username_key, id) order, one page at a time; pass the last user's id
+    as ?after= for the next page.
+    """
+    prefix = username_key(request.args.get('q', '').strip())
+    limit = request.args.get('limit', USER_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_USER_PAGE_SIZE))
+    after = request.args.get('after', type=int)
+    
+    query = select(User.id, User.username, User.status).where(User.id != current_user.id)
+    if prefix:
+        # A range scan over ix_user_username_key_id
+        query = query.where(User.username_key >= prefix)
+        end = _prefix_end(prefix)
+        if end is not None:
+            query = query.where(User.username_key < end)
+    
+    with read_engine().connect() as conn:
+        etag = _etag('users', current_user.id, directory_version(conn), prefix, after, limit)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        
+        if after is not None:
+            after_key = conn.execute(select(User.username_key).where(User.id == after)).scalar()
+            if after_key is None:
+                return jsonify({'error': 'Unknown user cursor'}), 400
+            query = query.where(tuple_(User.username_key, User.id) > tuple_(after_key, after))
+        rows = conn.execute(
+            query.order_by(User.username_key, User.id).limit(limit + 1)
+        ).all()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return _tagged(jsonify({
+        'users': [{
+            'id': row.id,
+            'username': row.username,
+            'status': presence.status(row.id, row.status)
+        } for row in rows],
+        'has_more': has_more,
+        'next_after': rows[-1].id if has_more else None
+    }), etag)
+
+def _etag(*parts):
+    """Strong ETag for a response identified by parts, which include a version counter"""
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()[:32]
+
+def _not_modified(etag):
+    """A 304 response if the client's copy is current, otherwise None"""
+    # Weak comparison: compression weakens the ETags it sends (see compression.py)
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return _tagged(make_response('', 304), etag)
+
+def _tagged(response, etag):
+    # Clients keep their copy but must revalidate it on every use
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _prefix_end(prefix):
+    """Smallest string greater than every string starting with prefix, or None"""
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            # Surrogates cannot be encoded, so step over them
+            return prefix[:-1] + chr(0xE000 if last == 0xD7FF else last + 1)
+        prefix = prefix[:-1]
+    return None
 
 @chat_bp.route('/api/conversations')
 @login_required
 def get_conversations():
-    # Get all groups the user is in (including direct chats)
-    user_groups = current_user.groups
-    
-    conversations = []
-    for group in user_groups:
-        # For direct chats, get the other user
-        if group.is_direct_chat:
-            other_user = None
-            for member in group.members:
-                if member.id != current_user.id:
-                    other_user = member
-                    break
-            
-            if other_user:
-                # Get last message and unread count
-                last_message = Message.query.filter_by(group_id=group.id).order_by(Message.timestamp.desc()).first()
-                unread_count = Message.query.filter_by(
-                    group_id=group.id, 
-                    is_read=False
-                ).filter(Message.sender_id != current_user.id).count()
-                
-                conversations.append({
-                    'id': group.id,
-                    'name': other_user.username,
-                    'is_direct': True,
-                    'user_id': other_user.id,
-                    'status': other_user.status,
-                    'last_message': last_message.content if last_message else None,
-                    'last_message_time': last_message.timestamp.isoformat() if last_message else None,
-                    'unread_count': unread_count
-                })
-        else:
-            # For group chats
-            last_message = Message.query.filter_by(group_id=group.id).order_by(Message.timestamp.desc()).first()
-            unread_count = Message.query.filter_by(
-                group_id=group.id, 
-                is_read=False
-            ).filter(Message.sender_id != current_user.id).count()
-            
-            conversations.append({
-                'id': group.id,
-                'name': group.name,
-                'is_direct': False,
-                'description': group.description,
-                'last_message': last_message.content if last_message else None,
-                'last_message_time': last_message.timestamp.isoformat() if last_message else None,
-                'unread_count': unread_count
-            })
-    
-    return jsonify(conversations)
+    with read_engine().connect() as conn:
+        etag = _etag('conversations', current_user.id, conversations_version(conn, current_user.id))
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    
+    # One aggregated query covers all groups the user is in (including direct chats)
+    return _tagged(jsonify(get_conversation_summaries(current_user.id)), etag)
 
 @chat_bp.route('/api/messages/<int:group_id>')
 @login_required
 def get_messages(group_id):
+    """Return one page of a group's message history.
+
+    Pages are keyed by message id: ?before=<id> returns older messages,
+    ?after=<id> returns newer ones and no cursor returns the latest page.
+    Messages within a page are always in chronological order. Pages that
+    run past the oldest message in the table continue in the archive
+    (see archive.py).
+    """
     # Verify user is member of the group
-    group = Group.query.get_or_404(group_id)
-    if current_user not in group.members:
+    if not membership_index.is_member(group_id, current_user.id):
+        Group.query.get_or_404(group_id)
         abort(403)
     
-    # Get messages from the group
-    messages = Message.query.filter_by(group_id=group_id).order_by(Message.timestamp).all()
-    
-    # Mark messages as read
-    unread_messages = Message.query.filter_by(
-        group_id=group_id,
-        is_read=False
-    ).filter(Message.sender_id != current_user.id).all()
-    
-    for message in unread_messages:
-        message.is_read = True
-        # Create read receipt
-        receipt = ReadReceipt(
-            message_id=message.id,
-            user_id=current_user.id
-        )
-        db.session.add(receipt)
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', MESSAGE_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+    if before is not None and after is not None:
+        return jsonify({'error': 'Use either before or after, not both'}), 400
     
-    db.session.commit()
+    # Resolve senders in the same query instead of one lookup per message
+    query = select(
+        Message.id, Message.content, Message.sender_id, Message.timestamp, User.username
+    ).join(
+        User, User.id == Message.sender_id
+    ).where(Message.group_id == group_id)
+    
+    # History reads go through the read-only pool
+    with read_engine().connect() as conn:
+        # The version is read before the messages, so a concurrent write can
+        # only make the ETag older than the page, never newer. Read cursors
+        # don't bump it: opening the chat moves the reader's own cursor, which
+        # the page doesn't show, and the others' cursor is tagged directly.
+        # A sent message is read once any other member's cursor has passed it.
+        others_cursor = get_others_read_cursor(current_user.id, group_id, conn)
+        etag = _etag('messages', current_user.id, group_id, group_version(conn, group_id),
+                     others_cursor, before, after, limit)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        
+        # Seek from the cursor message along the (group_id, timestamp, id) index
+        cursor_id = before if before is not None else after
+        cursor = None
+        archived_cursor = False
+        if cursor_id is not None:
+            cursor_timestamp = conn.execute(
+                select(Message.timestamp).where(Message.id == cursor_id, Message.group_id == group_id)
+            ).scalar()
+            if cursor_timestamp is None:
+                archived = find_archived_message(conn, group_id, cursor_id)
+                if archived is None:
+                    return jsonify({'error': 'Unknown message cursor'}), 400
+                cursor_timestamp, archived_cursor = archived.timestamp, True
+            cursor = (cursor_timestamp, cursor_id)
+            position = tuple_(Message.timestamp, Message.id)
+            if before is not None:
+                query = query.where(position < tuple_(*cursor))
+            else:
+                query = query.where(position > tuple_(*cursor))
+        
+        # Fetch one extra row to learn whether another page exists
+        if after is not None:
+            # Archived messages all come before the ones in the table
+            rows = read_archived_after(conn, group_id, cursor, limit + 1) if archived_cursor else []
+            if len(rows) <= limit:
+                rows += conn.execute(query.order_by(Message.timestamp, Message.id).limit(limit + 1 - len(rows))).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            rows = [] if archived_cursor else conn.execute(
+                query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1)
+            ).all()
+            if len(rows) <= limit:
+                # Read through into the archive once the table runs out
+                oldest = (rows[-1].timestamp, rows[-1].id) if rows else cursor
+                rows += read_archived_before(conn, group_id, oldest, limit + 1 - len(rows))
+            has_more = len(rows) > limit
+            rows = list(reversed(rows[:limit]))
+    
+    # Advance the reader's cursor when the page reaches the newest messages.
+    # It goes through the buffer like mark_read_upto, so the senders get
+    # their read receipts and the reader's other tabs their unread count.
+    if before is None and rows:
+        read_cursor_buffer.add(current_user.id, current_user.username, group_id, rows[-1].id)
     
     # Format messages
-    message_list = []
-    for message in messages:
-        sender = User.query.get(message.sender_id)
-        message_list.append({
-            'id': message.id,
-            'content': message.content,
-            'sender_id': message.sender_id,
-            'sender_name': sender.username,
-            'timestamp': message.timestamp.isoformat(),
-            'is_read': message.is_read
-        })
-    
-    return jsonify(message_list)
+    message_list = [{
+        'id': row.id,
+        'content': row.content,
+        'sender_id': row.sender_id,
+        'sender_name': row.username,
+        'timestamp': row.timestamp.isoformat(),
+        'is_read': row.sender_id != current_user.id or row.id <= others_cursor
+    } for row in rows]
+    
+    return _tagged(jsonify({
+        'messages': message_list,
+        'has_more': has_more
+    }), etag)
+
+@chat_bp.route('/api/messages/<int:group_id>/<int:message_id>/seen_by')
+@login_required
+def get_message_seen_by(group_id, message_id):
+    if not membership_index.is_member(group_id, current_user.id):
+        Group.query.get_or_404(group_id)
+        abort(403)
+    
+    message = Message.query.filter_by(id=message_id, group_id=group_id).first()
+    if message is None:
+        with read_engine().connect() as conn:
+            message = find_archived_message(conn, group_id, message_id)
+        if message is None:
+            abort(404)
+    seen_by = get_seen_by(group_id, message.id, message.sender_id)
+    return jsonify([{
+        'id': user_id,
+        'username': username
+    } for user_id, username in seen_by])
+
+@chat_bp.route('/api/search')
+@login_required
+def search():
+    """Full-text search over the messages of the user's groups.
+
+    ?q=<text> is required and ?group_id=<id> narrows it to one group.
+    Results are ranked by relevance and paged with ?offset=.
+    """
+    if not search_available():
+        return jsonify({'error': 'Search is not available on this database'}), 501
+    
+    # Trailing whitespace is kept: it ends the last word's prefix match
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({'error': 'Missing search query'}), 400
+    group_id = request.args.get('group_id', type=int)
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    offset = max(0, min(request.args.get('offset', 0, type=int), MAX_SEARCH_OFFSET))
+    
+    results = search_messages(current_user.id, query, limit + 1, offset, group_id)
+    has_more = len(results) > limit
+    return jsonify({
+        'results': results[:limit],
+        'has_more': has_more,
+        'next_offset': offset + limit if has_more else None
+    })
 
 @chat_bp.route('/api/create_group', methods=['POST'])
 @login_required
@@ -159,18 +315,26 @@ def create_group():
         creator_id=current_user.id,
         is_direct_chat=False
     )
+    db.session.add(group)
     
-    # Add current user to group
-    group.members.append(current_user)
+    # Add current user to group (current_user is a detached snapshot)
+    group.members.append(db.session.get(User, current_user.id))
     
     # Add other members
     for member_id in member_ids:
         user = User.query.get(member_id)
-        if user and user != current_user:
+        if user and user.id != current_user.id:
             group.members.append(user)
     
-    db.session.add(group)
     db.session.commit()
+    membership_index.invalidate(group.id)
+    
+    # Every member's sidebars pick up the group, on whichever worker they are;
+    # the row is the same for all of them
+    conversation = new_conversation_summary(group)
+    event_log.publish('conversation_updated', [
+        (member_id, conversation) for member_id in membership_index.members(group.id)
+    ])
     
     return jsonify({
         'id': group.id,
@@ -181,79 +345,100 @@ def create_group():
 @chat_bp.route('/api/start_direct_chat/<int:user_id>')
 @login_required
 def start_direct_chat(user_id):
+    if user_id == current_user.id:
+        return jsonify({'error': 'Cannot start a direct chat with yourself'}), 400
     other_user = User.query.get_or_404(user_id)
     
-    # Check if direct chat already exists
-    existing_chat = db.session.query(Group).join(
-        user_group, Group.id == user_group.c.group_id
-    ).filter(
-        Group.is_direct_chat == True,
-        user_group.c.user_id == current_user.id
-    ).join(
-        user_group, Group.id == user_group.c.group_id
-    ).filter(
-        user_group.c.user_id == other_user.id
-    ).first()
-    
-    if existing_chat:
-        return jsonify({
-            'id': existing_chat.id,
-            'name': other_user.username,
-            'is_direct': True
-        })
-    
-    # Create new direct chat
-    group_name = f"Direct: {current_user.username} and {other_user.username}"
-    group = Group(
-        name=group_name,
-        creator_id=current_user.id,
-        is_direct_chat=True
-    )
-    
-    # Add both users to the chat
-    group.members.append(current_user)
-    group.members.append(other_user)
+    # Direct chats are keyed by the ordered pair of members, so finding one
+    # is a single probe of ux_group_direct_pair
+    low, high = direct_chat_pair(current_user.id, other_user.id)
+    existing_chat = _find_direct_chat(low, high)
     
-    db.session.add(group)
-    db.session.commit()
+    if not existing_chat:
+        # Loaded before the group is added, so autoflush cannot insert it early
+        user = db.session.get(User, current_user.id)
+        group_name = f"Direct: {current_user.username} and {other_user.username}"
+        group = Group(
+            name=group_name,
+            creator_id=current_user.id,
+            is_direct_chat=True,
+            dm_low_user_id=low,
+            dm_high_user_id=high
+        )
+        db.session.add(group)
+        
+        # Add both users to the chat
+        group.members.append(user)
+        group.members.append(other_user)
+        
+        try:
+            db.session.commit()
+            existing_chat = group
+        except IntegrityError:
+            # The other user opened the same chat concurrently; use theirs
+            db.session.rollback()
+            existing_chat = _find_direct_chat(low, high)
+            if not existing_chat:
+                raise
+        else:
+            # Both sidebars gain the chat, each under the other's name
+            event_log.publish('conversation_updated', [
+                (member.id, new_conversation_summary(group, other_user if member.id == user.id else user))
+                for member in group.members
+            ])
     
     return jsonify({
-        'id': group.id,
+        'id': existing_chat.id,
         'name': other_user.username,
-        'is_direct': True
+        'is_direct': True,
+        'user_id': other_user.id
     })
 
+def _find_direct_chat(low, high):
+    return Group.query.filter_by(dm_low_user_id=low, dm_high_user_id=high).first()
+
 # Socket.IO events
 @socketio.on('connect')
 def handle_connect():
     if current_user.is_authenticated:
         # Join a room named after the user's ID for direct notifications
         join_room(f"user_{current_user.id}")
-        current_user.status = 'online'
-        db.session.commit()
         
-        # Notify others that user is online
-        emit('status_change', {
-            'user_id': current_user.id,
-            'status': 'online'
-        }, broadcast=True)
+        # The registry tells the user's contacts in its next presence_diff
+        presence.connect(current_user.id, request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     if current_user.is_authenticated:
-        current_user.status = 'offline'
-        db.session.commit()
-        
-        # Notify others that user is offline
-        emit('status_change', {
-            'user_id': current_user.id,
-            'status': 'offline'
-        }, broadcast=True)
+        presence.disconnect(current_user.id, request.sid)
+
+@socketio.on('presence_heartbeat')
+def handle_presence_heartbeat():
+    if current_user.is_authenticated:
+        presence.heartbeat(current_user.id, request.sid)
 
 @socketio.on('join_room')
 def handle_join_room(data):
-    room = data['room']
-    join_room(room)
+    """Join a group_<id> room of a group the user belongs to, or their own user_<id>"""
+    if not current_user.is_authenticated:
+        return
+    try:
+        kind, _, target = data['room'].partition('_')
+        target_id = int(target)
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return
+    
+    # Rooms receive messages and per-user events, so joining is authorised
+    if kind == 'user':
+        allowed = target_id == current_user.id
+    elif kind == 'group':
+        allowed = membership_index.is_member(target_id, current_user.id)
+    else:
+        allowed = False
+    if not allowed:
+        logger.warning("User %s may not join room %r", current_user.id, data['room'])
+        return
+    join_room(f"{kind}_{target_id}")
 
 @socketio.on('leave_room')
 def handle_leave_room(data):
@@ -263,69 +448,88 @@ def handle_leave_room(data):
 @socketio.on('send_message')
 def handle_message(data):
     if not current_user.is_authenticated:
-        return
+        return {'status': 'error', 'error': 'Not authenticated'}
     
-    group_id = data['group_id']
-    content = data['content']
+    try:
+        group_id = int(data['group_id'])
+    except (KeyError, TypeError, ValueError):
+        return {'status': 'error', 'error': 'Invalid group'}
+    # Checked here, as one bad row would fail the whole ingestion batch
+    content = data.get('content')
+    if not isinstance(content, str) or not content.strip():
+        return {'status': 'error', 'error': 'Message content is required'}
     
-    # Verify user is member of the group
-    group = Group.query.get(group_id)
-    if not group or current_user not in group.members:
-        return
+    # Verify user is member of the group; served from memory in steady state
+    if not membership_index.is_member(group_id, current_user.id):
+        return {'status': 'error', 'error': 'Not a member of this group'}
     
-    # Create and save message
-    message = Message(
-        content=content,
-        sender_id=current_user.id,
-        group_id=group_id
-    )
-    db.session.add(message)
-    db.session.commit()
+    # Stored by the group-commit pipeline, which also hands the message to
+    # the fan-out engine once its batch is durable
+    try:
+        message_data = ingestion.submit(current_user.id, current_user.username, group_id, content)
+    except IngestionPending:
+        # Not an error: resending would store it twice. It arrives as a
+        # new_message if the write succeeds.
+        return {'status': 'pending'}
+    if message_data is None:
+        return {'status': 'error', 'error': 'Message could not be stored'}
     
-    # Format response
-    message_data = {
-        'id': message.id,
-        'content': message.content,
-        'sender_id': message.sender_id,
-        'sender_name': current_user.username,
-        'timestamp': message.timestamp.isoformat(),
-        'is_read': False,
-        'group_id': group_id
-    }
-    
-    # Emit to all users in the group
-    emit('new_message', message_data, room=f"group_{group_id}")
-    
-    # Send notifications to all group members
-    for member in group.members:
-        if member.id != current_user.id:
-            emit('message_notification', {
-                'group_id': group_id,
-                'sender_name': current_user.username,
-                'content_preview': content[:30] + ('...' if len(content) > 30 else '')
-            }, room=f"user_{member.id}")
+    return {'status': 'ok', 'id': message_data['id']}
 
 @socketio.on('mark_read')
 def handle_mark_read(data):
-    message_id = data['message_id']
+    """Record that the user has read one message; kept for older clients"""
+    if not current_user.is_authenticated:
+        return
+    
+    try:
+        message_id = int(data['message_id'])
+    except (KeyError, TypeError, ValueError):
+        return
     
     message = Message.query.get(message_id)
     if not message or current_user.id == message.sender_id:
         return
     
-    message.is_read = True
+    read_cursor_buffer.add(current_user.id, current_user.username, message.group_id, message_id)
+
+@socketio.on('mark_read_upto')
+def handle_mark_read_upto(data):
+    """Record that the user has read a group up to and including message_id"""
+    if not current_user.is_authenticated:
+        return
     
-    # Create read receipt
-    receipt = ReadReceipt(
-        message_id=message_id,
-        user_id=current_user.id
-    )
-    db.session.add(receipt)
-    db.session.commit()
+    try:
+        group_id = int(data['group_id'])
+        message_id = int(data['message_id'])
+    except (KeyError, TypeError, ValueError):
+        return
+    
+    # Membership is enforced when the buffer flushes
+    read_cursor_buffer.add(current_user.id, current_user.username, group_id, message_id)
+
+@socketio.on('sync')
+def handle_sync(data):
+    """Replay the user-room events a reconnecting client missed.
+
+    data['seq'] is the last sequence number the client saw and
+    data['message_id'] the newest message id, or null to learn the current
+    ones. The ack carries the missed events in order and, per group, how
+    many messages arrived since message_id; or reset=True if the client
+    has to reload because some events are gone.
+    """
+    if not current_user.is_authenticated:
+        return {'status': 'error', 'error': 'Not authenticated'}
+    
+    data = data if isinstance(data, dict) else {}
+    seq, message_id = data.get('seq'), data.get('message_id')
+    for value in (seq, message_id):
+        if value is not None and (not isinstance(value, int) or value < 0):
+            return {'status': 'error', 'error': 'Invalid sequence number'}
     
-    # Notify sender that message was read
-    emit('message_read', {
-        'message_id': message_id,
-        'reader_id': current_user.id,
-        'reader_name': current_user.username
-    }, room=f"user_{message.sender_id}")
+    # Read first, so messages stored while the counts run are left for the next sync
+    latest_message_id = get_latest_message_id()
+    result = event_log.since(current_user.id, seq)
+    if message_id is not None and not result.get('reset'):
+        result['messages'] = get_new_message_counts(current_user.id, message_id, latest_message_id)
+    return {'status': 'ok', 'message_id': latest_message_id, **result}
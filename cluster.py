@@ -0,0 +1,88 @@
+from app import app, socketio
+import json
+import threading
+import uuid
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ClusterBus:
+    """Broadcasts cache invalidations to the other workers of a cluster.
+
+    Socket.IO emits already cross workers through SOCKETIO_MESSAGE_QUEUE,
+    but the in-process caches (membership index, identity cache) would
+    otherwise keep serving entries another worker has invalidated. Each
+    invalidation is published on a Redis channel next to the Socket.IO
+    one and applied by every other worker. Without a message queue the
+    bus does nothing.
+    """
+
+    def __init__(self, url=None, channel='wequack'):
+        self.url = url
+        self.channel = f"{channel}:invalidate"
+        self.worker_id = uuid.uuid4().hex
+        self._handlers = {}
+        self._redis = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.url)
+
+    def _client(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.url)
+        return self._redis
+
+    def subscribe(self, kind, handler):
+        """Call handler(ids) whenever another worker publishes an invalidation of kind.
+
+        ids is None when the whole cache should be dropped.
+        """
+        self._handlers[kind] = handler
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = socketio.start_background_task(self._listen)
+
+    def publish(self, kind, ids=None):
+        """Tell the other workers to drop ids from a cache; None drops everything"""
+        if not self.enabled:
+            return
+        try:
+            self._client().publish(self.channel, json.dumps({
+                'worker': self.worker_id,
+                'kind': kind,
+                'ids': None if ids is None else list(ids)
+            }))
+        except Exception:
+            # The other workers' caches expire their entries by TTL
+            logger.exception("Failed to publish %s invalidation", kind)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self._dispatch(message['data'])
+            except Exception:
+                logger.exception("Cluster bus connection lost, reconnecting")
+                socketio.sleep(1)
+
+    def _dispatch(self, data):
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            return
+        if payload.get('worker') == self.worker_id:
+            return
+        handler = self._handlers.get(payload.get('kind'))
+        if handler is not None:
+            handler(payload.get('ids'))
+
+cluster_bus = ClusterBus(app.config.get('SOCKETIO_MESSAGE_QUEUE'), app.config.get('SOCKETIO_CHANNEL', 'wequack'))
@@ -0,0 +1,51 @@
+from flask import request
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text formats worth compressing; images, fonts and archives already are
+COMPRESSIBLE_TYPES = frozenset([
+    'application/json', 'application/javascript', 'text/html', 'text/css',
+    'text/javascript', 'text/plain', 'image/svg+xml'
+])
+
+def _compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'])
+
+def init_compression(app):
+    """Compress large text responses with brotli or gzip per Accept-Encoding.
+
+    Streamed responses (send_file) are left alone. A compressed response's
+    ETag is weakened, as the bytes differ from the uncompressed
+    representation; conditional requests compare ETags weakly.
+    """
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+
+        # The representation depends on Accept-Encoding whatever the size
+        response.vary.add('Accept-Encoding')
+        if response.content_length is None or response.content_length < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        response.set_data(_compress(response.get_data(), encoding, app.config))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,178 @@
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import aliased
+from storage import read_engine
+from presence import presence
+from models import User, Group, Message, user_group
+
+def get_conversation_summaries(user_id):
+    """Build the sidebar rows for every conversation a user belongs to.
+
+    Everything is resolved in a single statement: the last message and the
+    unread count are correlated subqueries that seek along the
+    (group_id, timestamp, id) message index, and the other participant of
+    a direct chat is an outer join on the membership table. The cost is one
+    round trip on the read-only pool no matter how many groups the user is
+    in.
+    """
+    membership = user_group.alias('membership')
+    other_membership = user_group.alias('other_membership')
+    other_user = aliased(User, name='other_user')
+    last_message = aliased(Message, name='last_message')
+    last_sender = aliased(User, name='last_sender')
+
+    last_message_id = select(Message.id).where(
+        Message.group_id == Group.id
+    ).order_by(
+        Message.timestamp.desc(), Message.id.desc()
+    ).limit(1).correlate(Group).scalar_subquery()
+
+    # Unread messages are the ones past the member's read cursor
+    unread_count = select(func.count(Message.id)).where(
+        Message.group_id == Group.id,
+        Message.id > func.coalesce(membership.c.last_read_message_id, 0),
+        Message.sender_id != user_id
+    ).correlate(Group, membership).scalar_subquery()
+
+    query = select(
+        Group.id,
+        Group.name,
+        Group.description,
+        Group.is_direct_chat,
+        other_user.id.label('other_user_id'),
+        other_user.username.label('other_username'),
+        other_user.status.label('other_status'),
+        last_message.id.label('last_message_id'),
+        last_message.content.label('last_message'),
+        last_message.timestamp.label('last_message_time'),
+        last_message.sender_id.label('last_sender_id'),
+        last_sender.username.label('last_sender_name'),
+        unread_count.label('unread_count')
+    ).join(
+        membership, and_(membership.c.group_id == Group.id, membership.c.user_id == user_id)
+    ).outerjoin(
+        other_membership, and_(
+            Group.is_direct_chat == True,
+            other_membership.c.group_id == Group.id,
+            other_membership.c.user_id != user_id
+        )
+    ).outerjoin(
+        other_user, other_user.id == other_membership.c.user_id
+    ).outerjoin(
+        last_message, last_message.id == last_message_id
+    ).outerjoin(
+        last_sender, last_sender.id == last_message.sender_id
+    ).order_by(Group.id)
+
+    with read_engine().connect() as conn:
+        rows = conn.execute(query).all()
+
+    conversations = []
+    for row in rows:
+        if row.is_direct_chat:
+            # Skip direct chats whose other participant no longer exists
+            if row.other_user_id is None:
+                continue
+            conversation = {
+                'id': row.id,
+                'name': row.other_username,
+                'is_direct': True,
+                'user_id': row.other_user_id,
+                'status': presence.status(row.other_user_id, row.other_status)
+            }
+        else:
+            conversation = {
+                'id': row.id,
+                'name': row.name,
+                'is_direct': False,
+                'description': row.description
+            }
+        conversation.update({
+            'last_message_id': row.last_message_id,
+            'last_message': row.last_message,
+            'last_message_time': row.last_message_time.isoformat() if row.last_message_time else None,
+            'last_sender_id': row.last_sender_id,
+            'last_sender_name': row.last_sender_name,
+            'unread_count': row.unread_count
+        })
+        conversations.append(conversation)
+
+    return conversations
+
+def new_conversation_summary(group, other_user=None):
+    """The sidebar row of a conversation that has no messages yet.
+
+    other_user is the participant a direct chat is shown as.
+    """
+    if group.is_direct_chat:
+        conversation = {
+            'id': group.id,
+            'name': other_user.username,
+            'is_direct': True,
+            'user_id': other_user.id,
+            'status': presence.status(other_user.id, other_user.status)
+        }
+    else:
+        conversation = {
+            'id': group.id,
+            'name': group.name,
+            'is_direct': False,
+            'description': group.description
+        }
+    conversation.update({
+        'last_message_id': None,
+        'last_message': None,
+        'last_message_time': None,
+        'last_sender_id': None,
+        'last_sender_name': None,
+        'unread_count': 0
+    })
+    return conversation
+
+def get_new_message_counts(user_id, after_id, upto_id):
+    """Messages with ids in (after_id, upto_id], per group of a user.
+
+    Message ids only grow, so a client that remembers the newest id it has
+    seen learns where it missed messages from one aggregate over the id
+    range. count only includes messages from others; the newest message of
+    each group comes along for the sidebar.
+    """
+    missed = select(
+        Message.group_id,
+        func.count(Message.id).filter(Message.sender_id != user_id).label('count'),
+        func.max(Message.id).label('last_message_id')
+    ).join(
+        user_group, and_(user_group.c.group_id == Message.group_id, user_group.c.user_id == user_id)
+    ).where(
+        Message.id > after_id,
+        Message.id <= upto_id
+    ).group_by(Message.group_id).subquery()
+
+    with read_engine().connect() as conn:
+        rows = conn.execute(
+            select(
+                missed.c.group_id,
+                missed.c.count,
+                missed.c.last_message_id,
+                Message.content,
+                Message.timestamp,
+                Message.sender_id,
+                User.username
+            ).join(
+                Message, Message.id == missed.c.last_message_id
+            ).outerjoin(
+                User, User.id == Message.sender_id
+            )
+        ).all()
+    return [{
+        'group_id': row.group_id,
+        'count': row.count,
+        'last_message_id': row.last_message_id,
+        'last_message': row.content,
+        'last_message_time': row.timestamp.isoformat(),
+        'last_sender_id': row.sender_id,
+        'last_sender_name': row.username
+    } for row in rows]
+
+def get_latest_message_id():
+    with read_engine().connect() as conn:
+        return conn.execute(select(func.max(Message.id))).scalar() or 0
@@ -1,14 +1,134 @@
-from flask import send_file, Blueprint
+from flask import send_file, Blueprint, current_app
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
 
 download_bp = Blueprint('download', __name__)
 
+DOWNLOAD_NAME = 'literate-couscous-clean.zip'
+
+# The only files that go into the archive, relative to the app root. The
+# download is public, so anything else in the tree (local config, virtual
+# environments, logs, databases, benchmark output) stays out by default.
+INCLUDED_PATTERNS = (
+    '*.py', 'README.md', 'pyproject.toml', 'requirements.txt', 'dependencies.txt', '.gitignore',
+    'templates/*.html', 'static/css/*.css', 'static/fonts/*.css', 'static/js/*.js'
+)
+
+# Archives kept besides the newest, for workers still serving them
+KEEP_ARCHIVES = 1
+# Age in seconds after which a temporary file is taken to be left by a crash
+STALE_TMP_AGE = 3600
+
+class ProjectArchive:
+    """A zip of the source tree, cached on disk by a hash of its sources.
+
+    The hash covers every file's path, size and modification time, so
+    checking whether the cached archive is current costs a glob and a stat
+    per source; the archive is rebuilt only when a source changes. The
+    hash doubles as the download's ETag.
+
+    Workers of a cluster may share cache_dir: each writes to its own
+    temporary file and renames it into place, and cleanup leaves recent
+    archives and other workers' temporary files alone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def _sources(self, root):
+        names = set()
+        for pattern in INCLUDED_PATTERNS:
+            names.update(glob.glob(pattern, root_dir=root))
+        sources = []
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            sources.append((name.replace(os.sep, '/'), path, stat.st_size, stat.st_mtime_ns))
+        return sources
+
+    def get(self, root, cache_dir):
+        """Path and content hash of an archive of root, building it if needed"""
+        sources = self._sources(root)
+        digest = hashlib.sha256()
+        for name, _, size, mtime in sources:
+            digest.update(f"{name}\0{size}\0{mtime}\n".encode())
+        etag = digest.hexdigest()[:32]
+        path = os.path.join(cache_dir, f"{etag}.zip")
+        if os.path.exists(path):
+            return path, etag
+
+        with self._lock:
+            if not os.path.exists(path):
+                self._build(sources, cache_dir, path)
+        return path, etag
+
+    def _build(self, sources, cache_dir, path):
+        started = time.monotonic()
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        try:
+            # Sources are copied into the zip in chunks, never held in memory whole
+            with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for name, source, _, _ in sources:
+                    archive.write(source, name)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._cleanup(cache_dir, path)
+        logger.info("Built the project archive (%d files) in %.2fs",
+                    len(sources), time.monotonic() - started)
+
+    def _cleanup(self, cache_dir, current):
+        now = time.time()
+        archives = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            try:
+                mtime = os.stat(path).st_mtime
+                if name.endswith('.tmp'):
+                    # Another worker may be writing it
+                    if now - mtime > STALE_TMP_AGE:
+                        os.remove(path)
+                elif name.endswith('.zip') and path != current:
+                    archives.append((mtime, path))
+            except FileNotFoundError:
+                # Removed by another worker's cleanup
+                continue
+        for _, path in sorted(archives, reverse=True)[KEEP_ARCHIVES:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+project_archive = ProjectArchive()
+
 @download_bp.route('/download')
 def download_project():
     """Route to download the project zip file"""
-    try:
-        return send_file('literate-couscous-clean.zip',
-                        mimetype='application/zip',
-                        as_attachment=True,
-                        download_name='literate-couscous-clean.zip')
-    except Exception as e:
-        return str(e)
\ No newline at end of file
+    path, etag = project_archive.get(
+        current_app.root_path,
+        os.path.join(current_app.instance_path, 'download')
+    )
+    # Conditional responses handle If-None-Match and Range/If-Range; the
+    # file goes out through the server's file wrapper (sendfile) or, with
+    # USE_X_SENDFILE, through the front proxy
+    return send_file(path,
+                     mimetype='application/zip',
+                     as_attachment=True,
+                     download_name=DOWNLOAD_NAME,
+                     conditional=True,
+                     etag=etag,
+                     max_age=0)
@@ -0,0 +1,167 @@
+from sqlalchemy import select, delete, insert, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from app import app, db, socketio
+from models import user_event, version_counter
+from storage import read_engine
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+import json
+import threading
+
+class EventLog:
+    """Per-user log of the events sent to user rooms.
+
+    Every logged event emitted to a user_<id> room gets the next number of
+    that user's sequence (the 'events' scope of version_counter, allocated in the
+    database so workers of a cluster never hand out the same number) and is
+    stored in user_event; the last EVENT_LOG_SIZE events of each user are
+    kept. A client that reconnects sends the last sequence number it saw in
+    a sync event and gets back only what it missed, or a reset when part of
+    the gap is gone and it has to reload.
+
+    A single worker also keeps the last EVENT_LOG_MEMORY events of recently
+    active users in memory, so catching up after a short disconnect costs
+    no query.
+
+    New messages are not logged: storing a row per member and message would
+    multiply the cost of a fan-out, and the message table already orders
+    them by id (see get_new_message_counts).
+    """
+    # Stored events are trimmed whenever a user's sequence passes a multiple of this
+    trim_every = 100
+    # Users whose recent events are kept in memory
+    max_users = 10000
+
+    def __init__(self, clustered=False):
+        self.clustered = clustered
+        # user_id -> deque of (seq, event, data), most recently used user last
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publish(self, event, deliveries):
+        """Log an event for each (user_id, data) in deliveries, then emit it.
+
+        All of them are stored in one transaction; a user may appear more
+        than once.
+        """
+        deliveries = list(deliveries)
+        if not deliveries:
+            return
+        counts = Counter(user_id for user_id, _ in deliveries)
+        with db.engine.begin() as conn:
+            # Each user's counter moves past all of their events at once
+            last = dict(conn.execute(_next_seq_statement(), [
+                {'scope': 'events', 'key': user_id, 'version': count}
+                for user_id, count in counts.items()
+            ]).all())
+            next_seq = {user_id: last[user_id] - count + 1 for user_id, count in counts.items()}
+            entries = []
+            for user_id, data in deliveries:
+                entries.append((user_id, next_seq[user_id], data))
+                next_seq[user_id] += 1
+
+            # Fan-outs share one data object between users; encode it once
+            encoded = {}
+            for _, _, data in entries:
+                if id(data) not in encoded:
+                    encoded[id(data)] = json.dumps(data)
+            created_at = datetime.utcnow()
+            conn.execute(insert(user_event), [{
+                'user_id': user_id,
+                'seq': seq,
+                'event': event,
+                'payload': encoded[id(data)],
+                'created_at': created_at
+            } for user_id, seq, data in entries])
+
+            size = app.config.get('EVENT_LOG_SIZE', 1000)
+            trims = [{'target_user_id': user_id, 'floor': seq - size}
+                     for user_id, seq in last.items()
+                     if seq > size and seq // self.trim_every != (seq - counts[user_id]) // self.trim_every]
+            if trims:
+                conn.execute(delete(user_event).where(
+                    user_event.c.user_id == bindparam('target_user_id'),
+                    user_event.c.seq <= bindparam('floor')
+                ), trims)
+
+        if not self.clustered:
+            self._remember(event, entries)
+        for user_id, seq, data in entries:
+            socketio.emit(event, {**data, 'seq': seq}, room=f"user_{user_id}")
+
+    def _remember(self, event, entries):
+        limit = app.config.get('EVENT_LOG_MEMORY', 100)
+        with self._lock:
+            for user_id, seq, data in entries:
+                recent = self._recent.get(user_id)
+                if recent is None:
+                    recent = self._recent[user_id] = deque(maxlen=limit)
+                    if len(self._recent) > self.max_users:
+                        self._recent.popitem(last=False)
+                else:
+                    self._recent.move_to_end(user_id)
+                recent.append((seq, event, data))
+
+    def since(self, user_id, after):
+        """What a client that last saw seq after needs to catch up.
+
+        Returns {'seq': latest, 'events': [...]} with the missed events in
+        order, or {'seq': latest, 'reset': True} if some of them are no
+        longer kept. after=None only asks for the latest seq.
+        """
+        if after is not None and not self.clustered:
+            events = self._from_memory(user_id, after)
+            if events is not None:
+                return {'seq': events[-1]['seq'] if events else after, 'events': events}
+
+        with read_engine().connect() as conn:
+            latest = conn.execute(
+                select(version_counter.c.version).where(
+                    version_counter.c.scope == 'events',
+                    version_counter.c.key == user_id
+                )
+            ).scalar() or 0
+            if after is None or after == latest:
+                return {'seq': latest, 'events': []}
+            # More missed than is kept, or a sequence from another database
+            if after > latest or latest - after > app.config.get('EVENT_LOG_SIZE', 1000):
+                return {'seq': latest, 'reset': True}
+            rows = conn.execute(
+                select(user_event.c.seq, user_event.c.event, user_event.c.payload).where(
+                    user_event.c.user_id == user_id,
+                    user_event.c.seq > after,
+                    user_event.c.seq <= latest
+                ).order_by(user_event.c.seq)
+            ).all()
+        # Anything missing from the run has been trimmed
+        if len(rows) != latest - after or rows[0].seq != after + 1:
+            return {'seq': latest, 'reset': True}
+        return {'seq': latest, 'events': [
+            {'seq': row.seq, 'event': row.event, 'data': json.loads(row.payload)} for row in rows
+        ]}
+
+    def _from_memory(self, user_id, after):
+        """The events after seq after if memory holds all of them, otherwise None"""
+        with self._lock:
+            recent = self._recent.get(user_id)
+            if not recent:
+                return None
+            missed = sorted(entry for entry in recent if entry[0] > after)
+        # Events are remembered after their transaction commits, possibly out
+        # of order, so the run must be complete from after + 1
+        if not missed:
+            seqs = [entry[0] for entry in recent]
+            return [] if min(seqs) <= after + 1 and after <= max(seqs) else None
+        if missed[0][0] != after + 1 or missed[-1][0] - missed[0][0] != len(missed) - 1:
+            return None
+        return [{'seq': seq, 'event': event, 'data': data} for seq, event, data in missed]
+
+def _next_seq_statement():
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    insert_counter = dialect.insert(version_counter)
+    return insert_counter.on_conflict_do_update(
+        index_elements=[version_counter.c.scope, version_counter.c.key],
+        set_={'version': version_counter.c.version + insert_counter.excluded.version}
+    ).returning(version_counter.c.key, version_counter.c.version)
+
+event_log = EventLog(clustered=bool(app.config.get('SOCKETIO_MESSAGE_QUEUE')))
@@ -0,0 +1,72 @@
+from app import app, socketio
+from membership import membership_index
+import threading
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class FanoutEngine:
+    """Delivers new messages to their audience off the sender's request.
+
+    send_message only persists the message and hands it to submit(); the
+    new_message room emit and the per-member conversation_updated emits run
+    on background workers. Jobs are sharded by group so every group's
+    messages are still delivered in order. With zero workers delivery
+    happens inline, which is the old behaviour.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._queues = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._queues is None:
+                queues = [socketio.server.eio.create_queue() for _ in range(self.workers)]
+                for jobs in queues:
+                    socketio.start_background_task(self._run, jobs)
+                self._queues = queues
+        return self._queues
+
+    def submit(self, group_id, message_data):
+        if self.workers <= 0:
+            self.deliver(group_id, message_data)
+            return
+        queues = self._queues or self._start()
+        queues[group_id % len(queues)].put((group_id, message_data))
+
+    def pending(self):
+        """Number of messages waiting for delivery"""
+        return sum(jobs.qsize() for jobs in self._queues or ())
+
+    def _run(self, jobs):
+        while True:
+            group_id, message_data = jobs.get()
+            try:
+                with app.app_context():
+                    self.deliver(group_id, message_data)
+            except Exception:
+                logger.exception("Failed to deliver message %s", message_data.get('id'))
+
+    def deliver(self, group_id, message_data):
+        # Everyone viewing the group
+        socketio.emit('new_message', message_data, room=f"group_{group_id}")
+
+        # Every member's sidebar row moves to the new last message through
+        # their personal room. These updates are not logged per member; a
+        # reconnecting client counts what it missed from the message table.
+        # Clients raise the unread count for messages from others.
+        update = {
+            'id': group_id,
+            'last_message_id': message_data['id'],
+            'last_message': message_data['content'],
+            'last_message_time': message_data['timestamp'],
+            'last_sender_id': message_data['sender_id'],
+            'last_sender_name': message_data['sender_name']
+        }
+        for member_id in membership_index.members(group_id):
+            socketio.emit('conversation_updated', update, room=f"user_{member_id}")
+
+fanout = FanoutEngine(app.config.get('FANOUT_WORKERS', 4))
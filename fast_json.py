@@ -0,0 +1,70 @@
+from decimal import Decimal
+from flask.json.provider import JSONProvider
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Non-string keys are converted like the standard library does
+_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+def _default(obj):
+    # What orjson does not know natively but Flask's provider handles
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson.
+
+    Responses are built from orjson's bytes directly instead of going
+    through a str. Datetimes are written in ISO 8601 rather than Flask's
+    HTTP date format; the API already sends its timestamps as ISO strings.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=_OPTIONS),
+            mimetype='application/json'
+        )
+
+class SocketIOJSON:
+    """The dumps/loads pair python-socketio expects from a json module"""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+def init_json(app):
+    """Install the configured JSON provider and return the json module for Socket.IO.
+
+    Returns None, which keeps python-socketio's default, unless orjson is
+    selected and installed.
+    """
+    if app.config['JSON_PROVIDER'] != 'orjson':
+        return None
+    if orjson is None:
+        logger.warning("orjson is not installed; using the standard JSON provider")
+        return None
+    app.json = OrjsonProvider(app)
+    return SocketIOJSON
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from sqlalchemy import select
+from flask_login import UserMixin
+from app import app, db
+from models import User
+from cluster import cluster_bus
+import threading
+import time
+
+class UserSnapshot(UserMixin):
+    """Detached, read-only copy of the User columns requests need.
+
+    This is what current_user is. It is not attached to a session, so code
+    that needs the ORM object (relationships, changes) must load the User.
+    """
+    __slots__ = ('id', 'username', 'email', 'status')
+
+    def __init__(self, id, username, email, status):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.status = status
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.username}>'
+
+class IdentityCache:
+    """Per-process LRU cache of user snapshots behind the login manager.
+
+    Entries live for ttl seconds and are dropped explicitly when a user
+    logs out, registers or changes status, so an authenticated socket
+    event or request costs no database round trip in steady state.
+    """
+
+    def __init__(self, ttl=60, capacity=10000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with one is not cached
+        self._generation = 0
+
+    def get(self, user_id):
+        """Return the snapshot of a user, or None if there is no such user"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._users.move_to_end(user_id)
+                return entry[0]
+            generation = self._generation
+
+        row = db.session.execute(
+            select(User.id, User.username, User.email, User.status).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(*row)
+
+        with self._lock:
+            if generation != self._generation:
+                return snapshot
+            self._users[user_id] = (snapshot, now + self.ttl)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.capacity:
+                self._users.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, *user_ids):
+        self._drop(user_ids)
+        cluster_bus.publish('identity', user_ids)
+
+    def clear(self):
+        self._drop(None)
+        cluster_bus.publish('identity')
+
+    def _drop(self, user_ids):
+        with self._lock:
+            if user_ids is None:
+                self._users.clear()
+            for user_id in user_ids or ():
+                self._users.pop(user_id, None)
+            self._generation += 1
+
+identity_cache = IdentityCache(
+    ttl=app.config.get('IDENTITY_CACHE_TTL', 60),
+    capacity=app.config.get('IDENTITY_CACHE_SIZE', 10000)
+)
+cluster_bus.subscribe('identity', identity_cache._drop)
@@ -0,0 +1,164 @@
+from datetime import datetime
+from sqlalchemy import insert
+from app import app, db, socketio
+from models import Message
+from fanout import fanout
+from versions import bump_versions
+import threading
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class IngestionPending(Exception):
+    """A message was not stored in time, but its write is underway"""
+
+class IngestionPipeline:
+    """Group-commit writer for chat messages.
+
+    send_message handlers queue their message and wait. A single writer
+    collects everything that arrives within flush_interval seconds of the
+    first queued message (at most batch_size messages), stores the batch
+    with one multi-row INSERT ... RETURNING and one commit, and then wakes
+    the waiting handlers with the assigned ids. new_message is only handed
+    to the fan-out engine once the batch is durable.
+
+    If a batch fails, its messages are retried one at a time, so a bad
+    message cannot take the others down with it. A batch_size of 1 writes
+    each message in its own transaction on the caller's thread, which is
+    the old behaviour.
+    """
+
+    def __init__(self, batch_size=256, flush_interval=0.002, timeout=10):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._queue is None:
+                self._empty = socketio.server.eio.get_queue_empty_exception()
+                self._queue = socketio.server.eio.create_queue()
+                socketio.start_background_task(self._run)
+        return self._queue
+
+    def submit(self, sender_id, sender_name, group_id, content):
+        """Store a message and return its payload, or None if it was not stored.
+
+        If the writer has not finished with the message within timeout
+        seconds, a message it has not picked up yet is withdrawn and None is
+        returned; one it is already writing raises IngestionPending, as it
+        may still be stored and delivered.
+        """
+        item = {
+            'row': {
+                'content': content,
+                'sender_id': sender_id,
+                'group_id': group_id,
+                'timestamp': datetime.utcnow()
+            },
+            'sender_name': sender_name,
+            'message_data': None
+        }
+        if self.batch_size <= 1:
+            try:
+                self._write([item])
+            except Exception:
+                logger.exception("Failed to store a message from user %s", sender_id)
+            return item['message_data']
+
+        # Hand the caller's connection back to the pool while it waits, so
+        # waiting handlers cannot starve the writer of connections
+        db.session.close()
+        item['done'] = socketio.server.eio.create_event()
+        (self._queue or self._start()).put(item)
+        if not item['done'].wait(self.timeout):
+            with self._lock:
+                if not item.get('claimed'):
+                    # Still queued; the writer skips it
+                    item['withdrawn'] = True
+                    logger.error("Timed out waiting for message ingestion")
+                    return None
+            raise IngestionPending()
+        return item['message_data']
+
+    def _claim(self, batch):
+        """The items of batch whose handlers are still waiting"""
+        with self._lock:
+            claimed = [item for item in batch if not item.get('withdrawn')]
+            for item in claimed:
+                item['claimed'] = True
+        return claimed
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except self._empty:
+                    break
+            claimed = self._claim(batch)
+            try:
+                if claimed:
+                    with app.app_context():
+                        self._write(claimed)
+            except Exception:
+                logger.exception("Failed to store a batch of %d messages", len(batch))
+            finally:
+                for item in batch:
+                    item['done'].set()
+
+    def _insert(self, rows):
+        try:
+            message_ids = db.session.execute(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                rows
+            ).scalars().all()
+            bump_versions(db.session, groups=[row['group_id'] for row in rows])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return message_ids
+
+    def _write(self, batch):
+        try:
+            message_ids = self._insert([item['row'] for item in batch])
+        except Exception:
+            if len(batch) == 1:
+                raise
+            # One bad row fails the whole statement; store the rows one at a
+            # time so only that one fails
+            logger.exception("Failed to store a batch of %d messages, retrying them one at a time", len(batch))
+            for item in batch:
+                try:
+                    self._write([item])
+                except Exception:
+                    logger.exception("Failed to store a message from user %s", item['row']['sender_id'])
+            return
+
+        for item, message_id in zip(batch, message_ids):
+            row = item['row']
+            item['message_data'] = {
+                'id': message_id,
+                'content': row['content'],
+                'sender_id': row['sender_id'],
+                'sender_name': item['sender_name'],
+                'timestamp': row['timestamp'].isoformat(),
+                'is_read': False,
+                'group_id': row['group_id']
+            }
+            fanout.submit(row['group_id'], item['message_data'])
+
+ingestion = IngestionPipeline(
+    batch_size=app.config.get('INGEST_BATCH_SIZE', 256),
+    flush_interval=app.config.get('INGEST_FLUSH_INTERVAL', 2) / 1000.0
+)
@@ -0,0 +1,159 @@
+from logging.handlers import QueueHandler, QueueListener
+from eventlet.patcher import original
+import atexit
+import json
+import logging
+import sys
+
+# The writer must be a real OS thread even when the standard library has
+# been monkey patched, or writes would block the event loop again
+_queue = original('queue')
+_threading = original('threading')
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime', 'taskName'
+}
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; extra= fields become top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Thin out high-volume records.
+
+    Records are grouped by logger and message template, which stay stable
+    because messages are formatted lazily. Each group passes `burst` records
+    per second and then one in `every`; the next record that passes carries
+    the number skipped as `sampled_out`. WARNING and above always pass.
+    """
+
+    def __init__(self, burst=20, every=100):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.every <= 1:
+            return True
+        key = (record.name, record.msg)
+        second = int(record.created)
+        # Races between threads only make the sampling slightly less exact
+        window = self._windows.get(key)
+        if window is None or window[0] != second:
+            skipped = window[2] if window else 0
+            window = self._windows[key] = [second, 0, skipped]
+            if len(self._windows) > 10000:
+                self._windows.clear()
+        window[1] += 1
+        if window[1] > self.burst and (window[1] - self.burst) % self.every:
+            window[2] += 1
+            return False
+        if window[2]:
+            record.sampled_out = window[2]
+            window[2] = 0
+        return True
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped"""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format the message on the caller while its arguments are still
+        # current; the JSON encoding and the write happen on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if self.dropped:
+            record.dropped = self.dropped
+            self.dropped = 0
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except _queue.Full:
+            self.dropped += 1
+
+class _WriterListener(QueueListener):
+    def start(self):
+        self._thread = _threading.Thread(target=self._monitor, name='log-writer', daemon=True)
+        self._thread.start()
+
+_listener = None
+
+def parse_levels(spec):
+    """Parse "chat=DEBUG,engineio=WARNING" into {logger name: level}"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, _, level = item.strip().partition('=')
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging(config):
+    """Route all logging through the background writer.
+
+    Reads LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE,
+    LOG_SAMPLE_BURST and LOG_SAMPLE_EVERY from config.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    if config.get('LOG_FILE'):
+        output = logging.FileHandler(config['LOG_FILE'], encoding='utf-8')
+    else:
+        output = logging.StreamHandler(sys.stderr)
+    if config.get('LOG_FORMAT', 'json') == 'json':
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    # Only the writer thread takes this lock, so it must not be a green one
+    output.lock = _threading.RLock()
+
+    handler = _DroppingQueueHandler(_queue.Queue(config.get('LOG_QUEUE_SIZE', 10000)))
+    handler.addFilter(SamplingFilter(config.get('LOG_SAMPLE_BURST', 20), config.get('LOG_SAMPLE_EVERY', 100)))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config.get('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(config.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = _WriterListener(handler.queue, output)
+    _listener.start()
+
+def flush_logging():
+    """Write out everything queued and stop the writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(flush_logging)
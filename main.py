@@ -1,3 +1,11 @@
+import os
+
+# The Redis message queue client uses blocking sockets, so under eventlet the
+# standard library must be patched before anything else is imported
+if os.environ.get("SOCKETIO_MESSAGE_QUEUE"):
+    import eventlet
+    eventlet.monkey_patch()
+
 from app import app, socketio
 
 # This is for Gunicorn to use when serving the app
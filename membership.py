@@ -0,0 +1,113 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session, object_session, configure_mappers
+from app import app, db
+from models import User, Group, user_group
+from cluster import cluster_bus
+import threading
+import time
+
+class MembershipIndex:
+    """In-process LRU index of group memberships.
+
+    Maps group_id to the sorted member user ids, stored as a compact
+    array('q') so that even large groups cost 8 bytes per member. A miss
+    loads the group's memberships with one indexed query; hits never touch
+    the database. Entries are invalidated whenever membership changes and
+    live for ttl seconds, which bounds how long a worker that missed a
+    cluster invalidation keeps a stale member list.
+    """
+
+    def __init__(self, ttl=60, capacity=10000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with one is not cached
+        self._generation = 0
+
+    def members(self, group_id):
+        """Return the sorted user ids of a group's members"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._groups.get(group_id)
+            if entry is not None and entry[1] > now:
+                self._groups.move_to_end(group_id)
+                return entry[0]
+            generation = self._generation
+
+        member_ids = array('q', sorted(db.session.execute(
+            select(user_group.c.user_id).where(user_group.c.group_id == group_id)
+        ).scalars()))
+
+        with self._lock:
+            if generation != self._generation:
+                return member_ids
+            self._groups[group_id] = (member_ids, now + self.ttl)
+            self._groups.move_to_end(group_id)
+            while len(self._groups) > self.capacity:
+                self._groups.popitem(last=False)
+        return member_ids
+
+    def is_member(self, group_id, user_id):
+        member_ids = self.members(group_id)
+        position = bisect_left(member_ids, user_id)
+        return position < len(member_ids) and member_ids[position] == user_id
+
+    def invalidate(self, group_id):
+        self._drop([group_id])
+        cluster_bus.publish('membership', [group_id])
+
+    def clear(self):
+        self._drop(None)
+        cluster_bus.publish('membership')
+
+    def _drop(self, group_ids):
+        with self._lock:
+            if group_ids is None:
+                self._groups.clear()
+            for group_id in group_ids or ():
+                self._groups.pop(group_id, None)
+            self._generation += 1
+
+membership_index = MembershipIndex(
+    ttl=app.config.get('MEMBERSHIP_CACHE_TTL', 60),
+    capacity=app.config.get('MEMBERSHIP_CACHE_SIZE', 10000)
+)
+cluster_bus.subscribe('membership', membership_index._drop)
+
+# Any change made through the Group.members / User.groups relationships
+# invalidates the affected group once the session commits. Code that writes
+# user_group directly must call membership_index.invalidate() itself.
+configure_mappers()
+
+def _membership_changed(group):
+    if group.id is None:
+        # Not flushed yet, so it cannot be cached
+        return
+    session = object_session(group)
+    if session is None:
+        membership_index.invalidate(group.id)
+    else:
+        session.info.setdefault('membership_changes', set()).add(group.id)
+
+@event.listens_for(Group.members, 'append')
+@event.listens_for(Group.members, 'remove')
+def _group_members_changed(group, user, initiator):
+    _membership_changed(group)
+
+@event.listens_for(User.groups, 'append')
+@event.listens_for(User.groups, 'remove')
+def _user_groups_changed(user, group, initiator):
+    _membership_changed(group)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_changes(session):
+    for group_id in session.info.pop('membership_changes', ()):
+        membership_index.invalidate(group_id)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_changes(session, previous_transaction):
+    session.info.pop('membership_changes', None)
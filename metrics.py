@@ -0,0 +1,217 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from flask import Response, abort, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import hmac
+import threading
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, as in the Prometheus client libraries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Statements per request or event; a jump between releases points at an N+1
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Histogram:
+    """Cumulative histogram per label set, rendered in Prometheus text format"""
+
+    def __init__(self, name, help, labelnames, buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Gauge whose samples are computed by a callback at scrape time"""
+
+    def __init__(self, name, help, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+http_request_duration = Histogram(
+    'wequack_http_request_duration_seconds', 'HTTP request latency by route.',
+    ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+http_request_queries = Histogram(
+    'wequack_http_request_sql_queries', 'SQL statements executed per HTTP request.',
+    ('endpoint',), QUERY_BUCKETS)
+socketio_event_duration = Histogram(
+    'wequack_socketio_event_duration_seconds', 'Socket.IO handler latency by event.',
+    ('event',), LATENCY_BUCKETS)
+socketio_event_queries = Histogram(
+    'wequack_socketio_event_sql_queries', 'SQL statements executed per Socket.IO event.',
+    ('event',), QUERY_BUCKETS)
+
+# Statements run by the current request or socket event; None outside of one
+_query_count = ContextVar('query_count', default=None)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+def _socket_gauges(socketio):
+    def connected_sockets():
+        rooms = socketio.server.manager.rooms.get('/', {})
+        return {(): len(rooms.get(None, ()))}
+
+    def rooms_by_kind():
+        # Every socket is also in a room named after its sid; those are not counted
+        rooms = socketio.server.manager.rooms.get('/', {})
+        sids = rooms.get(None, {})
+        counts = {}
+        for room, members in rooms.items():
+            if room is None or room in sids:
+                continue
+            kind = room.split('_', 1)[0] if isinstance(room, str) else 'other'
+            key = (kind if kind in ('group', 'user') else 'other',)
+            rooms_count, members_count = counts.get(key, (0, 0))
+            counts[key] = (rooms_count + 1, members_count + len(members))
+        return counts
+
+    def fanout_pending():
+        from fanout import fanout
+        return {(): fanout.pending()}
+
+    return [
+        Gauge('wequack_socketio_connected_sockets', 'Sockets connected to this process.', (),
+              connected_sockets),
+        Gauge('wequack_socketio_rooms', 'Open rooms on this process by kind.', ('kind',),
+              lambda: {key: value[0] for key, value in rooms_by_kind().items()}),
+        Gauge('wequack_socketio_room_members', 'Room memberships on this process by room kind.', ('kind',),
+              lambda: {key: value[1] for key, value in rooms_by_kind().items()}),
+        Gauge('wequack_fanout_pending_messages', 'Messages waiting for delivery on this process.', (),
+              fanout_pending)
+    ]
+
+def _instrument_socketio(socketio):
+    """Time every registered Socket.IO handler.
+
+    Flask-SocketIO has no before/after hooks for events, so the handlers
+    registered with the underlying server are wrapped in place. This must
+    run after all @socketio.on handlers have been imported.
+    """
+    for namespace, handlers in socketio.server.handlers.items():
+        for name, handler in list(handlers.items()):
+            handlers[name] = _timed_handler(name, handler)
+
+def _timed_handler(name, handler):
+    @wraps(handler)
+    def timed(*args):
+        counter = [0]
+        token = _query_count.set(counter)
+        started = time.perf_counter()
+        try:
+            return handler(*args)
+        finally:
+            socketio_event_duration.observe((name,), time.perf_counter() - started)
+            socketio_event_queries.observe((name,), counter[0])
+            _query_count.reset(token)
+    return timed
+
+def init_metrics(app, socketio):
+    """Record request and event metrics and serve them at /metrics.
+
+    /metrics answers 404 unless the scraper presents METRICS_TOKEN or,
+    without a token, connects from localhost.
+    """
+    collectors = [
+        http_request_duration, http_request_queries,
+        socketio_event_duration, socketio_event_queries
+    ] + _socket_gauges(socketio)
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = [0]
+        g.metrics_token = _query_count.set(g.metrics_queries)
+
+    @app.after_request
+    def _note_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    # Teardown also runs for requests whose view raised, which after_request
+    # hooks may not see
+    @app.teardown_request
+    def _record_request_metrics(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        # Rule names, not paths, keep the label values bounded
+        endpoint = request.endpoint or 'unmatched'
+        status = g.pop('metrics_status', 500)
+        http_request_duration.observe(
+            (endpoint, request.method, str(status)), time.perf_counter() - started)
+        http_request_queries.observe((endpoint,), g.metrics_queries[0])
+        _query_count.reset(g.pop('metrics_token'))
+
+    def metrics():
+        # With METRICS_TOKEN set scrapers send it as a bearer token;
+        # otherwise only direct connections from this host are served
+        token = app.config.get('METRICS_TOKEN')
+        if token:
+            allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+        else:
+            allowed = (request.remote_addr in ('127.0.0.1', '::1')
+                       and 'X-Forwarded-For' not in request.headers)
+        if not allowed:
+            abort(404)
+        lines = []
+        for collector in collectors:
+            lines.extend(collector.render())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    _instrument_socketio(socketio)
+    logger.info("Serving metrics at /metrics")
@@ -0,0 +1,230 @@
+from sqlalchemy import inspect, text, select, update, bindparam, func, or_
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def run_migrations(db):
+    """Bring an existing database up to date with the current models.
+
+    db.create_all() only creates missing tables, so schema changes to tables
+    that already exist (new indexes, new columns) are applied here. Every step
+    must be idempotent because this runs on each startup.
+    """
+    add_missing_columns(db)
+    collapse_read_receipts(db)
+    drop_message_read_flag(db)
+    key_direct_chats(db)
+    create_missing_indexes(db)
+    backfill_username_keys(db)
+    create_search_index(db)
+    create_archive_search_index(db)
+
+def add_missing_columns(db):
+    """Add nullable columns declared on the models that an older database lacks"""
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            logger.info("Adding column %s.%s", table.name, column.name)
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+                ))
+
+def collapse_read_receipts(db):
+    """Fold per-message read_receipt rows into per-member read cursors"""
+    if not inspect(db.engine).has_table('read_receipt'):
+        return
+    logger.info("Collapsing read receipts into read cursors")
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE user_group SET last_read_message_id = ("
+            " SELECT MAX(read_receipt.message_id) FROM read_receipt"
+            " JOIN message ON message.id = read_receipt.message_id"
+            " WHERE read_receipt.user_id = user_group.user_id"
+            " AND message.group_id = user_group.group_id"
+            ") WHERE last_read_message_id IS NULL"
+        ))
+        conn.execute(text("DROP TABLE read_receipt"))
+
+def drop_message_read_flag(db):
+    """Drop the global message.is_read flag, superseded by read cursors"""
+    columns = {column['name'] for column in inspect(db.engine).get_columns('message')}
+    if 'is_read' not in columns:
+        return
+    logger.info("Dropping column message.is_read")
+    with db.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE message DROP COLUMN is_read"))
+
+def key_direct_chats(db):
+    """Fill in the pair key of older direct chats, merging duplicates.
+
+    Concurrent requests could create several direct chats for the same two
+    users before the pair key existed. The oldest one is kept: the others'
+    messages move into it, read cursors keep the furthest position, and the
+    duplicates are deleted. Must run before the unique index is created.
+    """
+    from models import Group, Message, user_group, direct_chat_pair
+    from versions import bump_versions
+    with db.engine.begin() as conn:
+        rows = conn.execute(
+            select(
+                Group.id,
+                func.min(user_group.c.user_id),
+                func.max(user_group.c.user_id),
+                func.count()
+            ).join(user_group, user_group.c.group_id == Group.id).where(
+                Group.is_direct_chat == True,
+                Group.dm_low_user_id == None
+            ).group_by(Group.id).order_by(Group.id)
+        ).all()
+        if not rows:
+            return
+
+        # Pairs already keyed win over any unkeyed duplicate
+        kept = {
+            (low, high): group_id
+            for group_id, low, high in conn.execute(
+                select(Group.id, Group.dm_low_user_id, Group.dm_high_user_id)
+                .where(Group.dm_low_user_id != None)
+            )
+        }
+        duplicates = []
+        for group_id, low, high, members in rows:
+            if members > 2:
+                continue
+            pair = direct_chat_pair(low, high)
+            if pair in kept:
+                duplicates.append((group_id, kept[pair]))
+                continue
+            kept[pair] = group_id
+            conn.execute(
+                update(Group).where(Group.id == group_id)
+                .values(dm_low_user_id=pair[0], dm_high_user_id=pair[1])
+            )
+
+        if duplicates:
+            logger.info("Merging %d duplicate direct chats", len(duplicates))
+        for group_id, kept_id in duplicates:
+            conn.execute(update(Message).where(Message.group_id == group_id).values(group_id=kept_id))
+            cursors = conn.execute(
+                select(user_group.c.user_id, user_group.c.last_read_message_id)
+                .where(user_group.c.group_id == group_id)
+            ).all()
+            for user_id, cursor in cursors:
+                if cursor is None:
+                    continue
+                conn.execute(update(user_group).where(
+                    user_group.c.user_id == user_id,
+                    user_group.c.group_id == kept_id,
+                    or_(
+                        user_group.c.last_read_message_id == None,
+                        user_group.c.last_read_message_id < cursor
+                    )
+                ).values(last_read_message_id=cursor))
+            conn.execute(user_group.delete().where(user_group.c.group_id == group_id))
+            conn.execute(Group.__table__.delete().where(Group.id == group_id))
+        bump_versions(conn, groups=[kept_id for _, kept_id in duplicates])
+
+    if duplicates:
+        # Workers that are still running may have the merged groups cached
+        from membership import membership_index
+        for group_id, kept_id in duplicates:
+            membership_index.invalidate(group_id)
+            membership_index.invalidate(kept_id)
+
+def create_missing_indexes(db):
+    """Create indexes declared on the models that an older database lacks"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info("Creating index %s on %s", index.name, table.name)
+                index.create(bind=db.engine)
+
+def backfill_username_keys(db):
+    """Fill in user.username_key for users created before the column existed"""
+    from models import User, username_key
+    with db.engine.begin() as conn:
+        rows = conn.execute(
+            select(User.id, User.username).where(User.username_key == None)
+        ).all()
+        if not rows:
+            return
+        logger.info("Backfilling username_key for %d users", len(rows))
+        for start in range(0, len(rows), 1000):
+            conn.execute(
+                update(User).where(User.id == bindparam('user_id')).values(username_key=bindparam('key')),
+                [{'user_id': user_id, 'key': username_key(username)}
+                 for user_id, username in rows[start:start + 1000]]
+            )
+
+def create_search_index(db):
+    """Create the FTS5 message index and the triggers that keep it in sync (SQLite only).
+
+    message_fts is an external-content table: it stores only the index and
+    reads content from the message table. Messages that existed before the
+    index was created are added with `flask --app main search backfill`.
+    """
+    if db.engine.dialect.name != 'sqlite' or inspect(db.engine).has_table('message_fts'):
+        return
+    logger.info("Creating full-text index message_fts")
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE message_fts USING fts5("
+            " content, content='message', content_rowid='id',"
+            " tokenize='unicode61 remove_diacritics 2', prefix='3 4')"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN"
+            " INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);"
+            " END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN"
+            " INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', old.id, old.content);"
+            " END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER message_fts_update AFTER UPDATE OF content ON message BEGIN"
+            " INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', old.id, old.content);"
+            " INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);"
+            " END"
+        ))
+        has_messages = conn.execute(text("SELECT 1 FROM message LIMIT 1")).first()
+    if has_messages:
+        logger.warning("Existing messages are not searchable until `flask --app main search backfill` is run")
+
+def create_archive_search_index(db):
+    """Create the FTS5 index of archived messages (SQLite only).
+
+    Archiving deletes messages from the message table, and with them their
+    message_fts entries, so archive.py indexes them here instead. Unlike
+    message_fts it stores its own copy of the content (and the group,
+    sender and time of each message) for snippets and access checks.
+    Messages archived before it existed are added with
+    `flask --app main search backfill`.
+    """
+    if db.engine.dialect.name != 'sqlite' or inspect(db.engine).has_table('archive_fts'):
+        return
+    logger.info("Creating full-text index archive_fts")
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE archive_fts USING fts5("
+            " content, group_id UNINDEXED, sender_id UNINDEXED, timestamp UNINDEXED,"
+            " tokenize='unicode61 remove_diacritics 2', prefix='3 4')"
+        ))
+        has_segments = conn.execute(text("SELECT 1 FROM archive_segment LIMIT 1")).first()
+    if has_segments:
+        logger.warning("Archived messages are not searchable until `flask --app main search backfill` is run")
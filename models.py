@@ -1,17 +1,51 @@
 from datetime import datetime
 from app import db
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
-# Association table for many-to-many relationship between users and group chats
+# Association table for many-to-many relationship between users and group chats.
+# last_read_message_id is the member's read cursor: the newest message id they
+# have read in the group (see read_state.py).
 user_group = db.Table('user_group',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('group_id', db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    db.Column('group_id', db.Integer, db.ForeignKey('group.id'), primary_key=True),
+    db.Column('last_read_message_id', db.Integer, nullable=True)
 )
 
+# Versions of cached API responses (see versions.py). scope is 'group',
+# 'user' or 'directory'; a missing row means version 0. The 'events' scope
+# holds each user's last event sequence number (see events.py).
+version_counter = db.Table('version_counter',
+    db.Column('scope', db.String(16), primary_key=True),
+    db.Column('key', db.Integer, primary_key=True),
+    db.Column('version', db.Integer, nullable=False, default=0)
+)
+
+# The most recent events sent to each user's room, by sequence number, for
+# clients catching up after a reconnect (see events.py)
+user_event = db.Table('user_event',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('seq', db.Integer, primary_key=True),
+    db.Column('event', db.String(32), nullable=False),
+    db.Column('payload', db.Text, nullable=False),
+    db.Column('created_at', db.DateTime, default=datetime.utcnow)
+)
+
+def username_key(username):
+    """Case-folded form of a username, used for case-insensitive prefix search"""
+    return username.casefold()
+
+def direct_chat_pair(user_id, other_user_id):
+    """Canonical (low, high) key of the direct chat between two users"""
+    return min(user_id, other_user_id), max(user_id, other_user_id)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
+    # Kept in step with username; prefix searches are range scans over
+    # (username_key, id), which needs code point order on PostgreSQL too
+    username_key = db.Column(db.String(64).with_variant(db.String(64, collation='C'), 'postgresql'))
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -21,6 +55,15 @@ class User(UserMixin, db.Model):
     sent_messages = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender', lazy='dynamic')
     groups = db.relationship('Group', secondary=user_group, backref=db.backref('members', lazy='dynamic'))
     
+    __table_args__ = (
+        db.Index('ix_user_username_key_id', 'username_key', 'id'),
+    )
+    
+    @validates('username')
+    def _update_username_key(self, key, username):
+        self.username_key = username_key(username)
+        return username
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
         
@@ -37,11 +80,20 @@ class Group(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     is_direct_chat = db.Column(db.Boolean, default=False)
+    # Direct chats only: the two members as direct_chat_pair() orders them.
+    # The unique index allows one direct chat per pair of users.
+    dm_low_user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    dm_high_user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     
     # Relationships
     messages = db.relationship('Message', backref='group', lazy='dynamic')
     creator = db.relationship('User', foreign_keys=[creator_id])
     
+    __table_args__ = (
+        db.Index('ux_group_direct_pair', 'dm_low_user_id', 'dm_high_user_id', unique=True),
+        db.Index('ix_group_dm_high_user_id', 'dm_high_user_id'),
+    )
+    
     def __repr__(self):
         return f'<Group {self.name}>'
 
@@ -51,20 +103,40 @@ class Message(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
-    is_read = db.Column(db.Boolean, default=False)
+    
+    # History is paged per group in (timestamp, id) order; unread counts and
+    # read receipts compare ids against per-member read cursors
+    __table_args__ = (
+        db.Index('ix_message_group_timestamp_id', 'group_id', 'timestamp', 'id'),
+        db.Index('ix_message_group_id', 'group_id', 'id'),
+    )
     
     def __repr__(self):
         return f'<Message {self.id} from {self.sender_id} at {self.timestamp}>'
 
-class ReadReceipt(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    read_at = db.Column(db.DateTime, default=datetime.utcnow)
+class ArchiveSegment(db.Model):
+    """A file of archived messages of one group and month (see archive.py).
+
+    Messages in the file are in (timestamp, id) order; blocks is the sparse
+    index, a JSON list of [offset, length, first timestamp, first id,
+    lowest id, highest id] per compressed block.
+    """
+    __tablename__ = 'archive_segment'
     
-    # Relationships
-    message = db.relationship('Message')
-    user = db.relationship('User')
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    path = db.Column(db.String(255), nullable=False, unique=True)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    min_message_id = db.Column(db.Integer, nullable=False)
+    max_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    blocks = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def __repr__(self):
-        return f'<ReadReceipt for message {self.message_id} by {self.user_id}>'
+    # Read-through pages seek the segments of a group from the newest one
+    __table_args__ = (
+        db.Index('ix_archive_segment_group_last', 'group_id', 'last_timestamp', 'last_message_id'),
+    )
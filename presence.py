@@ -0,0 +1,209 @@
+from sqlalchemy import select, update
+from app import app, db, socketio
+from models import User, user_group
+from identity import identity_cache
+from versions import bump_direct_chats_of
+from events import event_log
+from cluster import cluster_bus
+import threading
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class PresenceRegistry:
+    """In-process record of who is online.
+
+    Every Socket.IO connection is tracked per user, so a user stays online
+    while any of their tabs is connected and only goes offline once the last
+    one has been gone for PRESENCE_GRACE_PERIOD seconds; a page refresh no
+    longer flaps. Connections that stop sending heartbeats for
+    PRESENCE_TIMEOUT seconds are dropped.
+
+    Changes are collected and published every PRESENCE_FLUSH_INTERVAL
+    seconds: each online user who shares a group with a changed user gets a
+    single presence_diff, and User.status is written for the changed users
+    in one transaction. A user who goes offline and back online within one
+    interval produces no diff at all.
+
+    In a cluster each worker only sees its own connections, so a worker
+    whose last connection of a user closes announces them offline even if
+    another worker still holds one. The other workers hear of it over the
+    cluster bus and so do heartbeats: a user still connected to a worker is
+    checked against User.status in its next flush and announced online
+    again.
+    """
+    # Keeps IN lists well below the bound parameter limits of SQLite
+    chunk_size = 400
+
+    def __init__(self, clustered=False):
+        self.clustered = clustered
+        # user_id -> set of sids; an empty set means the user is in the grace period
+        self._connections = {}
+        # sid -> (user_id, time of the last heartbeat)
+        self._sids = {}
+        # user_id -> time at which the user goes offline
+        self._offline_at = {}
+        # Users announced as online by the last flush
+        self._published = set()
+        # Users whose presence may have changed since the last flush
+        self._touched = set()
+        self._lock = threading.Lock()
+        self._task = None
+
+    def connect(self, user_id, sid):
+        with self._lock:
+            self._connections.setdefault(user_id, set()).add(sid)
+            self._sids[sid] = (user_id, time.monotonic())
+            self._offline_at.pop(user_id, None)
+            self._touched.add(user_id)
+            if self._task is None:
+                self._task = socketio.start_background_task(self._run)
+
+    def disconnect(self, user_id, sid):
+        with self._lock:
+            self._sids.pop(sid, None)
+            self._drop_sid(user_id, sid, time.monotonic() + app.config.get('PRESENCE_GRACE_PERIOD', 5))
+
+    def heartbeat(self, user_id, sid):
+        if sid not in self._sids:
+            # Dropped after missing its heartbeats but still alive
+            self.connect(user_id, sid)
+            return
+        with self._lock:
+            self._sids[sid] = (user_id, time.monotonic())
+            if self.clustered:
+                # Catches an offline from another worker the bus missed
+                self._touched.add(user_id)
+
+    def _recheck(self, user_ids):
+        """Another worker announced user_ids offline; None means anyone"""
+        with self._lock:
+            self._touched.update(self._connections if user_ids is None else user_ids)
+
+    def _drop_sid(self, user_id, sid, offline_at):
+        sids = self._connections.get(user_id)
+        if sids is None:
+            return
+        sids.discard(sid)
+        if not sids:
+            self._offline_at[user_id] = offline_at
+
+    def is_online(self, user_id):
+        return user_id in self._connections
+
+    def status(self, user_id, stored=None):
+        """Current status of a user; stored is the persisted User.status.
+
+        A single worker sees every connection, so anyone it does not know
+        is offline, whatever was persisted before a restart or crash. Only
+        a cluster, where other workers hold connections, trusts stored.
+        """
+        if user_id in self._connections:
+            return 'online'
+        if not self.clustered:
+            return 'offline'
+        return stored or 'offline'
+
+    def _run(self):
+        while True:
+            socketio.sleep(app.config.get('PRESENCE_FLUSH_INTERVAL', 1.0))
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception("Failed to publish presence changes")
+
+    def flush(self):
+        """Expire stale connections, then publish and persist what changed"""
+        now = time.monotonic()
+        timeout = app.config.get('PRESENCE_TIMEOUT', 60)
+        with self._lock:
+            for sid, (user_id, last_seen) in list(self._sids.items()):
+                if now - last_seen > timeout:
+                    del self._sids[sid]
+                    self._drop_sid(user_id, sid, now)
+            for user_id, offline_at in list(self._offline_at.items()):
+                if offline_at <= now:
+                    del self._offline_at[user_id]
+                    self._connections.pop(user_id, None)
+                    self._touched.add(user_id)
+
+            changes = {}
+            recheck = []
+            for user_id in self._touched:
+                online = user_id in self._connections
+                if online and user_id not in self._published:
+                    changes[user_id] = 'online'
+                    self._published.add(user_id)
+                elif not online and user_id in self._published:
+                    changes[user_id] = 'offline'
+                    self._published.discard(user_id)
+                elif online and self.clustered:
+                    recheck.append(user_id)
+            self._touched.clear()
+            online_users = set(self._connections)
+
+        try:
+            # Online here but announced offline by another worker
+            changes.update((user_id, 'online') for user_id in self._stored_offline(recheck))
+            if not changes:
+                return
+            self._publish(changes, online_users)
+            self._persist(changes)
+        except Exception:
+            db.session.rollback()
+            raise
+        offline = [user_id for user_id, status in changes.items() if status == 'offline']
+        if offline:
+            cluster_bus.publish('presence', offline)
+
+    def _stored_offline(self, user_ids):
+        offline = []
+        for start in range(0, len(user_ids), self.chunk_size):
+            offline += db.session.execute(
+                select(User.id).where(
+                    User.id.in_(user_ids[start:start + self.chunk_size]),
+                    User.status == 'offline'
+                )
+            ).scalars().all()
+        return offline
+
+    def _publish(self, changes, online_users):
+        # Everyone sharing at least one group with a changed user
+        changed, peer = user_group.alias('changed'), user_group.alias('peer')
+        diffs = {}
+        user_ids = list(changes)
+        for start in range(0, len(user_ids), self.chunk_size):
+            rows = db.session.execute(
+                select(peer.c.user_id, changed.c.user_id).distinct().join(
+                    peer, peer.c.group_id == changed.c.group_id
+                ).where(
+                    changed.c.user_id.in_(user_ids[start:start + self.chunk_size]),
+                    peer.c.user_id != changed.c.user_id
+                )
+            )
+            for recipient_id, user_id in rows:
+                # Other workers' connections are unknown here, so a cluster
+                # emits to every peer's room
+                if recipient_id in online_users or self.clustered:
+                    diffs.setdefault(recipient_id, []).append({
+                        'user_id': user_id,
+                        'status': changes[user_id]
+                    })
+
+        event_log.publish('presence_diff', [
+            (recipient_id, {'changes': diff}) for recipient_id, diff in diffs.items()
+        ])
+
+    def _persist(self, changes):
+        db.session.execute(update(User), [
+            {'id': user_id, 'status': status} for user_id, status in changes.items()
+        ])
+        bump_direct_chats_of(db.session, changes)
+        db.session.commit()
+        identity_cache.invalidate(*changes)
+
+presence = PresenceRegistry(clustered=bool(app.config.get('SOCKETIO_MESSAGE_QUEUE')))
+cluster_bus.subscribe('presence', presence._recheck)
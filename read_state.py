@@ -0,0 +1,180 @@
+from sqlalchemy import select, update, func, or_, tuple_, bindparam, distinct
+from app import app, db, socketio
+from models import User, Message, user_group
+from events import event_log
+import threading
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Read state is one cursor per membership: user_group.last_read_message_id
+# is the id of the newest message the member has read in that group.
+# Message ids only grow, so "has X read message M" is cursor >= M.id and
+# the unread messages are the ones with id > cursor.
+
+def get_read_cursor(user_id, group_id):
+    """Return a member's read cursor, 0 if they have read nothing"""
+    cursor = db.session.execute(
+        select(user_group.c.last_read_message_id).where(
+            user_group.c.user_id == user_id,
+            user_group.c.group_id == group_id
+        )
+    ).scalar()
+    return cursor or 0
+
+def get_others_read_cursor(user_id, group_id, conn=None):
+    """Return the furthest read cursor among the other members of a group.
+
+    A message sent by user_id has been read by someone iff its id is at or
+    below this value. conn defaults to the session.
+    """
+    cursor = (conn or db.session).execute(
+        select(func.max(user_group.c.last_read_message_id)).where(
+            user_group.c.group_id == group_id,
+            user_group.c.user_id != user_id
+        )
+    ).scalar()
+    return cursor or 0
+
+def get_seen_by(group_id, message_id, sender_id):
+    """Return the members other than the sender who have read a message"""
+    return db.session.execute(
+        select(User.id, User.username).join(
+            user_group, user_group.c.user_id == User.id
+        ).where(
+            user_group.c.group_id == group_id,
+            user_group.c.user_id != sender_id,
+            user_group.c.last_read_message_id >= message_id
+        ).order_by(User.username)
+    ).all()
+
+class ReadCursorBuffer:
+    """Write-behind buffer for read cursor updates.
+
+    Socket events only record the furthest message each (user, group) has
+    read. A background task flushes the merged cursors every
+    READ_RECEIPT_FLUSH_INTERVAL seconds in a single transaction and sends
+    one message_read notification per sender, reader and group covering
+    everything read since the previous flush, and the reader's new unread
+    count of each group in a conversation_updated.
+    """
+    # Keeps IN lists well below the bound parameter limits of SQLite
+    chunk_size = 400
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def add(self, user_id, reader_name, group_id, message_id):
+        with self._lock:
+            key = (user_id, group_id)
+            current = self._pending.get(key)
+            if current is None or current[0] < message_id:
+                self._pending[key] = (message_id, reader_name)
+            if self._task is None:
+                self._task = socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            socketio.sleep(app.config.get('READ_RECEIPT_FLUSH_INTERVAL', 0.5))
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception("Failed to flush read cursors")
+
+    def flush(self):
+        """Write all pending cursors and notify the senders of newly read messages"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        # Only members have a cursor row, and only forward moves count
+        keys = list(pending)
+        current = {}
+        for start in range(0, len(keys), self.chunk_size):
+            chunk = keys[start:start + self.chunk_size]
+            rows = db.session.execute(
+                select(
+                    user_group.c.user_id,
+                    user_group.c.group_id,
+                    user_group.c.last_read_message_id
+                ).where(tuple_(user_group.c.user_id, user_group.c.group_id).in_(chunk))
+            )
+            for user_id, group_id, cursor in rows:
+                current[(user_id, group_id)] = cursor or 0
+
+        # Clamp to the newest message so a bogus id cannot mark future messages read
+        group_ids = list({group_id for _, group_id in current})
+        newest = {}
+        for start in range(0, len(group_ids), self.chunk_size):
+            newest.update(db.session.execute(
+                select(Message.group_id, func.max(Message.id)).where(
+                    Message.group_id.in_(group_ids[start:start + self.chunk_size])
+                ).group_by(Message.group_id)
+            ).all())
+
+        moves = []
+        for (user_id, group_id), (message_id, reader_name) in pending.items():
+            if (user_id, group_id) not in current:
+                continue
+            message_id = min(message_id, newest.get(group_id, 0))
+            if message_id > current[(user_id, group_id)]:
+                moves.append((user_id, group_id, current[(user_id, group_id)], message_id, reader_name))
+        if not moves:
+            db.session.rollback()
+            return
+
+        db.session.execute(
+            update(user_group).where(
+                user_group.c.user_id == bindparam('reader_id'),
+                user_group.c.group_id == bindparam('target_group_id'),
+                or_(
+                    user_group.c.last_read_message_id == None,
+                    user_group.c.last_read_message_id < bindparam('upto_id')
+                )
+            ).values(last_read_message_id=bindparam('upto_id')),
+            [{
+                'reader_id': user_id,
+                'target_group_id': group_id,
+                'upto_id': message_id
+            } for user_id, group_id, _, message_id, _ in moves]
+        )
+        db.session.commit()
+
+        # One notification per sender whose messages fall in the newly read range
+        notifications = []
+        updates = []
+        for user_id, group_id, previous, message_id, reader_name in moves:
+            senders = db.session.execute(
+                select(distinct(Message.sender_id)).where(
+                    Message.group_id == group_id,
+                    Message.id > previous,
+                    Message.id <= message_id,
+                    Message.sender_id != user_id
+                )
+            ).scalars().all()
+            notifications += [(sender_id, {
+                'group_id': group_id,
+                'message_id': message_id,
+                'reader_id': user_id,
+                'reader_name': reader_name
+            }) for sender_id in senders]
+            
+            # The reader's other tabs and devices drop the count too
+            unread_count = db.session.execute(
+                select(func.count(Message.id)).where(
+                    Message.group_id == group_id,
+                    Message.id > message_id,
+                    Message.sender_id != user_id
+                )
+            ).scalar()
+            updates.append((user_id, {'id': group_id, 'unread_count': unread_count}))
+        db.session.rollback()
+        event_log.publish('message_read', notifications)
+        event_log.publish('conversation_updated', updates)
+
+read_cursor_buffer = ReadCursorBuffer()
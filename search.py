@@ -0,0 +1,165 @@
+from flask.cli import AppGroup
+from markupsafe import escape
+from sqlalchemy import text, bindparam, DateTime
+from app import app, db
+from storage import read_engine
+import click
+import re
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Private-use characters mark the matches in FTS5 snippets; they are swapped
+# for <mark> tags after the snippet has been HTML-escaped
+_MATCH_OPEN = '\ue000'
+_MATCH_CLOSE = '\ue001'
+
+# Queries are cut to this many words
+_MAX_TERMS = 8
+
+# Only words at least this long are matched as prefixes
+_MIN_PREFIX = 3
+
+def search_available():
+    """Full-text search needs the SQLite FTS5 index"""
+    return app.config.get('STORAGE_PROFILE') == 'sqlite'
+
+def build_match_query(query):
+    """Turn user input into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted phrase, so FTS5 operators and column
+    filters typed by users are searched for literally. All words must
+    match and the last one is a prefix unless the query ends in a space,
+    so results follow the user as they type. Returns None if nothing searchable is left.
+    """
+    terms = re.findall(r'\w+', query)[:_MAX_TERMS]
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms]
+    # Shorter prefixes expand to too many terms; the index has ready-made
+    # entries for three and four character prefixes
+    if len(terms[-1]) >= _MIN_PREFIX and not query[-1].isspace():
+        phrases[-1] += '*'
+    return ' '.join(phrases)
+
+def search_messages(user_id, query, limit, offset=0, group_id=None):
+    """Return the best matching messages from the user's groups.
+
+    Results are ordered by bm25 relevance, newest first among equals, and
+    carry an HTML snippet with the matches wrapped in <mark>. Only the
+    newest SEARCH_CANDIDATES matches are ranked, which bounds the cost of
+    common words however large the history grows. Archived messages are
+    searched through archive_fts; its scores come from a separate index,
+    so they rank only roughly against messages still in the table.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    group_filter = "AND message.group_id = :group_id" if group_id is not None else ""
+    archive_group_filter = "AND archive_fts.group_id = :group_id" if group_id is not None else ""
+    # FTS5 walks its doclists in rowid order, so the newest matches in the
+    # user's groups are found without visiting older ones
+    ranked = text(f"""
+        SELECT candidate.id FROM (
+            SELECT id, score FROM (
+                SELECT message_fts.rowid AS id, bm25(message_fts) AS score
+                FROM message_fts
+                JOIN message ON message.id = message_fts.rowid
+                JOIN user_group ON user_group.group_id = message.group_id
+                               AND user_group.user_id = :user_id
+                WHERE message_fts MATCH :match {group_filter}
+                ORDER BY message_fts.rowid DESC
+                LIMIT :candidates
+            )
+            UNION ALL
+            SELECT id, score FROM (
+                SELECT archive_fts.rowid AS id, bm25(archive_fts) AS score
+                FROM archive_fts
+                JOIN user_group ON user_group.group_id = archive_fts.group_id
+                               AND user_group.user_id = :user_id
+                WHERE archive_fts MATCH :match {archive_group_filter}
+                ORDER BY archive_fts.rowid DESC
+                LIMIT :candidates
+            )
+            ORDER BY id DESC
+            LIMIT :candidates
+        ) AS candidate
+        ORDER BY candidate.score, candidate.id DESC
+        LIMIT :limit OFFSET :offset
+    """)
+    # Snippets are only built for the page being returned
+    details = text("""
+        SELECT message.id, message.group_id, message.sender_id, "user".username,
+               message.timestamp,
+               snippet(message_fts, 0, :open, :close, '…', 16) AS snippet
+        FROM message_fts
+        JOIN message ON message.id = message_fts.rowid
+        JOIN "user" ON "user".id = message.sender_id
+        WHERE message_fts MATCH :match AND message_fts.rowid IN :ids
+        UNION ALL
+        SELECT archive_fts.rowid, archive_fts.group_id, archive_fts.sender_id, "user".username,
+               archive_fts.timestamp,
+               snippet(archive_fts, 0, :open, :close, '…', 16)
+        FROM archive_fts
+        JOIN "user" ON "user".id = archive_fts.sender_id
+        WHERE archive_fts MATCH :match AND archive_fts.rowid IN :ids
+    """).bindparams(bindparam('ids', expanding=True)).columns(timestamp=DateTime)
+
+    with read_engine().connect() as conn:
+        message_ids = conn.execute(ranked, {
+            'user_id': user_id,
+            'match': match,
+            'group_id': group_id,
+            'candidates': app.config.get('SEARCH_CANDIDATES', 2000),
+            'limit': limit,
+            'offset': offset
+        }).scalars().all()
+        if not message_ids:
+            return []
+        rows = {row.id: row for row in conn.execute(details, {
+            'open': _MATCH_OPEN,
+            'close': _MATCH_CLOSE,
+            'match': match,
+            'ids': message_ids
+        })}
+
+    return [{
+        'id': message_id,
+        'group_id': rows[message_id].group_id,
+        'sender_id': rows[message_id].sender_id,
+        'sender_name': rows[message_id].username,
+        'timestamp': rows[message_id].timestamp.isoformat(),
+        'snippet': _highlight(rows[message_id].snippet)
+    } for message_id in message_ids if message_id in rows]
+
+def _highlight(snippet):
+    return str(escape(snippet)).replace(_MATCH_OPEN, '<mark>').replace(_MATCH_CLOSE, '</mark>')
+
+# flask --app main search ...
+search_cli = AppGroup('search', help='Manage the full-text message index.')
+
+@search_cli.command('backfill')
+def backfill_command():
+    """Index every stored and archived message (rebuilds both indexes)."""
+    if not search_available():
+        raise click.ClickException('Full-text search needs the SQLite storage profile')
+    from archive import reindex_archive
+    started = time.monotonic()
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO message_fts (message_fts) VALUES ('rebuild')"))
+    archived = reindex_archive()
+    click.echo(f"Rebuilt the message index and indexed {archived} archived messages "
+               f"in {time.monotonic() - started:.1f}s")
+
+@search_cli.command('optimize')
+def optimize_command():
+    """Merge the index segments for faster queries."""
+    if not search_available():
+        raise click.ClickException('Full-text search needs the SQLite storage profile')
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO message_fts (message_fts) VALUES ('optimize')"))
+        conn.execute(text("INSERT INTO archive_fts (archive_fts) VALUES ('optimize')"))
+    click.echo("Optimized the message indexes")
@@ -0,0 +1,213 @@
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer, want_bytes
+from werkzeug.datastructures import CallbackDict
+from app import socketio
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class SQLiteSession(CallbackDict, SessionMixin):
+    """A session whose data lives server side under sid"""
+
+    def __init__(self, initial=None, sid=None, permanent=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        if permanent:
+            self.permanent = permanent
+        self.modified = False
+
+    def __bool__(self):
+        return bool(dict(self)) and self.keys() != {'_permanent'}
+
+class SQLiteSessionInterface(SessionInterface):
+    """Server-side sessions in a single SQLite file.
+
+    Replaces the filesystem store, which keeps one file per session and
+    never removes them. Sessions are rows keyed by session id with an
+    indexed expiry column: loading one is a primary-key lookup, saving an
+    unchanged session only pushes its expiry forward, and a background
+    sweeper deletes expired rows every sweep_interval seconds. The file is
+    separate from the chat database so session writes never wait for the
+    message writer.
+
+    Built on Flask's own SessionInterface rather than Flask-Session's
+    internals, which change between its releases. Cookies are compatible
+    with Flask-Session's: the session id, signed with the secret key if
+    use_signer is set.
+    """
+    session_class = SQLiteSession
+    serializer = pickle
+    # Rows deleted per sweeper transaction
+    sweep_batch_size = 1000
+
+    def __init__(self, path, key_prefix, use_signer, permanent, sid_length, sweep_interval=300):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS session (
+                id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                expiry REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ix_session_expiry ON session (expiry);
+        """)
+        self.key_prefix = key_prefix
+        self.use_signer = use_signer
+        self.permanent = permanent
+        self.sid_length = sid_length
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _generate_sid(self, sid_length):
+        return secrets.token_urlsafe(sid_length)
+
+    def _signer(self, app):
+        if not app.secret_key:
+            raise KeyError("SECRET_KEY must be set when SESSION_USE_SIGNER=True")
+        return Signer(app.secret_key, salt='flask-session', key_derivation='hmac')
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if sid and self.use_signer:
+            try:
+                sid = self._signer(app).unsign(sid).decode()
+            except BadSignature:
+                sid = None
+        if not sid:
+            return self.session_class(sid=self._generate_sid(self.sid_length), permanent=self.permanent)
+        return self.fetch_session(sid)
+
+    def fetch_session(self, sid):
+        row = self._connection().execute(
+            "SELECT data FROM session WHERE id = ? AND expiry > ?",
+            (self.key_prefix + sid, time.time())
+        ).fetchone()
+        if row is not None:
+            try:
+                return self.session_class(self.serializer.loads(row[0]), sid=sid)
+            except (pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+                logger.warning("Discarding unreadable session")
+        return self.session_class(sid=sid, permanent=self.permanent)
+
+    def save_session(self, app, session, response):
+        if not self.should_set_cookie(app, session):
+            return
+
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        session_id = self.key_prefix + session.sid
+
+        # Empty sessions are not stored; a cleared one is deleted with its cookie
+        if not session:
+            if session.modified:
+                self._connection().execute("DELETE FROM session WHERE id = ?", (session_id,))
+                response.delete_cookie(app.config["SESSION_COOKIE_NAME"], domain=domain, path=path)
+            return
+
+        expiration_datetime = self.get_expiration_time(app, session)
+        expiry = time.time() + app.permanent_session_lifetime.total_seconds()
+
+        connection = self._connection()
+        updated = 0
+        if not session.modified:
+            updated = connection.execute(
+                "UPDATE session SET expiry = ? WHERE id = ?", (expiry, session_id)
+            ).rowcount
+        if not updated:
+            connection.execute(
+                "INSERT OR REPLACE INTO session (id, data, expiry) VALUES (?, ?, ?)",
+                (session_id, self.serializer.dumps(dict(session), pickle.HIGHEST_PROTOCOL), expiry)
+            )
+
+        self._start_sweeper()
+        cookie_value = session.sid
+        if self.use_signer:
+            cookie_value = self._signer(app).sign(want_bytes(session.sid)).decode('utf-8')
+        response.set_cookie(
+            app.config["SESSION_COOKIE_NAME"],
+            cookie_value,
+            expires=expiration_datetime,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def _start_sweeper(self):
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = socketio.start_background_task(self._run_sweeper)
+
+    def _run_sweeper(self):
+        while True:
+            socketio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Failed to sweep expired sessions")
+
+    def sweep(self, now=None):
+        """Delete expired sessions and return how many were removed"""
+        now = time.time() if now is None else now
+        connection = self._connection()
+        removed = 0
+        while True:
+            # Small batches keep the write lock short
+            deleted = connection.execute(
+                "DELETE FROM session WHERE id IN "
+                "(SELECT id FROM session WHERE expiry <= ? LIMIT ?)",
+                (now, self.sweep_batch_size)
+            ).rowcount
+            removed += deleted
+            if deleted < self.sweep_batch_size:
+                break
+            # Let request handlers in between batches
+            socketio.sleep(0)
+        if removed:
+            logger.info("Removed %d expired sessions", removed)
+        return removed
+
+def init_session_store(app, sess):
+    """Install the configured session backend.
+
+    SESSION_TYPE 'sqlite' uses SQLiteSessionInterface; any other value is
+    handed to Flask-Session (e.g. 'filesystem' or 'redis').
+    """
+    if app.config['SESSION_TYPE'] != 'sqlite':
+        sess.init_app(app)
+        return
+    app.session_interface = SQLiteSessionInterface(
+        app.config.get('SESSION_SQLITE_PATH') or os.path.join(app.instance_path, 'sessions.db'),
+        key_prefix=app.config.get('SESSION_KEY_PREFIX', 'session:'),
+        use_signer=app.config.get('SESSION_USE_SIGNER', False),
+        permanent=app.config.get('SESSION_PERMANENT', True),
+        sid_length=app.config.get('SESSION_ID_LENGTH', 32),
+        sweep_interval=app.config.get('SESSION_SWEEP_INTERVAL', 300)
+    )
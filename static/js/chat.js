@@ -1,7 +1,49 @@
 // Global variables
 let currentUserId = null;
 let currentGroupId = null;
-let conversations = [];
+
+// Sidebar conversations by group id. /api/conversations fills the store once;
+// after that the server pushes conversation_updated deltas, which are merged
+// in and patch only the sidebar rows they touch.
+const conversations = new Map();
+
+// Message history paging state for the open chat
+let oldestMessageId = null;
+let newestMessageId = null;
+let hasOlderMessages = false;
+let loadingOlderMessages = false;
+
+// The chat APIs tag their responses with ETags. The last copy of each URL is
+// kept and revalidated with If-None-Match, so an unchanged resource costs the
+// server a version lookup and comes back as an empty 304.
+const RESPONSE_CACHE_SIZE = 200;
+const responseCache = new Map();
+
+function fetchJSON(url) {
+    const cached = responseCache.get(url);
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    
+    return fetch(url, { headers, cache: 'no-store' }).then(response => {
+        // Callers may modify what they get, so they always get a copy
+        if (response.status === 304 && cached) {
+            return structuredClone(cached.data);
+        }
+        if (!response.ok) {
+            throw new Error(`${url} returned ${response.status}`);
+        }
+        return response.json().then(data => {
+            const etag = response.headers.get('ETag');
+            if (etag) {
+                responseCache.delete(url);
+                responseCache.set(url, { etag, data: structuredClone(data) });
+                if (responseCache.size > RESPONSE_CACHE_SIZE) {
+                    responseCache.delete(responseCache.keys().next().value);
+                }
+            }
+            return data;
+        });
+    });
+}
 
 // Initialize the chat application
 document.addEventListener('DOMContentLoaded', () => {
@@ -17,10 +59,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
 // Load all conversations (direct and group)
 function loadConversations() {
-    fetch('/api/conversations')
-        .then(response => response.json())
+    fetchJSON('/api/conversations')
         .then(data => {
-            conversations = data;
+            conversations.clear();
+            data.forEach(conversation => conversations.set(conversation.id, conversation));
             renderConversations();
         })
         .catch(error => console.error('Error loading conversations:', error));
@@ -28,93 +70,118 @@ function loadConversations() {
 
 // Render conversations in sidebar
 function renderConversations() {
-    // Render direct chats (friends)
     const friendsList = document.getElementById('friends-list');
+    const groupsList = document.getElementById('groups-list');
     friendsList.innerHTML = '';
+    groupsList.innerHTML = '';
     
-    // Filter direct chats
-    const directChats = conversations.filter(conv => conv.is_direct);
+    // The server sends them in group id order
+    conversations.forEach(conversation => {
+        const list = conversation.is_direct ? friendsList : groupsList;
+        list.appendChild(createConversationElement(conversation));
+    });
+}
+
+// Find the sidebar row of a conversation
+function conversationElement(conversation) {
+    const selector = conversation.is_direct ? '.friend-item' : '.group-item';
+    return document.querySelector(`${selector}[data-id="${conversation.id}"]`);
+}
+
+// Build the sidebar row for a conversation
+function createConversationElement(conversation) {
+    const item = document.createElement('div');
+    item.dataset.id = conversation.id;
     
-    directChats.forEach(chat => {
-        const friendItem = document.createElement('div');
-        friendItem.className = 'friend-item';
-        friendItem.dataset.id = chat.id;
-        friendItem.dataset.userId = chat.user_id;
+    if (conversation.is_direct) {
+        item.className = 'friend-item';
         
-        // Create status indicator
+        // Status indicator and friend name
         const statusElement = document.createElement('span');
-        statusElement.className = `friend-status status-${chat.status}`;
-        
-        // Create friend name
+        statusElement.className = 'friend-status';
         const nameElement = document.createElement('span');
         nameElement.className = 'friend-name';
-        nameElement.textContent = chat.name;
-        
-        // Create unread count if any
-        let unreadElement = '';
-        if (chat.unread_count > 0) {
-            unreadElement = document.createElement('span');
-            unreadElement.className = 'unread-count';
-            unreadElement.textContent = chat.unread_count;
-        }
         
-        // Assemble friend item
         const leftSection = document.createElement('div');
         leftSection.className = 'd-flex align-items-center';
         leftSection.appendChild(statusElement);
         leftSection.appendChild(nameElement);
+        item.appendChild(leftSection);
+    } else {
+        item.className = 'group-item';
         
-        friendItem.appendChild(leftSection);
-        if (unreadElement) {
-            friendItem.appendChild(unreadElement);
-        }
-        
-        // Add click event
-        friendItem.addEventListener('click', () => {
-            openChat(chat.id, chat.name, true);
-        });
-        
-        friendsList.appendChild(friendItem);
+        const nameElement = document.createElement('span');
+        nameElement.className = 'group-name';
+        item.appendChild(nameElement);
+    }
+    
+    if (conversation.id === currentGroupId) {
+        item.classList.add('active');
+    }
+    
+    // Click event; the name is looked up then, as it may have changed
+    item.addEventListener('click', () => {
+        const current = conversations.get(conversation.id);
+        openChat(current.id, current.name, current.is_direct);
     });
     
-    // Render group chats
-    const groupsList = document.getElementById('groups-list');
-    groupsList.innerHTML = '';
+    updateConversationElement(item, conversation);
+    return item;
+}
+
+// Bring a sidebar row in line with its conversation
+function updateConversationElement(item, conversation) {
+    if (conversation.is_direct) {
+        item.dataset.userId = conversation.user_id;
+        item.querySelector('.friend-status').className = `friend-status status-${conversation.status || 'offline'}`;
+        item.querySelector('.friend-name').textContent = conversation.name;
+    } else {
+        item.querySelector('.group-name').textContent = conversation.name;
+    }
     
-    // Filter group chats
-    const groupChats = conversations.filter(conv => !conv.is_direct);
+    // The last message shows on hover
+    item.title = conversation.last_message
+        ? `${conversation.last_sender_name}: ${conversation.last_message}`
+        : '';
     
-    groupChats.forEach(group => {
-        const groupItem = document.createElement('div');
-        groupItem.className = 'group-item';
-        groupItem.dataset.id = group.id;
-        
-        // Create group name
-        const nameElement = document.createElement('span');
-        nameElement.className = 'group-name';
-        nameElement.textContent = group.name;
-        
-        // Create unread count if any
-        let unreadElement = '';
-        if (group.unread_count > 0) {
+    // Unread count if any
+    let unreadElement = item.querySelector('.unread-count');
+    if (conversation.unread_count > 0) {
+        if (!unreadElement) {
             unreadElement = document.createElement('span');
             unreadElement.className = 'unread-count';
-            unreadElement.textContent = group.unread_count;
+            item.appendChild(unreadElement);
         }
+        unreadElement.textContent = conversation.unread_count;
+    } else if (unreadElement) {
+        unreadElement.remove();
+    }
+}
+
+// Merge a conversation_updated delta into the store and patch its row. A
+// conversation the user has just joined arrives as a whole row and is
+// inserted in group id order.
+function applyConversationUpdate(update) {
+    const { seq, ...fields } = update;
+    let conversation = conversations.get(fields.id);
+    
+    if (!conversation) {
+        // Deltas can outrun the initial load; it brings the whole row anyway
+        if (fields.name === undefined) return;
+        conversation = fields;
+        conversations.set(conversation.id, conversation);
         
-        // Assemble group item
-        groupItem.appendChild(nameElement);
-        if (unreadElement) {
-            groupItem.appendChild(unreadElement);
-        }
-        
-        // Add click event
-        groupItem.addEventListener('click', () => {
-            openChat(group.id, group.name, false);
-        });
-        
-        groupsList.appendChild(groupItem);
-    });
+        const list = document.getElementById(conversation.is_direct ? 'friends-list' : 'groups-list');
+        const next = Array.from(list.children).find(item => parseInt(item.dataset.id) > conversation.id);
+        list.insertBefore(createConversationElement(conversation), next || null);
+        return;
+    }
+    
+    Object.assign(conversation, fields);
+    const item = conversationElement(conversation);
+    if (item) {
+        updateConversationElement(item, conversation);
+    }
 }
 
 // Open a chat (direct or group)
@@ -125,7 +192,15 @@ function openChat(groupId, name, isDirect) {
     });
     
     const selector = isDirect ? '.friend-item' : '.group-item';
-    document.querySelector(`${selector}[data-id="${groupId}"]`).classList.add('active');
+    const item = document.querySelector(`${selector}[data-id="${groupId}"]`);
+    if (item) {
+        item.classList.add('active');
+    }
+    
+    // Everything in it is about to be read
+    if (conversations.has(groupId)) {
+        applyConversationUpdate({ id: groupId, unread_count: 0 });
+    }
     
     // Update chat header
     document.getElementById('chat-title').textContent = name;
@@ -143,33 +218,141 @@ function openChat(groupId, name, isDirect) {
     loadMessages(groupId);
 }
 
-// Load messages for a chat
+// Load the latest page of messages for a chat
 function loadMessages(groupId) {
-    fetch(`/api/messages/${groupId}`)
-        .then(response => response.json())
+    oldestMessageId = null;
+    newestMessageId = null;
+    hasOlderMessages = false;
+    
+    fetchJSON(`/api/messages/${groupId}`)
         .then(data => {
-            renderMessages(data);
+            // Ignore pages for a chat the user has already left
+            if (groupId !== currentGroupId) return;
+            
+            hasOlderMessages = data.has_more;
+            renderMessages(data.messages);
+            
+            // Opening a chat reads it, on the server too
+            if (data.messages.length > 0) {
+                markMessageAsRead(groupId, data.messages[data.messages.length - 1].id);
+            }
         })
         .catch(error => console.error('Error loading messages:', error));
 }
 
+// Load the page of messages just before the oldest one shown
+function loadOlderMessages() {
+    if (!currentGroupId || !hasOlderMessages || loadingOlderMessages || oldestMessageId === null) return;
+    
+    const groupId = currentGroupId;
+    loadingOlderMessages = true;
+    
+    fetchJSON(`/api/messages/${groupId}?before=${oldestMessageId}`)
+        .then(data => {
+            if (groupId !== currentGroupId) return;
+            
+            hasOlderMessages = data.has_more;
+            prependMessages(data.messages);
+        })
+        .catch(error => console.error('Error loading older messages:', error))
+        .finally(() => {
+            loadingOlderMessages = false;
+        });
+}
+
+// Fetch the messages the open chat received while the socket was down
+function catchUpMessages() {
+    if (!currentGroupId) return;
+    if (newestMessageId === null) {
+        loadMessages(currentGroupId);
+        return;
+    }
+    
+    const groupId = currentGroupId;
+    fetchJSON(`/api/messages/${groupId}?after=${newestMessageId}&limit=200`)
+        .then(data => {
+            if (groupId !== currentGroupId) return;
+            
+            // Too far behind to append; start over from the latest page
+            if (data.has_more) {
+                loadMessages(groupId);
+                return;
+            }
+            data.messages.forEach(message => {
+                appendMessage(message);
+                if (message.sender_id !== currentUserId) {
+                    markMessageAsRead(groupId, message.id);
+                }
+            });
+        })
+        .catch(error => console.error('Error catching up on messages:', error));
+}
+
+// Reload everything, for when missed events cannot be replayed
+function reloadChatState() {
+    loadConversations();
+    if (currentGroupId) {
+        loadMessages(currentGroupId);
+    }
+}
+
 // Render messages in the chat
 function renderMessages(messages) {
     const chatMessages = document.getElementById('chat-messages');
     chatMessages.innerHTML = '';
     
     messages.forEach(message => {
-        appendMessage(message);
+        chatMessages.appendChild(createMessageElement(message));
     });
     
+    if (messages.length > 0) {
+        oldestMessageId = messages[0].id;
+        newestMessageId = messages[messages.length - 1].id;
+    }
+    
     // Scroll to bottom
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+// Insert an older page above the current messages without moving the view
+function prependMessages(messages) {
+    if (messages.length === 0) return;
+    
+    const chatMessages = document.getElementById('chat-messages');
+    const previousHeight = chatMessages.scrollHeight;
+    
+    const fragment = document.createDocumentFragment();
+    messages.forEach(message => {
+        fragment.appendChild(createMessageElement(message));
+    });
+    chatMessages.insertBefore(fragment, chatMessages.firstChild);
+    
+    oldestMessageId = messages[0].id;
+    
+    // Keep the message the user was looking at in place
+    chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+}
+
 // Append a single message to the chat
 function appendMessage(message) {
     const chatMessages = document.getElementById('chat-messages');
+    // A catch-up fetch and the live event can both bring the same message
+    if (chatMessages.querySelector(`.message[data-id="${message.id}"]`)) return;
+    chatMessages.appendChild(createMessageElement(message));
     
+    if (oldestMessageId === null) {
+        oldestMessageId = message.id;
+    }
+    if (newestMessageId === null || message.id > newestMessageId) {
+        newestMessageId = message.id;
+    }
+    
+    // Scroll to bottom
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+// Build the DOM element for a single message
+function createMessageElement(message) {
     const messageElement = document.createElement('div');
     messageElement.className = `message ${message.sender_id === currentUserId ? 'message-sent' : 'message-received'}`;
     messageElement.dataset.id = message.id;
@@ -209,10 +392,7 @@ function appendMessage(message) {
     }
     
     messageElement.appendChild(infoElement);
-    chatMessages.appendChild(messageElement);
-    
-    // Scroll to bottom
-    chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageElement;
 }
 
 // Set up event listeners
@@ -232,6 +412,13 @@ function setupEventListeners() {
         }
     });
     
+    // Fetch older history when scrolled to the top
+    document.getElementById('chat-messages').addEventListener('scroll', (e) => {
+        if (e.target.scrollTop < 50) {
+            loadOlderMessages();
+        }
+    });
+    
     // Toggle friends list
     document.getElementById('friends-header').addEventListener('click', () => {
         const friendsList = document.getElementById('friends-list');
@@ -287,15 +474,10 @@ function setupEventListeners() {
 }
 
 // Update unread count for a group
-function updateUnreadCountForGroup(groupId) {
-    // Find the conversation
-    const conversation = conversations.find(conv => conv.id === groupId);
+function updateUnreadCountForGroup(groupId, count = 1) {
+    const conversation = conversations.get(groupId);
     if (conversation) {
-        // Increment unread count
-        conversation.unread_count = (conversation.unread_count || 0) + 1;
-        
-        // Re-render conversations
-        renderConversations();
+        applyConversationUpdate({ id: groupId, unread_count: (conversation.unread_count || 0) + count });
     }
 }
 
@@ -309,99 +491,172 @@ function updateUserStatus(userId, status) {
         statusElement.className = `friend-status status-${status}`;
     });
     
-    // Update in conversations array
-    const conversation = conversations.find(conv => conv.is_direct && conv.user_id === userId);
-    if (conversation) {
-        conversation.status = status;
+    // Update in the store
+    conversations.forEach(conversation => {
+        if (conversation.is_direct && conversation.user_id === userId) {
+            conversation.status = status;
+        }
+    });
+}
+
+// Update read status of sent messages up to and including messageId
+function updateMessageReadStatus(groupId, messageId, readerName) {
+    if (groupId !== currentGroupId) return;
+    
+    document.querySelectorAll('.message-read').forEach(readElement => {
+        if (parseInt(readElement.dataset.messageId) <= messageId && readElement.textContent === 'Sent') {
+            readElement.textContent = 'Read by ' + readerName;
+        }
+    });
+}
+
+// Type-ahead user search: /api/users matches a username prefix and returns
+// one page at a time, so the full user list is never downloaded
+const USER_SEARCH_DELAY = 200;
+
+function searchUsers(query, after) {
+    const params = new URLSearchParams({ q: query });
+    if (after) {
+        params.set('after', after);
     }
+    return fetchJSON(`/api/users?${params}`);
 }
 
-// Update message read status
-function updateMessageReadStatus(messageId, readerName) {
-    const readElement = document.querySelector(`.message-read[data-message-id="${messageId}"]`);
-    if (readElement) {
-        readElement.textContent = 'Read by ' + readerName;
+// Call render(page, query) with the results for the input's current text,
+// waiting for a pause in typing and dropping responses that arrive late
+function attachUserSearch(input, render) {
+    let timer = null;
+    let latest = 0;
+    
+    const run = () => {
+        const query = input.value.trim();
+        const request = ++latest;
+        searchUsers(query)
+            .then(page => {
+                if (request === latest) {
+                    render(page, query);
+                }
+            })
+            .catch(error => console.error('Error searching users:', error));
+    };
+    
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(run, USER_SEARCH_DELAY);
+    });
+    return run;
+}
+
+let groupMemberSearch = null;
+let chatUserSearch = null;
+let chatUserQuery = '';
+let chatUserNextAfter = null;
+
+// Add a member checkbox to the new group form, checked if requested
+function addGroupMemberOption(user, checked) {
+    const membersContainer = document.getElementById('group-members');
+    const existing = document.getElementById(`member-${user.id}`);
+    if (existing) {
+        existing.checked = existing.checked || checked;
+        return;
     }
+    
+    const checkbox = document.createElement('div');
+    checkbox.className = 'checkbox-group';
+    
+    const input = document.createElement('input');
+    input.type = 'checkbox';
+    input.name = 'members';
+    input.value = user.id;
+    input.id = `member-${user.id}`;
+    input.checked = checked;
+    
+    const label = document.createElement('label');
+    label.htmlFor = `member-${user.id}`;
+    label.textContent = user.username;
+    
+    checkbox.appendChild(input);
+    checkbox.appendChild(label);
+    membersContainer.appendChild(checkbox);
+}
+
+function renderGroupMemberResults(page, query) {
+    const resultsContainer = document.getElementById('group-member-results');
+    resultsContainer.innerHTML = '';
+    if (!query) {
+        return;
+    }
+    
+    page.users.forEach(user => {
+        const result = document.createElement('div');
+        result.className = 'user-result';
+        result.textContent = user.username;
+        result.addEventListener('click', () => {
+            addGroupMemberOption(user, true);
+            resultsContainer.innerHTML = '';
+            document.getElementById('group-member-search').value = '';
+        });
+        resultsContainer.appendChild(result);
+    });
 }
 
 // Open new group modal
 function openNewGroupModal() {
     document.getElementById('new-group-modal').style.display = 'block';
     
-    // Load users for member selection
-    fetch('/api/conversations')
-        .then(response => response.json())
-        .then(data => {
-            // Get unique users from direct chats
-            const users = data
-                .filter(conv => conv.is_direct)
-                .map(conv => ({
-                    id: conv.user_id,
-                    name: conv.name
-                }));
-            
-            // Populate member checkboxes
-            const membersContainer = document.getElementById('group-members');
-            membersContainer.innerHTML = '';
-            
-            users.forEach(user => {
-                const checkbox = document.createElement('div');
-                checkbox.className = 'checkbox-group';
-                
-                const input = document.createElement('input');
-                input.type = 'checkbox';
-                input.name = 'members';
-                input.value = user.id;
-                input.id = `member-${user.id}`;
-                
-                const label = document.createElement('label');
-                label.htmlFor = `member-${user.id}`;
-                label.textContent = user.name;
-                
-                checkbox.appendChild(input);
-                checkbox.appendChild(label);
-                membersContainer.appendChild(checkbox);
-            });
-        })
-        .catch(error => console.error('Error loading users:', error));
+    const searchInput = document.getElementById('group-member-search');
+    if (!groupMemberSearch) {
+        groupMemberSearch = attachUserSearch(searchInput, renderGroupMemberResults);
+    }
+    searchInput.value = '';
+    document.getElementById('group-member-results').innerHTML = '';
+    
+    // Offer the people the user already has direct chats with; anyone else
+    // can be found through the search box
+    document.getElementById('group-members').innerHTML = '';
+    conversations.forEach(conv => {
+        if (conv.is_direct) {
+            addGroupMemberOption({ id: conv.user_id, username: conv.name }, false);
+        }
+    });
+}
+
+function renderChatUserResults(page, query) {
+    const userSelect = document.getElementById('chat-user');
+    if (query !== null) {
+        // A new search replaces the list; "More results" passes null to append
+        chatUserQuery = query;
+        userSelect.innerHTML = '';
+    }
+    
+    page.users.forEach(user => {
+        const option = document.createElement('option');
+        option.value = user.id;
+        option.textContent = user.username;
+        userSelect.appendChild(option);
+    });
+    
+    chatUserNextAfter = page.next_after;
+    document.getElementById('chat-user-more').style.display = page.has_more ? 'inline-block' : 'none';
 }
 
-// Open new direct chat modal
+// Open new direct chat modal. Picking someone who already has a direct chat
+// with the user opens that chat.
 function openNewChatModal() {
     document.getElementById('new-chat-modal').style.display = 'block';
     
-    // Load users not in direct chats already
-    fetch('/api/conversations')
-        .then(response => response.json())
-        .then(data => {
-            // Get IDs of users already in direct chats
-            const existingUserIds = data
-                .filter(conv => conv.is_direct)
-                .map(conv => conv.user_id);
-            
-            // Fetch all users
-            fetch('/api/users')
-                .then(response => response.json())
-                .then(users => {
-                    // Filter out users already in direct chats
-                    const newUsers = users.filter(user => 
-                        user.id !== currentUserId && !existingUserIds.includes(user.id)
-                    );
-                    
-                    // Populate user select dropdown
-                    const userSelect = document.getElementById('chat-user');
-                    userSelect.innerHTML = '';
-                    
-                    newUsers.forEach(user => {
-                        const option = document.createElement('option');
-                        option.value = user.id;
-                        option.textContent = user.username;
-                        userSelect.appendChild(option);
-                    });
-                })
-                .catch(error => console.error('Error loading all users:', error));
-        })
-        .catch(error => console.error('Error loading conversations:', error));
+    const searchInput = document.getElementById('chat-user-search');
+    if (!chatUserSearch) {
+        chatUserSearch = attachUserSearch(searchInput, renderChatUserResults);
+        document.getElementById('chat-user-more').addEventListener('click', () => {
+            searchUsers(chatUserQuery, chatUserNextAfter)
+                .then(page => renderChatUserResults(page, null))
+                .catch(error => console.error('Error searching users:', error));
+        });
+    }
+    searchInput.value = '';
+    chatUserSearch();
+    searchInput.focus();
 }
 
 // Close all modals
@@ -439,8 +694,17 @@ function createNewGroup() {
         // Close modal
         closeModals();
         
-        // Reload conversations
-        loadConversations();
+        // The sidebar gets the group from conversation_updated; show it now
+        // in case the response arrived first
+        if (!conversations.has(data.id)) {
+            applyConversationUpdate({
+                id: data.id,
+                name: data.name,
+                is_direct: false,
+                description: data.description,
+                unread_count: 0
+            });
+        }
         
         // Reset form
         document.getElementById('create-group-form').reset();
@@ -456,13 +720,26 @@ function startDirectChat() {
     
     // Start direct chat via API
     fetch(`/api/start_direct_chat/${userId}`)
-        .then(response => response.json())
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`start_direct_chat returned ${response.status}`);
+            }
+            return response.json();
+        })
         .then(data => {
             // Close modal
             closeModals();
             
-            // Reload conversations
-            loadConversations();
+            // A new chat also comes in a conversation_updated, maybe later
+            if (!conversations.has(data.id)) {
+                applyConversationUpdate({
+                    id: data.id,
+                    name: data.name,
+                    is_direct: true,
+                    user_id: data.user_id,
+                    unread_count: 0
+                });
+            }
             
             // Open the new chat
             openChat(data.id, data.name, true);
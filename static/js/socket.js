@@ -1,10 +1,43 @@
 // Socket.IO handler
 const socket = io();
 
+// Events sent to this user's room carry a per-user sequence number. After a
+// reconnect the last one applied goes to the server in a sync event, which
+// answers with just the missed events, or with a reset if they are no longer
+// kept and the chat state has to be reloaded. The conversation updates of new
+// messages are not sequenced; missed messages are counted from the newest
+// message id seen instead.
+let lastEventSeq = null;
+let lastMessageId = null;
+let syncInFlight = false;
+let syncAgain = false;
+let hasConnected = false;
+// Message updates received while a sync is in flight, which it may count again
+let notifiedDuringSync = [];
+
 // Connection events
 socket.on('connect', () => {
     console.log('Connected to server');
     updateConnectionStatus(true);
+    
+    if (!hasConnected) {
+        // The page has just loaded its state; only the current seq is needed
+        hasConnected = true;
+        syncEvents();
+        return;
+    }
+    
+    // Rooms do not survive a reconnect
+    if (currentGroupId) {
+        socket.emit('join_room', { room: `group_${currentGroupId}` });
+    }
+    syncEvents();
+    if (lastEventSeq === null) {
+        // Never synced, so there is nothing to replay from
+        reloadChatState();
+    } else {
+        catchUpMessages();
+    }
 });
 
 socket.on('disconnect', () => {
@@ -12,6 +45,14 @@ socket.on('disconnect', () => {
     updateConnectionStatus(false);
 });
 
+// Keep this connection counted as online
+const PRESENCE_HEARTBEAT_INTERVAL = 25000;
+setInterval(() => {
+    if (socket.connected) {
+        socket.emit('presence_heartbeat');
+    }
+}, PRESENCE_HEARTBEAT_INTERVAL);
+
 // Join a chat room
 function joinChatRoom(groupId) {
     // Leave current room if any
@@ -28,61 +69,203 @@ function joinChatRoom(groupId) {
 function sendMessage(content) {
     if (!currentGroupId || !content.trim()) return;
     
+    // The server acknowledges once the message is stored
     socket.emit('send_message', {
         group_id: currentGroupId,
         content: content
+    }, (ack) => {
+        if (ack && ack.status === 'pending') {
+            // Slow to store but not lost; sending again would duplicate it
+            console.warn('Message is still being stored');
+        } else if (!ack || ack.status !== 'ok') {
+            console.error('Message was not sent:', ack && ack.error);
+        }
     });
     
     // Clear input after sending
     document.getElementById('message-input').value = '';
 }
 
-// Mark message as read
-function markMessageAsRead(messageId) {
-    socket.emit('mark_read', {
-        message_id: messageId
+// Read receipts are batched: only the newest message read per group is sent
+const READ_RECEIPT_DELAY = 300;
+const pendingReadUpto = {};
+let readReceiptTimer = null;
+
+// Mark a group as read up to and including a message
+function markMessageAsRead(groupId, messageId) {
+    if (!pendingReadUpto[groupId] || pendingReadUpto[groupId] < messageId) {
+        pendingReadUpto[groupId] = messageId;
+    }
+    
+    if (!readReceiptTimer) {
+        readReceiptTimer = setTimeout(flushReadReceipts, READ_RECEIPT_DELAY);
+    }
+}
+
+// Send one mark_read_upto per group for everything read since the last flush
+function flushReadReceipts() {
+    readReceiptTimer = null;
+    
+    Object.keys(pendingReadUpto).forEach(groupId => {
+        socket.emit('mark_read_upto', {
+            group_id: parseInt(groupId),
+            message_id: pendingReadUpto[groupId]
+        });
+        delete pendingReadUpto[groupId];
     });
 }
 
 // Listen for new messages
 socket.on('new_message', (message) => {
-    // Check if message belongs to current group
+    noteMessageId(message.id);
+    
+    // Check if message belongs to current group; the sidebar is updated
+    // by the conversation_updated every member gets
     if (message.group_id === currentGroupId) {
         appendMessage(message);
         
         // If message is not from current user, mark as read
         if (message.sender_id !== currentUserId) {
-            markMessageAsRead(message.id);
+            markMessageAsRead(message.group_id, message.id);
         }
-    } else {
-        // Update unread count for the conversation
-        updateUnreadCountForGroup(message.group_id);
     }
 });
 
-// Listen for message notifications
-socket.on('message_notification', (notification) => {
+// A new message in one of the user's conversations
+function receiveMessageUpdate(update) {
+    noteMessageId(update.last_message_id);
+    
+    const conversation = conversations.get(update.id);
+    // Already shown, by a sync or the initial load
+    if (!conversation || conversation.last_message_id >= update.last_message_id) return;
+    applyConversationUpdate(update);
+    if (update.last_sender_id === currentUserId) return;
+    
+    if (syncInFlight) {
+        notifiedDuringSync.push(update);
+    }
+    
     // Show desktop notification if permission granted
     if (Notification.permission === "granted") {
-        new Notification("New message from " + notification.sender_name, {
-            body: notification.content_preview
+        const content = update.last_message;
+        new Notification("New message from " + update.last_sender_name, {
+            body: content.length > 30 ? content.slice(0, 30) + '...' : content
         });
     }
     
-    // Update UI unread counter
-    updateUnreadCountForGroup(notification.group_id);
-});
+    // The open chat is read as it arrives
+    if (update.id !== currentGroupId) {
+        updateUnreadCountForGroup(update.id);
+    }
+}
 
-// Listen for status changes
-socket.on('status_change', (data) => {
-    updateUserStatus(data.user_id, data.status);
-});
+function noteMessageId(messageId) {
+    if (lastMessageId !== null && messageId > lastMessageId) {
+        lastMessageId = messageId;
+    }
+}
+
+// Handlers of the sequenced user-room events
+const userEventHandlers = {
+    // Conversations joined and read elsewhere
+    conversation_updated: (update) => {
+        applyConversationUpdate(update);
+    },
+    
+    // Presence changes of people sharing a conversation, batched by the server
+    presence_diff: (data) => {
+        data.changes.forEach(change => updateUserStatus(change.user_id, change.status));
+    },
+    
+    // Read receipts
+    message_read: (data) => {
+        updateMessageReadStatus(data.group_id, data.message_id, data.reader_name);
+    }
+};
 
-// Listen for read receipts
-socket.on('message_read', (data) => {
-    updateMessageReadStatus(data.message_id, data.reader_name);
+Object.keys(userEventHandlers).forEach(name => {
+    socket.on(name, (data) => receiveUserEvent(name, data));
 });
 
+// Apply live events in sequence; a gap means something was missed
+function receiveUserEvent(name, data) {
+    if (name === 'conversation_updated' && data.seq === undefined) {
+        receiveMessageUpdate(data);
+    } else if (lastEventSeq === null) {
+        userEventHandlers[name](data);
+    } else if (data.seq === lastEventSeq + 1) {
+        lastEventSeq = data.seq;
+        userEventHandlers[name](data);
+    } else if (data.seq > lastEventSeq) {
+        // The sync replays this event too, in order
+        syncEvents();
+    }
+}
+
+// Ask the server for the events after the last one applied
+function syncEvents() {
+    if (syncInFlight) {
+        syncAgain = true;
+        return;
+    }
+    syncInFlight = true;
+    notifiedDuringSync = [];
+    const sentMessageId = lastMessageId;
+    
+    socket.emit('sync', { seq: lastEventSeq, message_id: sentMessageId }, (result) => {
+        syncInFlight = false;
+        if (!result || result.status !== 'ok') {
+            console.error('Sync failed:', result && result.error);
+        } else if (result.reset) {
+            lastEventSeq = result.seq;
+            lastMessageId = result.message_id;
+            reloadChatState();
+        } else {
+            if (lastEventSeq !== null) {
+                result.events.forEach(entry => {
+                    // Live events may have been applied while the sync was in
+                    // flight; events no longer handled, logged before an
+                    // upgrade, are skipped
+                    if (entry.seq > lastEventSeq) {
+                        lastEventSeq = entry.seq;
+                        if (userEventHandlers[entry.event]) {
+                            userEventHandlers[entry.event](entry.data);
+                        }
+                    }
+                });
+            }
+            lastEventSeq = Math.max(lastEventSeq || 0, result.seq);
+            
+            (result.messages || []).forEach(missed => {
+                const conversation = conversations.get(missed.group_id);
+                if (!conversation) return;
+                if (!(conversation.last_message_id >= missed.last_message_id)) {
+                    const { group_id, count, ...fields } = missed;
+                    applyConversationUpdate({ id: group_id, ...fields });
+                }
+                
+                // The open chat fetches its new messages itself
+                if (missed.group_id === currentGroupId) return;
+                const counted = notifiedDuringSync.filter(update =>
+                    update.id === missed.group_id &&
+                    update.last_message_id > sentMessageId &&
+                    update.last_message_id <= result.message_id
+                ).length;
+                if (missed.count > counted) {
+                    updateUnreadCountForGroup(missed.group_id, missed.count - counted);
+                }
+            });
+            lastMessageId = Math.max(lastMessageId || 0, result.message_id);
+        }
+        notifiedDuringSync = [];
+        
+        if (syncAgain) {
+            syncAgain = false;
+            syncEvents();
+        }
+    });
+}
+
 // Update connection status in UI
 function updateConnectionStatus(connected) {
     const statusElement = document.getElementById('connection-status');
@@ -0,0 +1,88 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from app import db
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Storage profiles are picked from the DATABASE_URL scheme.
+#
+# sqlite:     WAL journal with synchronous=NORMAL, memory-mapped reads and a
+#             busy timeout. Read-heavy endpoints use a separate pool of
+#             read-only connections (the "reader" bind) so they never queue
+#             behind the writer.
+# postgresql: sized connection pool with pre-ping and recycling, and a
+#             server-side statement timeout on every connection.
+
+def configure_storage(app):
+    """Fill in the SQLAlchemy configuration for the selected storage profile.
+
+    Must run before db.init_app(app).
+    """
+    url = app.config['DATABASE_URL']
+    # Hosting providers still hand out the scheme SQLAlchemy 1.4 dropped
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        _configure_sqlite(app, make_url(url))
+    elif backend == 'postgresql':
+        _configure_postgresql(app)
+    app.config['STORAGE_PROFILE'] = backend
+
+def _configure_sqlite(app, url):
+    busy_timeout = app.config['SQLITE_BUSY_TIMEOUT']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'connect_args': {'timeout': busy_timeout / 1000.0}
+    }
+
+    # In-memory databases exist per connection, so they cannot have readers
+    if url.database in (None, '', ':memory:'):
+        return
+    database = url.database[len('file:'):] if url.query.get('uri') else url.database
+    app.config.setdefault('SQLALCHEMY_BINDS', {})['reader'] = {
+        'url': url.set(database=f"file:{database}", query={'mode': 'ro', 'uri': 'true'}),
+        'pool_size': app.config['SQLITE_READER_POOL_SIZE'],
+        'connect_args': {'timeout': busy_timeout / 1000.0}
+    }
+
+def _configure_postgresql(app):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'connect_args': {
+            'options': f"-c statement_timeout={app.config['DB_STATEMENT_TIMEOUT']}"
+        }
+    }
+
+def init_storage(app):
+    """Attach per-connection settings to the engines. Must run after db.init_app(app)."""
+    with app.app_context():
+        if app.config['STORAGE_PROFILE'] != 'sqlite':
+            return
+        pragmas = {
+            'busy_timeout': app.config['SQLITE_BUSY_TIMEOUT'],
+            'synchronous': 'NORMAL',
+            'mmap_size': app.config['SQLITE_MMAP_SIZE']
+        }
+        _apply_pragmas(db.engine, dict(pragmas, journal_mode='WAL'))
+        if 'reader' in db.engines:
+            _apply_pragmas(db.engines['reader'], pragmas)
+
+def _apply_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def read_engine():
+    """Engine for read-only queries; the writer engine when there is no reader pool"""
+    return db.engines.get('reader', db.engine)
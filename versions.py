@@ -0,0 +1,115 @@
+from sqlalchemy import select, func, or_, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session, configure_mappers
+from app import db
+from models import User, Group, user_group, version_counter
+
+# Version counters back the ETags of the chat JSON APIs. Every write that
+# changes what an endpoint returns bumps a counter in the same transaction,
+# so checking whether a client's copy is current costs one indexed lookup
+# instead of rebuilding the response.
+#
+# group:     messages and, for direct chats, the other member's presence;
+#            covers /api/messages/<id> and the group's row in
+#            /api/conversations. Read cursors are not counted here: they
+#            only move forward, so the endpoints tag the cursors they show
+#            directly and a reader opening a chat doesn't stale its own tag
+# user:      the set of groups a user belongs to
+# directory: users joining and presence changes, for /api/users
+
+def bump_versions(conn, groups=(), users=(), directory=False):
+    """Increment the counters of the given groups and users.
+
+    conn is a Session or Connection inside the writing transaction.
+    """
+    rows = [{'scope': 'group', 'key': group_id, 'version': 1} for group_id in set(groups)]
+    rows += [{'scope': 'user', 'key': user_id, 'version': 1} for user_id in set(users)]
+    if directory:
+        rows.append({'scope': 'directory', 'key': 0, 'version': 1})
+    if rows:
+        conn.execute(_bump_statement(), rows)
+
+def _bump_statement():
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    insert = dialect.insert(version_counter)
+    return insert.on_conflict_do_update(
+        index_elements=[version_counter.c.scope, version_counter.c.key],
+        set_={'version': version_counter.c.version + 1}
+    )
+
+def bump_direct_chats_of(conn, user_ids):
+    """Bump the direct chats of users whose presence changed"""
+    user_ids = list(user_ids)
+    group_ids = []
+    for start in range(0, len(user_ids), 400):
+        chunk = user_ids[start:start + 400]
+        group_ids += conn.execute(
+            select(Group.id).where(or_(
+                Group.dm_low_user_id.in_(chunk),
+                Group.dm_high_user_id.in_(chunk)
+            ))
+        ).scalars().all()
+    bump_versions(conn, groups=group_ids, directory=True)
+
+def _version(conn, scope, key):
+    return conn.execute(
+        select(version_counter.c.version).where(
+            version_counter.c.scope == scope,
+            version_counter.c.key == key
+        )
+    ).scalar() or 0
+
+def group_version(conn, group_id):
+    return _version(conn, 'group', group_id)
+
+def directory_version(conn):
+    return _version(conn, 'directory', 0)
+
+def conversations_version(conn, user_id):
+    """Version of a user's conversation list, as a string.
+
+    Counters only grow, so the sum over the user's groups changes whenever
+    any of them is bumped; the user counter covers joining and leaving. The
+    user's read cursors only grow too, and their sum covers unread counts.
+    """
+    total, groups, read = conn.execute(
+        select(func.coalesce(func.sum(version_counter.c.version), 0), func.count(),
+               func.coalesce(func.sum(user_group.c.last_read_message_id), 0))
+        .select_from(user_group)
+        .outerjoin(version_counter, (version_counter.c.scope == 'group')
+                   & (version_counter.c.key == user_group.c.group_id))
+        .where(user_group.c.user_id == user_id)
+    ).one()
+    return f"{_version(conn, 'user', user_id)}.{groups}.{total}.{read}"
+
+# Membership changes made through the Group.members / User.groups
+# relationships bump the member's counter when the session commits. Code
+# that writes user_group directly must call bump_versions() itself.
+configure_mappers()
+
+def _membership_changed(user):
+    # Ids are read at commit time; loading them here could autoflush
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault('version_users', set()).add(user)
+
+@event.listens_for(Group.members, 'append')
+@event.listens_for(Group.members, 'remove')
+def _group_members_changed(group, user, initiator):
+    _membership_changed(user)
+
+@event.listens_for(User.groups, 'append')
+@event.listens_for(User.groups, 'remove')
+def _user_groups_changed(user, group, initiator):
+    _membership_changed(user)
+
+@event.listens_for(Session, 'before_commit')
+def _bump_membership_versions(session):
+    users = session.info.pop('version_users', None)
+    if users:
+        session.flush()
+        bump_versions(session, users=[user.id for user in users])
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_membership_versions(session, previous_transaction):
+    session.info.pop('version_users', None)